@@ -0,0 +1,156 @@
+"""
+Approximate nearest-neighbor search over the catalog (inverted file index).
+
+Catalog features are scaled once over the whole catalog and partitioned into
+k-means cells. A query scans only the cells closest to it, applying the
+ownership and price filters to the scanned rows before measuring distances.
+
+The search mode is chosen per deployment with BOB_KNN_INDEX:
+    exact  fit NearestNeighbors over the filtered candidates per request (default)
+    ivf    search the prebuilt inverted file index
+"""
+import os
+import time
+import logging
+import numpy as np
+import pandas as pd
+from typing import Optional, Tuple
+from sklearn.cluster import MiniBatchKMeans
+from bottle_dataset import register_catalog_artifact, get_catalog_artifact
+from features import build_user_vector, encode_bottle_features, min_max_scale
+from models import UserPreferences
+
+logger = logging.getLogger(__name__)
+
+KNN_INDEX_MODES = ('exact', 'ivf')
+KNN_INDEX_MODE = os.environ.get('BOB_KNN_INDEX', 'exact').lower()
+if KNN_INDEX_MODE not in KNN_INDEX_MODES:
+    logger.warning(f"Unknown BOB_KNN_INDEX '{KNN_INDEX_MODE}', using exact search")
+    KNN_INDEX_MODE = 'exact'
+
+# Cells probed per query; more cells trade speed for recall
+DEFAULT_NPROBE = int(os.environ.get('BOB_IVF_NPROBE', 16))
+
+def default_num_cells(num_rows: int) -> int:
+    """About sqrt(n) cells, the usual IVF sizing"""
+    return int(min(max(1, round(np.sqrt(num_rows))), 4096))
+
+class IVFIndex:
+    """
+    Inverted file index over globally scaled catalog features.
+
+    Rows are stored grouped by cell, so scanning a cell reads contiguous
+    memory. MSRP is kept alongside for filtering without touching the catalog.
+
+    Attributes:
+        feature_columns: Feature space of the index
+        feature_min, feature_spread: Scaling parameters of that feature space
+        centroids: float32 array of shape (num_cells, num_features)
+        cell_ptr: Start offset of each cell in the row arrays (num_cells + 1)
+        rows: Catalog row of each stored vector, grouped by cell
+        vectors: float32 scaled features in the same order
+        msrp: float32 MSRP in the same order
+    """
+
+    def __init__(self, df: pd.DataFrame, num_cells: Optional[int] = None, seed: int = 0):
+        started = time.perf_counter()
+        X_raw, self.feature_columns = encode_bottle_features(df)
+        X, self.feature_min, self.feature_spread = min_max_scale(X_raw)
+        X = X.astype(np.float32)
+        num_cells = min(num_cells or default_num_cells(len(X)), max(len(X), 1))
+
+        kmeans = MiniBatchKMeans(n_clusters=num_cells, random_state=seed, n_init=1,
+                                 batch_size=min(len(X), 10 * num_cells + 1024))
+        assignment = kmeans.fit_predict(X) if len(X) else np.zeros(0, dtype=np.int64)
+        self.centroids = kmeans.cluster_centers_.astype(np.float32) if len(X) else X[:0]
+
+        order = np.argsort(assignment, kind='stable')
+        self.cell_ptr = np.zeros(num_cells + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=num_cells), out=self.cell_ptr[1:])
+        self.rows = order.astype(np.int32)
+        self.vectors = np.ascontiguousarray(X[order])
+        self.msrp = pd.to_numeric(df['msrp'], errors='coerce').to_numpy(dtype=np.float32)[order]
+        self._centroid_norms = (self.centroids ** 2).sum(axis=1)
+        self._position_of_row = np.empty(len(order), dtype=np.int64)
+        self._position_of_row[order] = np.arange(len(order))
+        logger.info(f"Built IVF index with {num_cells} cells over {len(X)} bottles "
+                    f"in {time.perf_counter() - started:.2f}s")
+
+    @property
+    def num_cells(self) -> int:
+        return len(self.centroids)
+
+    def query_vector(self, preferences: UserPreferences) -> np.ndarray:
+        """A user's preference vector in the index's scaled feature space"""
+        user_vector = build_user_vector(self.feature_columns, preferences)
+        return ((user_vector - self.feature_min) / self.feature_spread).astype(np.float32)
+
+    def distances(self, query: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Exact euclidean distances from a query vector to the given catalog rows"""
+        vectors = self.vectors[self._position_of_row[rows]]
+        return np.sqrt(((vectors - np.asarray(query, dtype=np.float32).ravel()) ** 2).sum(axis=1))
+
+    def search(self, query: np.ndarray, k: int, nprobe: Optional[int] = None,
+               price_range: Optional[Tuple[float, float]] = None,
+               exclude_rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Finds approximately the k nearest catalog rows to a query vector.
+
+        Filters are applied to the rows of the probed cells before distances
+        are computed. When too few rows survive them, the probe widens to
+        twice as many cells until k rows are found or every cell was scanned.
+
+        Args:
+            query: Scaled query vector
+            k: Number of neighbors
+            nprobe: Cells to scan (defaults to DEFAULT_NPROBE)
+            price_range: Optional inclusive (min, max) MSRP
+            exclude_rows: Catalog rows that must not be returned (e.g. owned bottles)
+
+        Returns:
+            Tuple of (catalog rows, euclidean distances), nearest first
+        """
+        if k <= 0 or not len(self.rows):
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        query = np.asarray(query, dtype=np.float32).ravel()
+        # Squared distance up to the constant |q|^2, enough for ranking cells
+        cell_order = np.argsort(self._centroid_norms - 2 * self.centroids @ query, kind='stable')
+        nprobe = min(nprobe or DEFAULT_NPROBE, self.num_cells)
+
+        scanned = 0
+        found_rows, found_dist = [], []
+        while True:
+            cells = cell_order[scanned:nprobe]
+            scanned = nprobe
+            positions = np.concatenate([np.arange(self.cell_ptr[c], self.cell_ptr[c + 1]) for c in cells])
+            keep = np.ones(len(positions), dtype=bool)
+            if price_range is not None:
+                msrp = self.msrp[positions]
+                keep &= (msrp >= price_range[0]) & (msrp <= price_range[1])
+            if exclude_rows is not None and len(exclude_rows):
+                keep &= ~np.isin(self.rows[positions], exclude_rows)
+            positions = positions[keep]
+            if len(positions):
+                found_rows.append(self.rows[positions])
+                found_dist.append(np.sqrt(((self.vectors[positions] - query) ** 2).sum(axis=1)))
+            total = sum(len(rows) for rows in found_rows)
+            if total >= k or nprobe >= self.num_cells:
+                break
+            nprobe = min(nprobe * 2, self.num_cells)
+
+        if not found_rows:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        rows = np.concatenate(found_rows)
+        distances = np.concatenate(found_dist)
+        if len(rows) > k:
+            top = np.argpartition(distances, k - 1)[:k]
+            rows, distances = rows[top], distances[top]
+        order = np.argsort(distances, kind='stable')
+        return rows[order], distances[order]
+
+# Built with the catalog when the deployment uses it, never otherwise
+register_catalog_artifact('ivf_index', IVFIndex, eager=KNN_INDEX_MODE == 'ivf')
+
+def get_ivf_index() -> IVFIndex:
+    """The IVF index for the currently loaded catalog"""
+    return get_catalog_artifact('ivf_index')
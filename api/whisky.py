@@ -1,11 +1,43 @@
 """
 Simplified API endpoint for Bob the Whisky Expert on Vercel
+
+Vercel keeps a function instance for consecutive invocations while it is warm
+and starts a fresh one (a cold start) otherwise. The expensive parts of a chat
+request therefore belong to the instance and are set up once, by its first
+invocation or ahead of traffic by /api/warmup:
+
+    chat cache   replies loaded from a local JSON snapshot
+                 (BOB_CHAT_CACHE_SNAPSHOT, or the read-only BOB_CHAT_CACHE_SEED
+                 shipped with the deployment when that doesn't exist yet) and
+                 written back at the end of an invocation, at most every
+                 BOB_CHAT_SNAPSHOT_INTERVAL seconds. /tmp is private to an
+                 instance, so the seed is what a fresh instance starts from
+    OpenAI       one client, and so one pool of HTTP connections, per instance
+    catalog      the search index behind rule-based answers and prompt grounding
+
+Every response says whether its instance was cold (X-Bob-Instance) and where
+the time went (Server-Timing: import on a cold start, init, handler).
+`python -m benchmarks.cold_start` runs this handler in fresh processes to
+compare cold and warm invocations locally.
+
+Usage:
+    # Build the seed before deploying: answer the listed opening questions
+    # as /api/chat would (needs OPENAI_API_KEY) and keep an earlier seed's replies
+    python -m api.whisky export-seed data/chat_cache_seed.json --questions questions.txt \
+        --include data/chat_cache_seed.json
 """
+import time
+
+IMPORT_STARTED = time.perf_counter()
+
 import os
 import sys
 import json
 import logging
-from flask import Flask, jsonify, request
+import argparse
+import threading
+from typing import Dict, Any, Iterable, List
+from flask import Flask, g, jsonify, request
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -14,18 +46,136 @@ logger = logging.getLogger(__name__)
 # Add parent directory to path so we can import our modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+# Writable cache snapshot (Vercel only allows writes under /tmp) and an optional read-only seed
+CHAT_CACHE_SNAPSHOT = os.environ.get('BOB_CHAT_CACHE_SNAPSHOT', '/tmp/bob_chat_cache.json')
+CHAT_CACHE_SEED = os.environ.get('BOB_CHAT_CACHE_SEED', '')
+# Minimum seconds between snapshot writes (0 writes after every new reply)
+CHAT_SNAPSHOT_INTERVAL = float(os.environ.get('BOB_CHAT_SNAPSHOT_INTERVAL', 10))
+
 # Create a simple API app
 app = Flask(__name__)
 
 try:
     # Import our chat functionality
-    from bob_chat import chat_with_bob, add_to_cache, get_rule_based_response
+    from bob_chat import chat_with_bob, add_to_cache, get_rule_based_response, get_openai_client, response_cache
+    from catalog_search import get_catalog_search_index
     logger.info("Successfully imported whisky chat modules")
     CHAT_AVAILABLE = True
 except Exception as e:
     logger.error(f"Error importing chat modules: {str(e)}")
     CHAT_AVAILABLE = False
 
+# Milliseconds spent importing this module, paid once per cold start
+IMPORT_MS = (time.perf_counter() - IMPORT_STARTED) * 1000
+
+class InstanceState:
+    """What this function instance has set up, and how long that took"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.invocations = 0
+        self.initialized = False
+        # Milliseconds per initialization step
+        self.init_ms: Dict[str, float] = {}
+        self.snapshot_entries = 0
+        self._saved_changes = 0
+        self._saved_at = float('-inf')
+        self._lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+
+    def begin_invocation(self) -> bool:
+        """Count an invocation; returns whether it is the instance's first (cold) one"""
+        with self._lock:
+            self.invocations += 1
+            return self.invocations == 1
+
+    def initialize(self) -> float:
+        """Set up the chat cache, OpenAI client and catalog once; returns the ms spent now"""
+        if self.initialized:
+            return 0.0
+        with self._lock:
+            if self.initialized:
+                return 0.0
+            started = time.perf_counter()
+            for step, setup in (('chat_cache', self._load_snapshot),
+                                ('openai_client', get_openai_client),
+                                ('catalog', get_catalog_search_index)):
+                step_started = time.perf_counter()
+                try:
+                    setup()
+                except Exception as e:
+                    logger.warning(f"Instance setup step {step} failed: {str(e)}")
+                self.init_ms[step] = (time.perf_counter() - step_started) * 1000
+            self._saved_changes = response_cache.changes
+            self.initialized = True
+            return (time.perf_counter() - started) * 1000
+
+    def _load_snapshot(self) -> None:
+        for path in (CHAT_CACHE_SNAPSHOT, CHAT_CACHE_SEED):
+            if path and os.path.exists(path):
+                self.snapshot_entries = response_cache.load(path)
+                logger.info(f"Loaded {self.snapshot_entries} cached chat replies from {path}")
+                return
+
+    def save_snapshot(self) -> bool:
+        """
+        Write the chat cache back if it changed. Writes are at least
+        BOB_CHAT_SNAPSHOT_INTERVAL seconds apart: replies cached sooner are
+        written by the first invocation to end after the interval. Vercel
+        freezes an instance between invocations, so a background timer
+        couldn't be relied on to write them.
+
+        Returns:
+            Whether it wrote now
+        """
+        with self._snapshot_lock:
+            if not CHAT_CACHE_SNAPSHOT or response_cache.changes == self._saved_changes:
+                return False
+            if time.monotonic() - self._saved_at < CHAT_SNAPSHOT_INTERVAL:
+                return False
+            changes = response_cache.changes
+            try:
+                response_cache.save(CHAT_CACHE_SNAPSHOT)
+            except OSError as e:
+                logger.warning(f"Could not write the chat cache snapshot: {str(e)}")
+                return False
+            self._saved_changes, self._saved_at = changes, time.monotonic()
+            return True
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "uptime_s": round(time.time() - self.started_at, 3),
+            "invocations": self.invocations,
+            "initialized": self.initialized,
+            "import_ms": round(IMPORT_MS, 2),
+            "init_ms": {step: round(ms, 2) for step, ms in self.init_ms.items()},
+            "snapshot_entries": self.snapshot_entries,
+            "cache_entries": len(response_cache) if CHAT_AVAILABLE else 0,
+        }
+
+instance = InstanceState()
+
+@app.before_request
+def start_invocation():
+    g.started = time.perf_counter()
+    g.cold = instance.begin_invocation()
+    g.init_ms = 0.0
+
+@app.after_request
+def report_timings(response):
+    """Mark cold invocations, break down their time in Server-Timing and write the chat cache back"""
+    if instance.initialized:
+        # Before the response is sent: the instance may be frozen right after
+        instance.save_snapshot()
+    handler_ms = (time.perf_counter() - g.started) * 1000 - g.init_ms
+    timings = [f"import;dur={IMPORT_MS:.1f}"] if g.cold else []
+    timings += [f"init;dur={g.init_ms:.1f}", f"handler;dur={handler_ms:.1f}"]
+    response.headers['X-Bob-Instance'] = 'cold' if g.cold else 'warm'
+    response.headers['Server-Timing'] = ', '.join(timings)
+    logger.info(f"{request.path} on a {'cold' if g.cold else 'warm'} instance: "
+                f"init {g.init_ms:.1f} ms, handler {handler_ms:.1f} ms")
+    return response
+
 @app.route('/api/chat', methods=['POST'])
 def chat_api():
     """Simple API endpoint for chatting with Bob"""
@@ -34,34 +184,37 @@ def chat_api():
             "error": "Chat functionality not available",
             "message": "The chat service is currently unavailable"
         }), 503
-    
+
     try:
         data = request.json
         if not data or not data.get('message'):
             return jsonify({"error": "Missing message"}), 400
-        
+
         # Check for API key
         if not os.environ.get("OPENAI_API_KEY"):
             return jsonify({
                 "response": "I apologize, but I'm not available right now. The API key is missing. Please contact the administrator.",
                 "error": "api_key_missing"
             }), 503
-        
+
+        g.init_ms = instance.initialize()
+
         # Create simple message format
         message = data.get('message')
         username = data.get('username')
-        
-        # Try rule-based response first
-        rule_response = get_rule_based_response(message)
+
+        # Try a canned answer for a common topic first; catalog matches are
+        # only the fallback while OpenAI is unavailable
+        rule_response = get_rule_based_response(message, catalog=False)
         if rule_response:
             return jsonify({"response": rule_response})
-        
+
         # Use chat function with minimal context
         messages = [{"role": "user", "content": message}]
         response = chat_with_bob(messages, username)
-        
+
         return jsonify({"response": response})
-    
+
     except Exception as e:
         logger.exception(f"Error in chat API: {str(e)}")
         return jsonify({
@@ -69,6 +222,14 @@ def chat_api():
             "message": "An error occurred processing your request"
         }), 500
 
+@app.route('/api/warmup', methods=['GET', 'POST'])
+def warmup():
+    """Set up the instance ahead of traffic (e.g. from a cron job) and report what it cost"""
+    if not CHAT_AVAILABLE:
+        return jsonify({"status": "error", "message": "The chat service is currently unavailable"}), 503
+    g.init_ms = instance.initialize()
+    return jsonify({"status": "warm", "cold": g.cold, "instance": instance.describe()})
+
 @app.route('/api/status', methods=['GET'])
 def status():
     """Status endpoint"""
@@ -76,9 +237,30 @@ def status():
         "status": "ok",
         "service": "Bob the Whisky Expert API",
         "chat_available": CHAT_AVAILABLE,
-        "openai_configured": bool(os.environ.get("OPENAI_API_KEY"))
+        "openai_configured": bool(os.environ.get("OPENAI_API_KEY")),
+        "instance": instance.describe()
     })
 
+def export_seed(path: str, questions: Iterable[str] = (), include: Iterable[str] = ()) -> int:
+    """
+    Writes a chat cache seed for BOB_CHAT_CACHE_SEED from this process's
+    ConversationCache.
+
+    Args:
+        path: Seed file to write
+        questions: Opening questions to answer as /api/chat does (canned topics are skipped)
+        include: Earlier seeds or snapshots whose replies are kept
+
+    Returns:
+        Number of replies written
+    """
+    for snapshot in include:
+        logger.info(f"Including {response_cache.load(snapshot)} replies from {snapshot}")
+    for question in questions:
+        if get_rule_based_response(question, catalog=False) is None:
+            chat_with_bob([{"role": "user", "content": question}])
+    return response_cache.save(path)
+
 # Default route
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
@@ -87,4 +269,29 @@ def catch_all(path):
     return jsonify({
         "error": "not_found",
         "message": f"Endpoint '{path}' not found. Use /api/chat for chat functionality."
-    }), 404
\ No newline at end of file
+    }), 404
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Vercel chat handler tools")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    seed_parser = subparsers.add_parser('export-seed', help="Write the chat cache seed shipped as BOB_CHAT_CACHE_SEED")
+    seed_parser.add_argument('output')
+    seed_parser.add_argument('--questions', help="File of opening questions to answer, one per line")
+    seed_parser.add_argument('--include', action='append', default=[],
+                             help="Seed or snapshot whose replies to keep (repeatable)")
+    args = parser.parse_args(argv)
+
+    if not CHAT_AVAILABLE:
+        return 1
+    questions = []
+    if args.questions:
+        with open(args.questions, encoding='utf-8') as f:
+            questions = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    if questions and not os.environ.get("OPENAI_API_KEY"):
+        parser.error("answering questions needs OPENAI_API_KEY")
+    written = export_seed(args.output, questions, args.include)
+    print(f"Wrote {written} cached replies to {args.output}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,13 +1,36 @@
 import os
+import hmac
+import math
+import time
 import logging
 import json
-from flask import Flask, render_template, request, flash, redirect, url_for, session, jsonify
-from baxus_api import get_user_bar_data
-from recommendation_engine import analyze_preferences, generate_recommendations
+from datetime import datetime, timezone
+from flask import Flask, render_template, request, flash, redirect, url_for, session, jsonify, g, Response, make_response, send_file, abort
 from bob_chat import chat_with_bob
+from request_context import RecommendationContext
+from recommendation_engine import (empty_preferences, explain_popular_bottle, get_similar_bottles,
+                                   generate_recommendation_explanation, is_sparse_profile)
+from bottle_dataset import get_bottle_dataset
+from value_scoring import get_best_deals, get_value_scores
+from render_cache import CachedPage, FragmentCacheExtension, RenderCache
+from serializers import json_safe, records_from_columns, serialize_columns
+from models import Bottle
+from warmup import WARMUP_TOKEN, start_configured_warmup, start_warmup_thread, warmup_status
+from offload import RankingBusy, in_worker_process, start_ranking_pool
+from image_proxy import THUMBNAIL_SIZES, bottle_image_url, thumbnail_cache
+from static_assets import asset_registry
+from metrics import HTTP_SECONDS, PROMETHEUS_CONTENT_TYPE, render_prometheus
+from structured_logging import configure_logging, new_request_id, reset_request_id, set_request_id
+from resilience import degraded_stages, reset_deadline, start_deadline
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Ranking pool workers (BOB_RANKING_EXECUTOR=process) are spawned, and under
+# `python app.py` each one imports this module again as __mp_main__. They only
+# rank, so the start-up side effects below are skipped there.
+IS_RANKING_WORKER = in_worker_process()
+
+# Configure logging (BOB_LOG_LEVEL, BOB_LOG_FORMAT, BOB_LOG_SAMPLE)
+if not IS_RANKING_WORKER:
+    configure_logging()
 logger = logging.getLogger(__name__)
 
 # Check if OpenAI API key is available
@@ -22,6 +45,118 @@ app.secret_key = os.environ.get("SECRET_KEY", os.environ.get("SESSION_SECRET", "
 # Set Flask environment configuration
 app.config['DEBUG'] = os.environ.get('FLASK_DEBUG', 'True').lower() in ('true', '1', 't')
 
+# "More like this" lookups for recommendation cards, served from the similarity graph
+app.jinja_env.globals['similar_bottles'] = get_similar_bottles
+
+def thumbnail_url(bottle_id, image_url, size='md'):
+    """Local thumbnail URL of a bottle image, versioned by content hash once it is cached"""
+    thumbnail = thumbnail_cache.lookup(image_url, size) if image_url else None
+    if thumbnail is None:
+        return url_for('bottle_image', bottle_id=bottle_id, size=size)
+    return url_for('bottle_image', bottle_id=bottle_id, size=size, v=thumbnail.content_hash)
+
+app.jinja_env.globals['thumbnail_url'] = thumbnail_url
+
+# Fingerprinted, precompressed CSS/JS/images, built now if the build is missing or stale
+if not IS_RANKING_WORKER:
+    asset_registry.load()
+
+def asset_url(filename):
+    """URL of a static asset: the fingerprinted build if there is one, else the plain static file"""
+    asset = asset_registry.lookup(filename)
+    if asset is None:
+        return url_for('static', filename=filename)
+    return url_for('static_asset', filename=asset.path)
+
+app.jinja_env.globals['asset_url'] = asset_url
+app.jinja_env.globals['asset_version'] = asset_registry.version
+
+# {% cache %} for template fragments that don't change between page views
+app.jinja_env.add_extension(FragmentCacheExtension)
+app.jinja_env.fragment_cache_enabled = os.environ.get('BOB_FRAGMENT_CACHE', 'true').lower() in ('true', '1', 't')
+
+# Rendered /recommendations pages keyed on (username, bar content hash, catalog version)
+recommendations_cache = RenderCache(max_entries=int(os.environ.get('RENDER_CACHE_MAX_ENTRIES', 2048)))
+
+if not IS_RANKING_WORKER:
+    # With BOB_RANKING_EXECUTOR=process, start the ranking workers before the first request
+    start_ranking_pool()
+    # Precompute recommendations for the users in BOB_WARMUP_USERS_FILE in the background
+    start_configured_warmup()
+
+# Recommendations API: ranked list size that limit/offset page over, and default projection
+API_MAX_RECOMMENDATIONS = 100
+API_MAX_PAGE_SIZE = 50
+API_DEFAULT_FIELDS = ('id', 'name', 'spirit_type', 'region', 'abv', 'msrp', 'fair_price',
+                      'total_score', 'image_url', 'explanation')
+API_VALUE_FIELDS = ('price_to_fair', 'score_per_dollar', 'shelf_markup', 'value_score')
+# Most neighbors /api/bottles/<id>/similar returns
+API_MAX_SIMILAR = 50
+
+def render_cached(key, variant, mimetype, render):
+    """
+    A recommendations_cache page, rendering it on a miss. A page rendered from
+    degraded results is served once but not kept, and gets its own ETag so
+    browsers don't hold on to it either.
+    """
+    degraded_before = set(degraded_stages())
+    page = recommendations_cache.get_or_render(key, variant, mimetype, render)
+    if set(degraded_stages()) - degraded_before:
+        recommendations_cache.discard(key, variant)
+        page = CachedPage(page.body, page.mimetype, RenderCache.etag_for(key, f"{variant}:degraded"),
+                          page.last_modified)
+    return page
+
+def get_pipeline(username):
+    """Get the lazily evaluated recommendation pipeline for this request"""
+    if 'pipeline' not in g:
+        g.pipeline = RecommendationContext(username)
+    return g.pipeline
+
+@app.before_request
+def start_request_timer():
+    """Remember when the request started and tag its log records with a request ID"""
+    g.request_started = time.perf_counter()
+    # Honor an upstream proxy's ID so logs line up across services
+    request_id = request.headers.get('X-Request-ID', '')
+    if not (0 < len(request_id) <= 64 and request_id.replace('-', '').isalnum()):
+        request_id = new_request_id()
+    g.request_id = request_id
+    g.request_id_token = set_request_id(request_id)
+    # Stages cap their upstream timeouts by what is left of BOB_REQUEST_DEADLINE
+    g.deadline_token = start_deadline()
+
+@app.after_request
+def record_request_latency(response):
+    """Record end-to-end latency for every routed request"""
+    started = g.get('request_started')
+    if started is not None and request.endpoint:
+        HTTP_SECONDS.observe(time.perf_counter() - started,
+                             endpoint=request.endpoint, method=request.method)
+    if 'request_id' in g:
+        response.headers['X-Request-ID'] = g.request_id
+    degraded = degraded_stages()
+    if degraded:
+        response.headers['X-Bob-Degraded'] = ','.join(degraded)
+    return response
+
+@app.teardown_request
+def clear_request_id(exc):
+    """Unbind the request ID (registered first, so it runs after the other teardowns)"""
+    token = g.pop('request_id_token', None)
+    if token is not None:
+        reset_request_id(token)
+    token = g.pop('deadline_token', None)
+    if token is not None:
+        reset_deadline(token)
+
+@app.teardown_request
+def log_pipeline_timings(exc):
+    """Log which pipeline stages ran for this request and how long they took"""
+    pipeline = g.pop('pipeline', None)
+    if pipeline is not None:
+        pipeline.log_timings(request.endpoint or request.path)
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     """Home page with username form"""
@@ -45,25 +180,50 @@ def recommendations():
         flash('Please enter a BAXUS username first', 'warning')
         return redirect(url_for('index'))
     
+    wants_json = (request.args.get('format') == 'json' or
+                  request.accept_mimetypes.best == 'application/json')
+    
     try:
-        # Get user's bar data from BAXUS API
-        user_data = get_user_bar_data(username)
+        pipeline = get_pipeline(username)
         
-        if not user_data or 'bar' not in user_data or not user_data['bar']:
-            flash('No bottle collection found for this username. Please try another username or contact BAXUS support.', 'warning')
-            return redirect(url_for('index'))
-        
-        # Analyze user preferences
-        user_preferences = analyze_preferences(user_data)
+        def render_page():
+            if not pipeline.has_collection:
+                # Cold start: show the most popular bottles rather than turning the visitor away
+                preferences = empty_preferences()
+                bottles = pipeline.popular_recommendations
+            else:
+                preferences = pipeline.preferences
+                bottles = pipeline.recommendations
+            
+            if wants_json:
+                return json.dumps(json_safe({"username": username,
+                                             "personalized": not is_sparse_profile(preferences),
+                                             "preferences": preferences,
+                                             "recommendations": bottles}))
+            return render_template('recommendations.html', 
+                                   username=username, 
+                                   preferences=preferences, 
+                                   recommendations=bottles,
+                                   cold_start=not pipeline.has_collection)
         
-        # Generate recommendations based on preferences
-        recommendations = generate_recommendations(user_preferences, user_data)
+        variant, mimetype = ('json', 'application/json') if wants_json else ('html', 'text/html')
+        # Pending flash messages would be baked into the cached HTML, so render those fresh
+        if '_flashes' in session:
+            page = CachedPage(render_page(), mimetype, RenderCache.etag_for(None, variant), time.time())
+        else:
+            page = render_cached(pipeline.cache_key, variant, mimetype, render_page)
         
-        return render_template('recommendations.html', 
-                               username=username, 
-                               preferences=user_preferences, 
-                               recommendations=recommendations)
+        response = Response(page.body, mimetype=page.mimetype)
+        response.set_etag(page.etag)
+        response.last_modified = datetime.fromtimestamp(page.last_modified, timezone.utc)
+        # The page is per-user: browsers may keep it but must revalidate each time
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.vary.update(('Cookie', 'Accept'))
+        return response.make_conditional(request)
     
+    except RankingBusy:
+        raise
     except Exception as e:
         logger.exception("Error generating recommendations")
         flash(f'An error occurred: {str(e)}', 'danger')
@@ -73,21 +233,7 @@ def recommendations():
 def chat():
     """Chat with Bob the Whisky Expert"""
     username = session.get('username')
-    recommendations = []
-    user_preferences = None
-    
-    # If user has logged in, get their preferences and recommendations
-    if username:
-        try:
-            # Get user's bar data from BAXUS API
-            user_data = get_user_bar_data(username)
-            
-            # If user has bottle collection, analyze preferences
-            if user_data and 'bar' in user_data and user_data['bar']:
-                user_preferences = analyze_preferences(user_data)
-                recommendations = generate_recommendations(user_preferences, user_data)
-        except Exception as e:
-            logger.exception(f"Error loading user data for chat: {str(e)}")
+    pipeline = get_pipeline(username)
     
     # Handle chat API requests
     if request.method == 'POST' and request.is_json:
@@ -109,6 +255,14 @@ def chat():
             session['chat_history'] = chat_history[-20:] if len(chat_history) > 20 else chat_history
             return jsonify({"response": api_error_msg, "error": "api_key_missing"})
         
+        # The chat reply only needs the preference summary, never the recommendations
+        user_preferences = None
+        if username:
+            try:
+                user_preferences = pipeline.preferences
+            except Exception as e:
+                logger.exception(f"Error loading user data for chat: {str(e)}")
+        
         try:
             # Get response from Bob
             bob_response = chat_with_bob(chat_history, username, user_preferences)
@@ -138,7 +292,14 @@ def chat():
             
             return jsonify({"response": error_msg, "error": "api_error"})
     
-    # For GET requests, render the chat page
+    # For GET requests, render the chat page with the user's recommendations
+    recommendations = []
+    if username:
+        try:
+            recommendations = pipeline.recommendations
+        except Exception as e:
+            logger.exception(f"Error loading user data for chat: {str(e)}")
+    
     return render_template('chat.html', 
                            username=username, 
                            recommendations=recommendations)
@@ -149,6 +310,195 @@ def reset_chat():
     session.pop('chat_history', None)
     return jsonify({"success": True})
 
+@app.route('/api/recommendations/<username>')
+def api_recommendations(username):
+    """
+    Ranked recommendations for a BAXUS user as JSON.
+    
+    Query parameters:
+        fields: Comma-separated projection (catalog columns, 'explanation' and
+            the value signals); defaults to API_DEFAULT_FIELDS
+        limit, offset: Page over the top API_MAX_RECOMMENDATIONS bottles
+        layout: 'rows' (list of objects, default) or 'columns' (object of arrays)
+    """
+    bottle_df = get_bottle_dataset()
+    fields = [f.strip() for f in request.args.get('fields', ','.join(API_DEFAULT_FIELDS)).split(',') if f.strip()]
+    allowed = set(bottle_df.columns) | {'explanation'} | set(API_VALUE_FIELDS)
+    unknown = [f for f in fields if f not in allowed]
+    layout = request.args.get('layout', 'rows')
+    try:
+        limit = int(request.args.get('limit', 10))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({"error": "invalid_parameters", "message": "limit and offset must be integers"}), 400
+    if unknown or not fields or layout not in ('rows', 'columns') or \
+            not 1 <= limit <= API_MAX_PAGE_SIZE or not 0 <= offset < API_MAX_RECOMMENDATIONS:
+        return jsonify({"error": "invalid_parameters", "unknown_fields": unknown,
+                        "max_limit": API_MAX_PAGE_SIZE, "max_offset": API_MAX_RECOMMENDATIONS - 1}), 400
+    
+    pipeline = get_pipeline(username)
+    
+    def render_payload():
+        # Always rank the full list so pages stay consistent with each other
+        ranked = pipeline.ranked_rows(API_MAX_RECOMMENDATIONS)
+        rows = ranked[offset:offset + limit]
+        columns = serialize_columns(bottle_df, rows, [f for f in fields if f in bottle_df.columns])
+        
+        if any(f in API_VALUE_FIELDS for f in fields):
+            signals = get_value_scores().columns(rows)
+            for f in fields:
+                if f in API_VALUE_FIELDS:
+                    columns[f] = json_safe([round(float(v), 4) for v in signals[f]])
+        
+        if 'explanation' in fields:
+            preferences = pipeline.preferences
+            explain = explain_popular_bottle if is_sparse_profile(preferences) else generate_recommendation_explanation
+            bottles = Bottle.from_catalog(bottle_df, rows)
+            columns['explanation'] = [explain(bottle, preferences, pipeline.user_data or {}) for bottle in bottles]
+        
+        columns = {f: columns[f] for f in fields}
+        payload = {
+            "username": username,
+            "personalized": not is_sparse_profile(pipeline.preferences),
+            "total": int(len(ranked)),
+            "offset": offset,
+            "limit": limit,
+            "fields": fields,
+        }
+        if layout == 'columns':
+            payload["columns"] = columns
+        else:
+            payload["recommendations"] = records_from_columns(columns)
+        return json.dumps(payload, separators=(',', ':'))
+    
+    variant = f"api:{','.join(fields)}:{offset}:{limit}:{layout}"
+    page = render_cached(pipeline.cache_key, variant, 'application/json', render_payload)
+    response = Response(page.body, mimetype=page.mimetype)
+    response.set_etag(page.etag)
+    response.last_modified = datetime.fromtimestamp(page.last_modified, timezone.utc)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@app.route('/api/catalog/deals')
+def catalog_deals():
+    """Best-value bottles in the catalog, optionally filtered by price and style"""
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 1), 100)
+        min_price = float(request.args['min_price']) if request.args.get('min_price') else None
+        max_price = float(request.args['max_price']) if request.args.get('max_price') else None
+        if not all(math.isfinite(price) for price in (min_price, max_price) if price is not None):
+            raise ValueError("prices must be finite")
+    except ValueError:
+        return jsonify({"error": "invalid_parameters"}), 400
+    
+    deals = get_best_deals(limit=limit, min_price=min_price, max_price=max_price,
+                           spirit_type=request.args.get('spirit_type'),
+                           region=request.args.get('region'))
+    return jsonify({"deals": deals})
+
+@app.route('/api/bottles/<int:bottle_id>/similar')
+def similar_bottles(bottle_id):
+    """Bottles most similar to a catalog bottle, from the precomputed similarity graph"""
+    try:
+        limit = int(request.args.get('limit', 5))
+    except ValueError:
+        return jsonify({"error": "invalid_parameters", "message": "limit must be an integer"}), 400
+    if not 1 <= limit <= API_MAX_SIMILAR:
+        return jsonify({"error": "invalid_parameters", "max_limit": API_MAX_SIMILAR}), 400
+    similar = get_similar_bottles(bottle_id, limit)
+    if not similar and not (get_bottle_dataset()['id'] == bottle_id).any():
+        return jsonify({"error": "unknown_bottle"}), 404
+    return jsonify({"bottle_id": bottle_id, "similar": json_safe(similar)})
+
+@app.route('/images/bottles/<int:bottle_id>/<size>')
+def bottle_image(bottle_id, size):
+    """A catalog bottle image resized to a standard size, from the local thumbnail cache"""
+    if size not in THUMBNAIL_SIZES:
+        abort(404)
+    image_url = bottle_image_url(bottle_id)
+    if not image_url:
+        abort(404)
+    thumbnail = thumbnail_cache.get(image_url, size)
+    if thumbnail is None:
+        # Source couldn't be fetched or decoded: let the browser try the original
+        return redirect(image_url)
+    
+    response = send_file(thumbnail.path, mimetype=thumbnail.mimetype, etag=thumbnail.content_hash,
+                         conditional=True, max_age=86400)
+    response.cache_control.public = True
+    if request.args.get('v') == thumbnail.content_hash:
+        # The URL names these exact bytes, so it can be cached for good
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+    return response
+
+@app.route('/assets/<path:filename>')
+def static_asset(filename):
+    """A fingerprinted static asset, precompressed in the best encoding the client accepts"""
+    resolved = asset_registry.resolve(filename, request.accept_encodings)
+    if resolved is None:
+        abort(404)
+    asset, encoding, path = resolved
+    # Each encoding is a different representation and needs its own validator
+    response = send_file(path, mimetype=asset.mimetype, etag=f"{asset.content_hash}-{encoding}",
+                         conditional=True, max_age=31536000)
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    # The name carries the content hash, so these bytes never change
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/admin/warmup', methods=['GET', 'POST'])
+def admin_warmup():
+    """Warm the posted users in this process in the background (POST), or report the latest run (GET)"""
+    if not WARMUP_TOKEN:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {WARMUP_TOKEN}"):
+        return jsonify({"error": "unauthorized"}), 401
+    if request.method == 'GET':
+        return jsonify(warmup_status())
+
+    data = request.get_json(silent=True) or {}
+    usernames = data.get('usernames')
+    if not isinstance(usernames, list) or not all(isinstance(u, str) for u in usernames):
+        return jsonify({"error": "invalid_parameters", "message": "usernames must be a list of strings"}), 400
+    options = {}
+    try:
+        if data.get('concurrency') is not None:
+            options['concurrency'] = int(data['concurrency'])
+        if data.get('rate') is not None:
+            options['rate'] = float(data['rate'])
+    except (TypeError, ValueError):
+        return jsonify({"error": "invalid_parameters", "message": "concurrency and rate must be numbers"}), 400
+    if options.get('concurrency', 1) < 1 or not math.isfinite(options.get('rate', 0)):
+        return jsonify({"error": "invalid_parameters", "message": "concurrency must be at least 1 and rate finite"}), 400
+
+    if start_warmup_thread(usernames, **options) is None:
+        return jsonify({"error": "warmup_running", **warmup_status()}), 409
+    logger.info(f"Started warmup of {len(usernames)} users")
+    return jsonify({"status": "started", "users": len(usernames)}), 202
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint with per-stage latency histograms and counters"""
+    return Response(render_prometheus(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+@app.errorhandler(RankingBusy)
+def ranking_busy(e):
+    """The ranking pool is saturated: ask the client to come back shortly"""
+    logger.warning(f"Rejected {request.path}: {str(e)}")
+    if request.path.startswith('/api/') or request.args.get('format') == 'json' or \
+            request.accept_mimetypes.best == 'application/json':
+        response = jsonify({"error": "busy", "message": "Recommendations are busy, please retry shortly"})
+    else:
+        flash("Bob is busy pouring for other guests. Please try again in a moment.", 'warning')
+        response = make_response(render_template('index.html'))
+    response.status_code = 503
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
 @app.errorhandler(404)
 def page_not_found(e):
     return render_template('index.html', error="Page not found"), 404
@@ -1,40 +1,194 @@
+import os
+import json
+import time
+import hashlib
+import threading
 import requests
 import logging
-from typing import Dict, Any, Optional
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple, Callable, List
+from metrics import counter, timer
+from resilience import DeadlineExceeded, baxus_breaker, record_degraded, stage_timeout
 
 logger = logging.getLogger(__name__)
 
-BAXUS_API_BASE_URL = "https://services.baxus.co/api"
+BAXUS_API_BASE_URL = os.environ.get('BAXUS_API_BASE_URL', "https://services.baxus.co/api")
+# Seconds to wait for a bar, further capped by the request deadline
+BAXUS_TIMEOUT = float(os.environ.get('BAXUS_TIMEOUT', 3.0))
 
-def get_user_bar_data(username: str) -> Optional[Dict[str, Any]]:
+# Bars are reused for this many seconds before BAXUS is asked again
+BAR_CACHE_TTL = float(os.environ.get('BAXUS_BAR_CACHE_TTL', 300))
+BAR_CACHE_MAX_USERS = int(os.environ.get('BAXUS_BAR_CACHE_MAX_USERS', 10000))
+# Expired bars are still served for this long while BAXUS is failing
+BAR_CACHE_STALE_TTL = float(os.environ.get('BAXUS_BAR_CACHE_STALE_TTL', 86400))
+# Usernames BAXUS rejected (404 or another 4xx) aren't asked about again for this long
+UNKNOWN_USER_TTL = float(os.environ.get('BAXUS_UNKNOWN_USER_TTL', 60))
+
+BAXUS_REQUESTS = counter('bob_baxus_requests_total', 'BAXUS bar API requests by outcome', ('outcome',))
+BAR_CACHE = counter('bob_bar_cache_lookups_total', 'BAXUS bar cache lookups by result', ('result',))
+
+# username -> (fetched_at, user_data), least recently used first
+_bar_cache: 'OrderedDict[str, Tuple[float, Dict[str, Any]]]' = OrderedDict()
+# username -> when BAXUS rejected it, oldest first
+_unknown_users: 'OrderedDict[str, float]' = OrderedDict()
+_bar_cache_lock = threading.Lock()
+
+# Called with (username, user_data) for every bar freshly fetched from BAXUS
+_bar_listeners: List[Callable[[str, Dict[str, Any]], None]] = []
+
+def get_user_bar_data(username: str, max_age: Optional[float] = None) -> Optional[Dict[str, Any]]:
     """
     Retrieves a user's bar collection data from the BAXUS API.
-    
+
+    Successful responses are cached per user, so reloads within the TTL don't
+    hit BAXUS again. A username BAXUS rejects (e.g. a typo, 404) is remembered
+    for UNKNOWN_USER_TTL seconds and answered with None. When BAXUS fails, times out or its circuit breaker is
+    open, an expired cached bar (up to BAR_CACHE_STALE_TTL old) is served
+    instead and the request is marked degraded.
+
     Args:
         username: The BAXUS username for which to retrieve data
-        
+        max_age: Maximum age in seconds of a cached bar to accept
+            (defaults to BAR_CACHE_TTL; 0 forces a fresh fetch)
+
+    Returns:
+        Dictionary containing the user's bar data (under 'bar') and a hash of
+        the raw response (under 'content_hash'), or None if an error occurs
+    """
+    max_age = BAR_CACHE_TTL if max_age is None else max_age
+    with _bar_cache_lock:
+        cached = _bar_cache.get(username)
+        if cached is not None and time.time() - cached[0] <= max_age:
+            _bar_cache.move_to_end(username)
+            BAR_CACHE.inc(result='hit')
+            return cached[1]
+        rejected_at = _unknown_users.get(username)
+        if rejected_at is not None and time.time() - rejected_at <= min(max_age, UNKNOWN_USER_TTL):
+            BAR_CACHE.inc(result='unknown_user')
+            return None
+    BAR_CACHE.inc(result='miss')
+
+    try:
+        timeout = stage_timeout(BAXUS_TIMEOUT)
+    except DeadlineExceeded:
+        return _stale_bar(username, cached, 'deadline')
+    if not baxus_breaker.allow():
+        return _stale_bar(username, cached, 'circuit_open')
+    user_data, upstream_ok = _fetch_user_bar_data(username, timeout)
+    if upstream_ok:
+        baxus_breaker.record_success()
+    else:
+        baxus_breaker.record_failure()
+        return _stale_bar(username, cached, 'upstream_error')
+    if user_data is None:
+        _remember_unknown_user(username)
+    else:
+        store_user_bar_data(username, user_data)
+        for listener in _bar_listeners:
+            try:
+                listener(username, user_data)
+            except Exception:
+                logger.exception(f"Bar listener {getattr(listener, '__name__', listener)} failed")
+    return user_data
+
+def _stale_bar(username: str, cached: Optional[Tuple[float, Dict[str, Any]]],
+               reason: str) -> Optional[Dict[str, Any]]:
+    """The expired cached bar while BAXUS can't be asked, or None if there is none"""
+    record_degraded('bar', reason)
+    if cached is not None and time.time() - cached[0] <= BAR_CACHE_STALE_TTL:
+        BAR_CACHE.inc(result='stale')
+        return cached[1]
+    return None
+
+def _remember_unknown_user(username: str) -> None:
+    with _bar_cache_lock:
+        _unknown_users[username] = time.time()
+        _unknown_users.move_to_end(username)
+        while len(_unknown_users) > BAR_CACHE_MAX_USERS:
+            _unknown_users.popitem(last=False)
+
+def store_user_bar_data(username: str, user_data: Dict[str, Any],
+                        fetched_at: Optional[float] = None) -> None:
+    """Put a user's bar data into the cache, evicting the least recently used users"""
+    with _bar_cache_lock:
+        _bar_cache[username] = (fetched_at or time.time(), user_data)
+        _bar_cache.move_to_end(username)
+        _unknown_users.pop(username, None)
+        while len(_bar_cache) > BAR_CACHE_MAX_USERS:
+            _bar_cache.popitem(last=False)
+
+def cached_bar_age(username: str) -> Optional[float]:
+    """Seconds since the user's cached bar was fetched, or None if it isn't cached"""
+    with _bar_cache_lock:
+        cached = _bar_cache.get(username)
+    return None if cached is None else time.time() - cached[0]
+
+def bar_content_hash(user_data: Optional[Dict[str, Any]]) -> str:
+    """Short hash identifying the contents of a user's bar"""
+    if not user_data or not user_data.get('bar'):
+        return 'no-bar'
+    if user_data.get('content_hash'):
+        return user_data['content_hash']
+    payload = json.dumps(user_data['bar'], sort_keys=True, default=str).encode()
+    return hashlib.sha1(payload).hexdigest()[:16]
+
+def add_bar_listener(listener: Callable[[str, Dict[str, Any]], None]) -> None:
+    """Registers a callback receiving (username, user_data) for each freshly fetched bar"""
+    _bar_listeners.append(listener)
+
+def clear_bar_cache() -> None:
+    """Forget all cached bars and unknown users"""
+    with _bar_cache_lock:
+        _bar_cache.clear()
+        _unknown_users.clear()
+
+@timer('get_user_bar_data')
+def _fetch_user_bar_data(username: str, timeout: float = BAXUS_TIMEOUT) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """
+    Fetch a user's bar from the BAXUS API, bypassing the cache.
+
     Returns:
-        Dictionary containing the user's bar data or None if an error occurs
+        Tuple of (bar data or None, whether BAXUS itself worked); an unknown
+        user is a working upstream, a 5xx or a timeout is not
     """
     endpoint = f"{BAXUS_API_BASE_URL}/bar/user/{username}"
     headers = {"Content-Type": "application/json"}
-    
+
     try:
-        logger.debug(f"Fetching bar data for user: {username}")
-        response = requests.get(endpoint, headers=headers)
-        
+        logger.debug("Fetching bar data for user: %s", username)
+        response = requests.get(endpoint, headers=headers, timeout=timeout)
+
         if response.status_code == 200:
             user_data = response.json()
-            logger.debug(f"Successfully retrieved data for user: {username}")
+            logger.debug("Successfully retrieved data for user: %s", username)
+            BAXUS_REQUESTS.inc(outcome='ok')
             # Format the response for our app expecting a specific structure
-            return {"bar": user_data}
+            return {"bar": user_data,
+                    "content_hash": hashlib.sha1(response.content).hexdigest()[:16]}, True
+        elif response.status_code == 404:
+            # A mistyped or unknown username: expected, and the body says nothing more
+            logger.info("BAXUS has no bar for %s", username,
+                        extra={'fields': {'username': username, 'status': 404}})
+            BAXUS_REQUESTS.inc(outcome='http_404')
+            return None, True
         else:
-            logger.error(f"Failed to retrieve user data: Status {response.status_code}, Response: {response.text}")
-            return None
-            
+            # Error pages can be large HTML documents; a prefix identifies them
+            log = logger.warning if response.status_code < 500 else logger.error
+            log("Failed to retrieve bar for %s: status %d, response: %.200s",
+                username, response.status_code, response.text,
+                extra={'fields': {'username': username, 'status': response.status_code}})
+            BAXUS_REQUESTS.inc(outcome=f'http_{response.status_code}')
+            return None, response.status_code < 500
+
+    except requests.Timeout:
+        logger.error(f"BAXUS request for {username} timed out after {timeout:.2f}s")
+        BAXUS_REQUESTS.inc(outcome='timeout')
+        return None, False
     except requests.RequestException as e:
         logger.exception(f"API request error for user {username}: {str(e)}")
-        return None
+        BAXUS_REQUESTS.inc(outcome='request_error')
+        return None, False
     except ValueError as e:
         logger.exception(f"JSON parsing error for user {username}: {str(e)}")
-        return None
+        BAXUS_REQUESTS.inc(outcome='invalid_json')
+        return None, False
@@ -0,0 +1,5 @@
+"""
+Reproducible benchmarks for the recommendation and chat pipelines.
+
+Run ``python -m benchmarks.run --help`` from the repository root.
+"""
@@ -0,0 +1,136 @@
+"""
+Per-request memory of the /recommendations page.
+
+Bars for synthetic users are placed in the BAXUS bar cache, so requests run
+the full analysis, ranking and rendering without network access. The render
+and user result caches are cleared before each request so every one does the
+full work.
+
+For each bar size it reports:
+
+    retained_kib  deep size of the request's pipeline objects (bar analysis
+                  and recommendations), which live until the page is rendered
+    peak_kib      peak traced memory during one full request
+    blocks        memory blocks allocated and still alive after the pipeline
+                  objects were built
+
+Examples (from the repository root):
+
+    python -m benchmarks.allocations
+    python -m benchmarks.allocations --bar-sizes 10,100,1000 --output before.json
+"""
+import gc
+import os
+import sys
+import time
+import logging
+import argparse
+import tracemalloc
+from typing import Dict, List, Any
+
+from benchmarks.harness import environment, measure, write_results
+from benchmarks.run import _parse_sizes
+from benchmarks.synthetic import generate_bar
+
+def _deep_size(obj, seen=None) -> int:
+    """Bytes held by obj and everything it references (numpy arrays by buffer size)"""
+    import numpy as np
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, np.ndarray):
+        # Views report only their header; count the buffer they keep alive once
+        if obj.base is not None:
+            size += _deep_size(obj.base, seen)
+        return size
+    if isinstance(obj, dict):
+        return size + sum(_deep_size(k, seen) + _deep_size(v, seen) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return size + sum(_deep_size(item, seen) for item in obj)
+    for name in getattr(type(obj), '__slots__', ()):
+        size += _deep_size(getattr(obj, name, None), seen)
+    if hasattr(obj, '__dict__'):
+        size += _deep_size(obj.__dict__, seen)
+    return size
+
+def _retained(build) -> Dict[str, float]:
+    """Size of what build() returns, and the memory blocks allocated while building it"""
+    tracemalloc.start()
+    try:
+        before_blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+        kept = build()
+        # Temporaries caught in reference cycles are not part of what a request keeps
+        gc.collect()
+        after_blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+    finally:
+        tracemalloc.stop()
+    return {'retained_kib': _deep_size(kept) / 1024, 'blocks': after_blocks - before_blocks}
+
+def run_allocation_benchmarks(bar_sizes: List[int], repeat: int, seed: int) -> List[Dict[str, Any]]:
+    import pandas as pd
+    import app as web
+    from baxus_api import store_user_bar_data
+    from bottle_dataset import _resolve_dataset_path, get_bottle_dataset
+    from request_context import RecommendationContext, user_cache
+
+    get_bottle_dataset()
+    raw_catalog = pd.read_csv(_resolve_dataset_path())
+    client = web.app.test_client()
+    results = []
+    for bar_size in bar_sizes:
+        username = f"bench-{bar_size}"
+        store_user_bar_data(username, generate_bar(raw_catalog, bar_size, seed),
+                            fetched_at=time.time() + 10 ** 6)
+        with client.session_transaction() as session:
+            session['username'] = username
+
+        def request_page():
+            web.recommendations_cache.clear()
+            user_cache.clear()
+            response = client.get('/recommendations')
+            assert response.status_code == 200, response.status_code
+            return response
+
+        def build_pipeline():
+            # What a request keeps alive between ranking and rendering
+            user_cache.clear()
+            with web.app.test_request_context('/recommendations'):
+                pipeline = RecommendationContext(username)
+                return pipeline.preferences, pipeline.recommendations, pipeline.popular_recommendations
+
+        stats = measure(request_page, repeat=repeat, warmup=2)
+        retained = _retained(build_pipeline)
+        row = {'case': f"recommendations_page/bar={bar_size}", 'params': {'bar_size': bar_size},
+               'peak_kib': stats['peak_mib'] * 1024, **stats, **retained}
+        print(f"bar={bar_size:<6} p50 {stats['p50_ms']:>8.2f} ms  peak {row['peak_kib']:>9.1f} KiB  "
+              f"retained {retained['retained_kib']:>8.1f} KiB  blocks {retained['blocks']:>7}", flush=True)
+        results.append(row)
+    return results
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Measure per-request memory of /recommendations")
+    parser.add_argument('--bar-sizes', default='5,25,100,1000', help="Comma-separated bar sizes")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmarks/results/allocations.json')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    started = time.time()
+    results = run_allocation_benchmarks(_parse_sizes(args.bar_sizes), args.repeat, args.seed)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    write_results(args.output, results, {
+        'started_at': started,
+        'duration_s': time.time() - started,
+        'seed': args.seed,
+        'repeat': args.repeat,
+        'environment': environment(),
+    })
+    print(f"Wrote {len(results)} results to {args.output}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,169 @@
+"""
+Recall and throughput of the IVF index against exact search.
+
+For each catalog size, queries are built from synthetic bars (preference
+vector, price band, owned bottles) and answered three ways:
+
+    exact_scan   brute force over the filtered catalog in the index's feature
+                 space; the ground truth for recall
+    exact_fit    the default request path, fitting NearestNeighbors over the
+                 filtered candidates for every query
+    ivf          the index at each nprobe
+
+Examples (from the repository root):
+
+    python -m benchmarks.ann
+    python -m benchmarks.ann --catalog-sizes 50000,1000000 --nprobe 4,16,64
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+from typing import Dict, List, Any
+
+import numpy as np
+
+from benchmarks.harness import environment, write_results
+from benchmarks.run import _parse_sizes
+from benchmarks.synthetic import generate_bar, generate_catalog
+
+def _build_queries(raw_catalog, index, num_queries: int, seed: int) -> List[Dict[str, Any]]:
+    from candidate_index import get_candidate_index
+    from recommendation_engine import analyze_preferences
+    queries = []
+    for i in range(num_queries):
+        user_data = generate_bar(raw_catalog, 5 + i % 40, seed + i)
+        preferences = analyze_preferences(user_data)
+        owned = [bottle['release_id'] for bottle in user_data['bar']]
+        queries.append({
+            'preferences': preferences,
+            'user_data': user_data,
+            'vector': index.query_vector(preferences),
+            'price_range': (max(0, preferences.average_bottle_price * 0.5),
+                            preferences.price_ceiling),
+            'exclude_rows': get_candidate_index().rows_of_ids(owned),
+        })
+    return queries
+
+def _exact_scan(index, msrp: np.ndarray, query: Dict[str, Any], k: int):
+    """Ground truth: every eligible row, same feature space and filters as the index"""
+    low, high = query['price_range']
+    eligible = (msrp >= low) & (msrp <= high)
+    eligible[query['exclude_rows']] = False
+    rows = np.flatnonzero(eligible)
+    distances = index.distances(query['vector'], rows)
+    top = np.argsort(distances, kind='stable')[:k]
+    return rows[top], distances[top]
+
+def _timed(func, queries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    results = []
+    latencies = np.empty(len(queries))
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        results.append(func(query))
+        latencies[i] = time.perf_counter() - start
+    return {
+        'results': results,
+        'qps': len(queries) / latencies.sum() if latencies.sum() else float('inf'),
+        'p50_ms': float(np.percentile(latencies, 50) * 1000),
+        'p99_ms': float(np.percentile(latencies, 99) * 1000),
+    }
+
+def _recall(found: List[tuple], truth: List[tuple]) -> float:
+    """
+    Tie-aware recall@k: a returned row is a hit when it is no further away than
+    the true k-th neighbor. Catalogs hold many bottles with identical features,
+    so comparing row ids would punish returning an equally close twin.
+    """
+    hits = total = 0
+    for (_, found_dist), (_, true_dist) in zip(found, truth):
+        if len(true_dist):
+            hits += min(len(true_dist), int((found_dist <= true_dist[-1] + 1e-5).sum()))
+        total += len(true_dist)
+    return hits / total if total else 1.0
+
+def run_ann_benchmarks(catalog_sizes: List[int], nprobes: List[int], k: int,
+                       num_queries: int, exact_fit_queries: int, seed: int) -> List[Dict[str, Any]]:
+    from ann_index import IVFIndex
+    from bottle_dataset import clear_catalog_cache, get_bottle_dataset
+    from recommendation_engine import rank_recommendations
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='bob-ann-') as workdir:
+        for size in catalog_sizes:
+            raw_catalog = generate_catalog(size, seed)
+            path = os.path.join(workdir, f"catalog_{size}.csv")
+            raw_catalog.to_csv(path, index=False)
+            os.environ['BOB_DATASET_PATH'] = path
+            clear_catalog_cache()
+            catalog = get_bottle_dataset()
+
+            started = time.perf_counter()
+            index = IVFIndex(catalog)
+            build_s = time.perf_counter() - started
+            msrp = catalog['msrp'].to_numpy(dtype=np.float32)
+            queries = _build_queries(raw_catalog, index, num_queries, seed)
+
+            exact = _timed(lambda q: _exact_scan(index, msrp, q, k), queries)
+            truth = exact['results']
+            print(f"catalog={size:<8} cells={index.num_cells:<5} build {build_s:6.2f}s", flush=True)
+            rows = [{'case': f"ann/exact_scan,catalog={size}", 'recall': 1.0,
+                     'qps': exact['qps'], 'p50_ms': exact['p50_ms'], 'p99_ms': exact['p99_ms']}]
+
+            # The request path refits per query, so only a subset is timed
+            subset = queries[:exact_fit_queries]
+            fit = _timed(lambda q: rank_recommendations(q['preferences'], q['user_data'], k,
+                                                        value_weight=0, cf_weight=0,
+                                                        knn_mode='exact'), subset)
+            rows.append({'case': f"ann/exact_fit,catalog={size}", 'recall': None,
+                         'qps': fit['qps'], 'p50_ms': fit['p50_ms'], 'p99_ms': fit['p99_ms']})
+
+            for nprobe in nprobes:
+                ivf = _timed(lambda q: index.search(q['vector'], k, nprobe=nprobe,
+                                                    price_range=q['price_range'],
+                                                    exclude_rows=q['exclude_rows']), queries)
+                rows.append({'case': f"ann/ivf,catalog={size},nprobe={nprobe}",
+                             'recall': _recall(ivf['results'], truth),
+                             'qps': ivf['qps'], 'p50_ms': ivf['p50_ms'], 'p99_ms': ivf['p99_ms']})
+
+            for row in rows:
+                row['params'] = {'catalog_size': size, 'k': k, 'cells': index.num_cells,
+                                 'build_s': build_s}
+                recall = "      -" if row['recall'] is None else f"{row['recall']:7.3f}"
+                print(f"  {row['case']:<45} recall@{k} {recall}  {row['qps']:>10.1f} qps  "
+                      f"p50 {row['p50_ms']:>8.2f} ms  p99 {row['p99_ms']:>8.2f} ms", flush=True)
+            results.extend(rows)
+    return results
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the IVF index against exact search")
+    parser.add_argument('--catalog-sizes', default='50000,250000',
+                        help="Comma-separated catalog sizes")
+    parser.add_argument('--nprobe', default='4,16,64', help="Comma-separated nprobe values")
+    parser.add_argument('--k', type=int, default=15, help="Neighbors per query (the kNN shortlist size)")
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--exact-fit-queries', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmarks/results/ann.json')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    started = time.time()
+    results = run_ann_benchmarks(_parse_sizes(args.catalog_sizes), _parse_sizes(args.nprobe),
+                                 args.k, args.queries, args.exact_fit_queries, args.seed)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    write_results(args.output, results, {
+        'started_at': started,
+        'duration_s': time.time() - started,
+        'seed': args.seed,
+        'k': args.k,
+        'environment': environment(),
+    })
+    print(f"Wrote {len(results)} results to {args.output}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
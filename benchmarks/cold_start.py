@@ -0,0 +1,176 @@
+"""
+Cold and warm invocations of the Vercel chat handler (api/whisky.py).
+
+Each simulated function instance is a fresh Python process: it imports the
+handler, answers a series of /api/chat requests through the Flask test client
+with a stub OpenAI client, and exits, like an instance being recycled. Like
+Vercel instances, each one has its own /tmp directory, so nothing it writes
+reaches the next one. What instances share is the seed: before the
+instances run, `export_seed` (python -m api.whisky export-seed) answers the
+first --seed-questions questions of a fixed pool, and the instances read the
+file as BOB_CHAT_CACHE_SEED. Questions are drawn from the whole pool.
+Scenarios:
+
+    no_seed      every instance starts with an empty cache
+    seed         instances load the seed at their first invocation
+    seed_warmup  as seed, but /api/warmup is called before traffic
+
+For each scenario it reports the import time, the first (cold) invocation,
+warm invocation p50/p99, and the OpenAI calls per instance.
+
+Examples (from the repository root):
+
+    python -m benchmarks.cold_start
+    python -m benchmarks.cold_start --instances 8 --requests 40 --output benchmarks/results/cold_start.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+from typing import Dict, List, Any
+
+from benchmarks.harness import StubOpenAIClient, environment, write_results
+
+SCENARIOS = ('no_seed', 'seed', 'seed_warmup')
+# Phrased to match no rule-based topic or catalog bottle, so each one needs OpenAI
+QUESTION_POOL = [f"What would you pour for a friend on occasion number {i}?" for i in range(30)]
+
+def _server_timing(header: str) -> Dict[str, float]:
+    """'import;dur=1.0, init;dur=2.0' -> {'import': 1.0, 'init': 2.0}"""
+    timings = {}
+    for part in header.split(','):
+        name, _, duration = part.strip().partition(';dur=')
+        if duration:
+            timings[name] = float(duration)
+    return timings
+
+def run_instance(requests: int, warmup: bool, latency: float, seed: int) -> Dict[str, Any]:
+    """Runs inside a fresh process: one simulated function instance"""
+    started = time.perf_counter()
+    from api import whisky
+    import bob_chat
+    import_ms = (time.perf_counter() - started) * 1000
+    openai = StubOpenAIClient(latency)
+    bob_chat.client = openai
+
+    client = whisky.app.test_client()
+    invocations = []
+    if warmup:
+        response = client.get('/api/warmup')
+        assert response.status_code == 200, response.status_code
+        invocations.append({'route': 'warmup', 'instance': response.headers['X-Bob-Instance'],
+                            **_server_timing(response.headers['Server-Timing'])})
+    rng = random.Random(seed)
+    for _ in range(requests):
+        call_started = time.perf_counter()
+        response = client.post('/api/chat', json={'message': rng.choice(QUESTION_POOL)})
+        assert response.status_code == 200, response.status_code
+        invocations.append({'route': 'chat', 'instance': response.headers['X-Bob-Instance'],
+                            'total_ms': (time.perf_counter() - call_started) * 1000,
+                            **_server_timing(response.headers['Server-Timing'])})
+    # No final save: a recycled instance gets no chance to write anything
+    return {'import_ms': import_ms, 'openai_calls': openai.calls,
+            'snapshot_entries': whisky.instance.snapshot_entries, 'invocations': invocations}
+
+def build_seed(path: str, questions: int, latency: float) -> int:
+    """Runs inside a fresh process: exports a seed answering the first questions of the pool"""
+    from api import whisky
+    import bob_chat
+    bob_chat.client = StubOpenAIClient(latency)
+    return whisky.export_seed(path, QUESTION_POOL[:questions])
+
+def _run_child(args: List[str], env: Dict[str, str]) -> Dict[str, Any]:
+    env = dict(os.environ, OPENAI_API_KEY=os.environ.get('OPENAI_API_KEY', 'bench'), BOB_LOG_LEVEL='ERROR', **env)
+    output = subprocess.run([sys.executable, '-m', 'benchmarks.cold_start'] + args, env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def _spawn_instance(seed_path: str, requests: int, warmup: bool, latency: float, seed: int) -> Dict[str, Any]:
+    # A private /tmp per instance, as on Vercel
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {'TMPDIR': tmp, 'BOB_CHAT_CACHE_SNAPSHOT': os.path.join(tmp, 'bob_chat_cache.json'),
+               'BOB_CHAT_CACHE_SEED': seed_path}
+        return _run_child(['--instance', '--requests', str(requests), '--latency', str(latency),
+                           '--seed', str(seed)] + (['--warmup'] if warmup else []), env)
+
+def run_cold_start_benchmarks(instances: int, requests: int, latency: float, seed: int,
+                              seed_questions: int) -> List[Dict[str, Any]]:
+    results = []
+    for scenario in SCENARIOS:
+        with tempfile.TemporaryDirectory() as directory:
+            seed_path = ''
+            if scenario != 'no_seed':
+                seed_path = os.path.join(directory, 'chat_cache_seed.json')
+                _run_child(['--export-seed', seed_path, '--seed-questions', str(seed_questions),
+                            '--latency', str(latency)], {'BOB_CHAT_CACHE_SEED': ''})
+            runs = [_spawn_instance(seed_path, requests, scenario == 'seed_warmup', latency, seed + i)
+                    for i in range(instances)]
+        chats = [[c for c in run['invocations'] if c['route'] == 'chat'] for run in runs]
+        first = [calls[0]['total_ms'] for calls in chats]
+        warm = [c['total_ms'] for calls in chats for c in calls if c['instance'] == 'warm']
+        init = [c.get('init', 0.0) for run in runs for c in run['invocations'][:1]]
+        row = {
+            'case': f"cold_start/{scenario}",
+            'params': {'scenario': scenario, 'instances': instances, 'requests': requests,
+                       'latency_s': latency, 'seed_questions': seed_questions if seed_path else 0},
+            'import_ms': float(np.median([run['import_ms'] for run in runs])),
+            'init_ms': float(np.median(init)),
+            'first_chat_ms': float(np.median(first)),
+            'warm_p50_ms': float(np.percentile(warm, 50)),
+            'warm_p99_ms': float(np.percentile(warm, 99)),
+            'openai_calls_per_instance': float(np.mean([run['openai_calls'] for run in runs])),
+        }
+        print(f"{scenario:<16} import {row['import_ms']:7.1f} ms  init {row['init_ms']:7.1f} ms  "
+              f"first chat {row['first_chat_ms']:7.1f} ms  warm p50 {row['warm_p50_ms']:6.1f} ms  "
+              f"p99 {row['warm_p99_ms']:6.1f} ms  OpenAI calls/instance {row['openai_calls_per_instance']:5.1f}",
+              flush=True)
+        results.append(row)
+    return results
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Measure cold and warm invocations of the Vercel chat handler")
+    parser.add_argument('--instances', type=int, default=5, help="Function instances per scenario")
+    parser.add_argument('--requests', type=int, default=30, help="Chat requests per instance")
+    parser.add_argument('--latency', type=float, default=0.05, help="Stub OpenAI latency in seconds")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--seed-questions', type=int, default=len(QUESTION_POOL) // 2,
+                        help="Questions of the pool answered in the exported seed")
+    parser.add_argument('--output', default='benchmarks/results/cold_start.json')
+    parser.add_argument('--instance', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--warmup', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--export-seed', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.export_seed:
+        print(json.dumps({'entries': build_seed(args.export_seed, args.seed_questions, args.latency)}))
+        return 0
+    if args.instance:
+        result = run_instance(args.requests, args.warmup, args.latency, args.seed)
+        print(json.dumps(result))
+        return 0
+
+    logging.basicConfig(level=logging.WARNING)
+    started = time.time()
+    results = run_cold_start_benchmarks(args.instances, args.requests, args.latency, args.seed,
+                                        args.seed_questions)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    write_results(args.output, results, {
+        'started_at': started,
+        'duration_s': time.time() - started,
+        'seed': args.seed,
+        'instances': args.instances,
+        'requests': args.requests,
+        'seed_questions': args.seed_questions,
+        'environment': environment(),
+    })
+    print(f"Wrote {len(results)} results to {args.output}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
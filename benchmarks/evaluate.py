@@ -0,0 +1,322 @@
+"""
+Offline evaluation of recommendation quality against latency and memory.
+
+Replays a corpus of bars, holds out bottles from each one, asks every
+recommender mode for the top k from the rest of the bar and scores how well
+it recovers the held-out bottles:
+
+    hit_rate     share of users with at least one held-out bottle in the top k
+    recall       share of all held-out bottles found in the top k
+    diversity    mean pairwise distance between a user's recommendations in
+                 the scaled feature space (0 = identical bottles)
+    coverage     share of the catalog recommended to at least one user
+
+together with per-query latency (p50/p99) and the peak traced memory of a
+query. Modes:
+
+    popular   popularity ranking for the user's preferences (cold-start path)
+    content   exact kNN over feature vectors only (value and CF weights 0)
+    value     content plus the value/deal re-ranking (the default without item vectors)
+    ivf       value, searching the approximate IVF index instead of fitting kNN
+    graph     neighbors of the user's bottles in the precomputed similarity graph
+    cf_blend  value plus the co-ownership score, with item vectors trained on
+              the held-in bottles of the corpus (never the held-out ones)
+
+The corpus is either a JSON-lines bar dump (as read by `cooccurrence.py
+ingest`, e.g. the BOB_BAR_SPOOL_PATH spool) or synthetic users whose bars
+cluster around a favorite spirit type and price level. The catalog is the
+bundled dataset, or a synthetic one with --catalog-size.
+
+Examples (from the repository root):
+
+    python -m benchmarks.evaluate
+    python -m benchmarks.evaluate --users 500 --k 10 --modes content,value,ivf
+    python -m benchmarks.evaluate --bars data/bar_spool.jsonl --holdout 3
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+import tracemalloc
+from typing import Callable, Dict, List, Any, Optional
+
+import numpy as np
+
+from benchmarks.harness import environment, write_results
+from benchmarks.synthetic import generate_catalog
+
+MODES = ('popular', 'content', 'value', 'ivf', 'graph', 'cf_blend')
+# Mode the report compares the others against
+BASELINE_MODE = 'value'
+# Queries traced for peak memory; tracemalloc slows allocation-heavy code down
+MEMORY_QUERIES = 10
+
+def synthetic_corpus(catalog, num_users: int, seed: int) -> List[Dict[str, Any]]:
+    """
+    Users whose bars mostly hold one spirit type around one price level, so
+    held-out bottles are predictable from the rest of the bar.
+
+    Returns:
+        List of {'username', 'bottle_ids'}
+    """
+    rng = np.random.default_rng(seed)
+    spirits = catalog['spirit_type'].astype(object).fillna('').astype(str).to_numpy()
+    log_price = np.log(np.clip(catalog['msrp'].to_numpy(dtype=np.float64), 1, None))
+    spirit_values, spirit_counts = np.unique(spirits, return_counts=True)
+    ids = catalog['id'].to_numpy()
+    corpus = []
+    for i in range(num_users):
+        favorite = rng.choice(spirit_values, p=spirit_counts / spirit_counts.sum())
+        price_center = rng.choice(log_price)
+        weights = np.exp(-(log_price - price_center) ** 2 / (2 * 0.35 ** 2))
+        weights *= np.where(spirits == favorite, 1.0, 0.1)
+        size = min(int(rng.integers(6, 40)), int((weights > 0).sum()))
+        rows = rng.choice(len(catalog), size=size, replace=False, p=weights / weights.sum())
+        corpus.append({'username': f'eval-{i}', 'bottle_ids': ids[rows].tolist()})
+    return corpus
+
+def dump_corpus(path: str) -> List[Dict[str, Any]]:
+    """A JSON-lines bar dump as a corpus"""
+    from cooccurrence import read_bar_records
+    return [{'username': username, 'bottle_ids': list(bottle_ids)}
+            for username, bottle_ids in read_bar_records(path)]
+
+def bar_payload(catalog, row_of_id: Dict[Any, int], bottle_ids: List[Any]) -> Dict[str, Any]:
+    """The BAXUS bar payload analyze_preferences expects, built from catalog rows"""
+    bar = []
+    for bottle_id in bottle_ids:
+        bottle = catalog.iloc[row_of_id[bottle_id]]
+        proof = bottle['proof']
+        bar.append({'release_id': bottle_id, 'product': {
+            'id': bottle_id,
+            'name': bottle['name'],
+            'spirit': str(bottle['spirit_type']),
+            'average_msrp': float(bottle['msrp']),
+            'brand': str(bottle['brand_id']),
+            'proof': 0 if proof != proof else float(proof),
+        }})
+    return {'bar': bar}
+
+def split_corpus(corpus: List[Dict[str, Any]], catalog, holdout: int, min_held_in: int,
+                 seed: int) -> List[Dict[str, Any]]:
+    """
+    Holds out `holdout` random catalog bottles of each bar; bars too small to
+    keep min_held_in bottles after that are skipped.
+
+    Returns:
+        List of {'username', 'user_data', 'held_in', 'held_out'}
+    """
+    rng = np.random.default_rng(seed)
+    row_of_id = {bottle_id: row for row, bottle_id in enumerate(catalog['id'].tolist())}
+    queries = []
+    for record in corpus:
+        bottle_ids = list(dict.fromkeys(i for i in record['bottle_ids'] if i in row_of_id))
+        if len(bottle_ids) < holdout + min_held_in:
+            continue
+        held_out = set(rng.choice(len(bottle_ids), size=holdout, replace=False).tolist())
+        held_in = [i for n, i in enumerate(bottle_ids) if n not in held_out]
+        queries.append({
+            'username': record['username'],
+            'user_data': bar_payload(catalog, row_of_id, held_in),
+            'held_in': held_in,
+            'held_out': {bottle_ids[n] for n in held_out},
+        })
+    return queries
+
+def train_item_vectors(queries: List[Dict[str, Any]], path: str, seed: int) -> None:
+    """Co-ownership item vectors from the held-in bottles only, written to path"""
+    from cooccurrence import CoOccurrenceMatrix, ItemVectors
+    matrix = CoOccurrenceMatrix()
+    for query in queries:
+        matrix.update_bar(query['username'], query['held_in'])
+    ItemVectors.from_cooccurrence(matrix, seed=seed).save(path)
+
+def _graph_rows(owned_ids: List[Any], k: int) -> np.ndarray:
+    """Catalog rows most similar to the user's bottles, summing similarity over the bar"""
+    from similarity_graph import get_similarity_graph
+    graph = get_similarity_graph()
+    owned_rows = {graph.row_of(bottle_id) for bottle_id in owned_ids} - {None}
+    scores: Dict[int, float] = {}
+    for row in owned_rows:
+        neighbors, similarities = graph.neighbors(row, graph.k)
+        for neighbor, similarity in zip(neighbors.tolist(), similarities.tolist()):
+            if neighbor not in owned_rows:
+                scores[neighbor] = scores.get(neighbor, 0.0) + similarity
+    return np.array(sorted(scores, key=lambda row: (-scores[row], row))[:k], dtype=np.int32)
+
+def rankers(k: int) -> Dict[str, Callable[[Dict[str, Any]], np.ndarray]]:
+    """Ranking function of each mode: query -> catalog rows, best first"""
+    from popularity_index import popular_rows
+    from recommendation_engine import CF_RANKING_WEIGHT, VALUE_RANKING_WEIGHT, rank_collection
+
+    def knn(value_weight: float, cf_weight: float, knn_mode: str):
+        return lambda q: rank_collection(q['preferences'], q['held_in'], k, value_weight, cf_weight, knn_mode)
+
+    return {
+        'popular': lambda q: np.asarray(popular_rows(q['preferences'], q['held_in'], k), dtype=np.int32),
+        'content': knn(0, 0, 'exact'),
+        'value': knn(VALUE_RANKING_WEIGHT, 0, 'exact'),
+        'ivf': knn(VALUE_RANKING_WEIGHT, 0, 'ivf'),
+        'graph': lambda q: _graph_rows(q['held_in'], k),
+        'cf_blend': knn(VALUE_RANKING_WEIGHT, CF_RANKING_WEIGHT, 'exact'),
+    }
+
+def _scaled_features(catalog) -> np.ndarray:
+    """Catalog features scaled to [0, 1] per column, for the diversity metric"""
+    from features import encode_bottle_features
+    X, _ = encode_bottle_features(catalog)
+    X = np.asarray(X, dtype=np.float64)
+    spread = X.max(axis=0) - X.min(axis=0)
+    return (X - X.min(axis=0)) / np.where(spread > 0, spread, 1)
+
+def _diversity(features: np.ndarray, rows: np.ndarray) -> Optional[float]:
+    """Mean pairwise euclidean distance between the given rows' features"""
+    if len(rows) < 2:
+        return None
+    X = features[rows]
+    distances = np.sqrt(((X[:, None, :] - X[None, :, :]) ** 2).sum(axis=-1))
+    return float(distances[np.triu_indices(len(rows), 1)].mean())
+
+def evaluate_mode(name: str, rank: Callable, queries: List[Dict[str, Any]], catalog,
+                  features: np.ndarray, k: int) -> Dict[str, Any]:
+    """Quality, latency and memory of one mode over every query"""
+    ids = catalog['id'].to_numpy()
+    rank(queries[0])  # Builds any index the mode needs outside the timings
+
+    latencies = np.empty(len(queries))
+    hits = found = held_out = 0
+    diversities = []
+    recommended = np.zeros(len(catalog), dtype=bool)
+    for i, query in enumerate(queries):
+        started = time.perf_counter()
+        rows = rank(query)
+        latencies[i] = time.perf_counter() - started
+        found_here = len(set(ids[rows].tolist()) & query['held_out'])
+        hits += found_here > 0
+        found += found_here
+        held_out += len(query['held_out'])
+        recommended[rows] = True
+        diversity = _diversity(features, rows)
+        if diversity is not None:
+            diversities.append(diversity)
+
+    peak = 0
+    for query in queries[:MEMORY_QUERIES]:
+        tracemalloc.start()
+        try:
+            rank(query)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+
+    return {
+        'case': f"eval/{name}",
+        'hit_rate': hits / len(queries),
+        'recall': found / held_out if held_out else 0.0,
+        'diversity': float(np.mean(diversities)) if diversities else 0.0,
+        'coverage': float(recommended.mean()),
+        'mean_ms': float(latencies.mean() * 1000),
+        'p50_ms': float(np.percentile(latencies, 50) * 1000),
+        'p99_ms': float(np.percentile(latencies, 99) * 1000),
+        'peak_mib': peak / (1024 * 1024),
+    }
+
+def print_report(results: List[Dict[str, Any]], k: int, baseline: str = BASELINE_MODE) -> None:
+    """Side-by-side table, with quality and latency relative to the baseline mode"""
+    reference = next((r for r in results if r['case'] == f"eval/{baseline}"), None)
+    print(f"\n{'mode':<10} {f'hit@{k}':>7} {'recall':>7} {'divers':>7} {'cover':>7} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'MiB':>6}   vs {baseline}")
+    for row in results:
+        versus = ''
+        if reference is not None and row is not reference:
+            speedup = reference['p50_ms'] / row['p50_ms'] if row['p50_ms'] else float('inf')
+            versus = (f"hit {row['hit_rate'] - reference['hit_rate']:+.3f}  "
+                      f"p50 x{speedup:.2f}")
+        print(f"{row['case'][len('eval/'):]:<10} {row['hit_rate']:7.3f} {row['recall']:7.3f} "
+              f"{row['diversity']:7.3f} {row['coverage']:7.3f} {row['p50_ms']:8.2f} {row['p99_ms']:8.2f} "
+              f"{row['peak_mib']:6.1f}   {versus}")
+
+def run_evaluation(modes: List[str], k: int, holdout: int, users: int, bars_path: Optional[str],
+                   catalog_size: Optional[int], seed: int, workdir: str) -> List[Dict[str, Any]]:
+    import cooccurrence
+    from bottle_dataset import clear_catalog_cache, get_bottle_dataset
+    from recommendation_engine import SPARSE_PROFILE_THRESHOLD, analyze_preferences
+
+    if catalog_size:
+        path = os.path.join(workdir, f"catalog_{catalog_size}.csv")
+        generate_catalog(catalog_size, seed).to_csv(path, index=False)
+        os.environ['BOB_DATASET_PATH'] = path
+        clear_catalog_cache()
+    catalog = get_bottle_dataset()
+
+    corpus = dump_corpus(bars_path) if bars_path else synthetic_corpus(catalog, users, seed)
+    queries = split_corpus(corpus, catalog, holdout, SPARSE_PROFILE_THRESHOLD, seed)
+    if not queries:
+        raise SystemExit(f"No bar has {holdout + SPARSE_PROFILE_THRESHOLD} catalog bottles to evaluate on")
+    for query in queries:
+        query['preferences'] = analyze_preferences(query['user_data'])
+    print(f"{len(queries)} users from {'the dump ' + bars_path if bars_path else 'the synthetic corpus'}, "
+          f"catalog of {len(catalog)} bottles, {holdout} held out per bar", flush=True)
+
+    # Only cf_blend sees item vectors, and only ones trained without the held-out bottles
+    vectors_path = os.path.join(workdir, 'item_vectors.npz')
+    original_vectors_path = cooccurrence.VECTORS_PATH
+    cooccurrence.VECTORS_PATH = os.path.join(workdir, 'no_item_vectors.npz')
+    features = _scaled_features(catalog)
+    ranking = rankers(k)
+    results = []
+    try:
+        for mode in modes:
+            if mode == 'cf_blend':
+                train_item_vectors(queries, vectors_path, seed)
+                cooccurrence.VECTORS_PATH = vectors_path
+            row = evaluate_mode(mode, ranking[mode], queries, catalog, features, k)
+            row['params'] = {'mode': mode, 'k': k, 'holdout': holdout, 'users': len(queries),
+                             'catalog_size': len(catalog), 'corpus': bars_path or 'synthetic'}
+            print(f"  {mode:<10} hit@{k} {row['hit_rate']:.3f}  p50 {row['p50_ms']:.2f} ms", flush=True)
+            results.append(row)
+    finally:
+        cooccurrence.VECTORS_PATH = original_vectors_path
+    return results
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Evaluate recommendation quality against latency")
+    parser.add_argument('--modes', default=','.join(MODES),
+                        help=f"Comma-separated modes to compare ({', '.join(MODES)})")
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--holdout', type=int, default=2, help="Bottles held out per bar")
+    parser.add_argument('--users', type=int, default=300, help="Synthetic users (ignored with --bars)")
+    parser.add_argument('--bars', help="JSON-lines bar dump to replay instead of synthetic users")
+    parser.add_argument('--catalog-size', type=int, help="Use a synthetic catalog of this size")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmarks/results/evaluation.json')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    modes = [m.strip() for m in args.modes.split(',') if m.strip()]
+    unknown = [m for m in modes if m not in MODES]
+    if unknown:
+        parser.error(f"Unknown modes: {', '.join(unknown)}")
+
+    started = time.time()
+    with tempfile.TemporaryDirectory(prefix='bob-eval-') as workdir:
+        results = run_evaluation(modes, args.k, args.holdout, args.users, args.bars,
+                                 args.catalog_size, args.seed, workdir)
+    print_report(results, args.k, BASELINE_MODE if BASELINE_MODE in modes else modes[0])
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    write_results(args.output, results, {
+        'started_at': started,
+        'duration_s': time.time() - started,
+        'seed': args.seed,
+        'k': args.k,
+        'holdout': args.holdout,
+        'environment': environment(),
+    })
+    print(f"Wrote {len(results)} results to {args.output}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""
+Timing, memory and comparison helpers shared by the benchmark scripts.
+"""
+import gc
+import json
+import time
+import platform
+import tracemalloc
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Any, Optional
+
+import numpy as np
+
+def measure(func: Callable[[], Any], repeat: int = 20, warmup: int = 2,
+            items: int = 1) -> Dict[str, float]:
+    """
+    Times repeated calls of a zero-argument callable.
+
+    Latencies are collected with the GC disabled so that collections triggered
+    by earlier cases don't land in this one. Peak memory is measured in a
+    separate traced call, since tracemalloc slows allocation-heavy code down.
+
+    Args:
+        func: The work to time
+        repeat: Number of timed calls
+        warmup: Untimed calls made first to populate caches
+        items: Items processed per call, used to report item throughput
+
+    Returns:
+        Dictionary of latency percentiles (ms), throughput and peak memory (MiB)
+    """
+    for _ in range(warmup):
+        func()
+
+    latencies = np.empty(repeat)
+    gc_enabled = gc.isenabled()
+    gc.collect()
+    gc.disable()
+    try:
+        for i in range(repeat):
+            start = time.perf_counter()
+            func()
+            latencies[i] = time.perf_counter() - start
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    total = float(latencies.sum())
+    return {
+        'repeat': repeat,
+        'mean_ms': float(latencies.mean() * 1000),
+        'p50_ms': float(np.percentile(latencies, 50) * 1000),
+        'p90_ms': float(np.percentile(latencies, 90) * 1000),
+        'p99_ms': float(np.percentile(latencies, 99) * 1000),
+        'max_ms': float(latencies.max() * 1000),
+        'calls_per_sec': repeat / total if total else float('inf'),
+        'items_per_sec': repeat * items / total if total else float('inf'),
+        'peak_mib': peak / (1024 * 1024),
+    }
+
+class StubOpenAIClient:
+    """
+    Minimal stand-in for openai.OpenAI that answers instantly.
+
+    An optional fixed latency simulates the network round trip so chat
+    benchmarks can separate our own overhead from the upstream's.
+    """
+
+    def __init__(self, latency: float = 0.0, reply: str = "Try a Speyside single malt."):
+        self.latency = latency
+        self.reply = reply
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        message = SimpleNamespace(content=self.reply)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+def environment() -> Dict[str, str]:
+    """Describe the machine and library versions a result file was produced on"""
+    import pandas
+    import sklearn
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'numpy': np.__version__,
+        'pandas': pandas.__version__,
+        'sklearn': sklearn.__version__,
+    }
+
+def write_results(path: str, results: List[Dict[str, Any]], meta: Dict[str, Any]) -> None:
+    """Write a result file: run metadata plus one entry per benchmark case"""
+    with open(path, 'w') as f:
+        json.dump({'meta': meta, 'results': results}, f, indent=2, sort_keys=True)
+
+def load_results(path: str) -> Dict[str, Dict[str, Any]]:
+    """Load a result file keyed by case name"""
+    with open(path) as f:
+        data = json.load(f)
+    return {result['case']: result for result in data['results']}
+
+def compare(baseline: Dict[str, Dict[str, Any]], current: Dict[str, Dict[str, Any]],
+            metric: str = 'p50_ms', threshold: float = 0.10,
+            memory_threshold: Optional[float] = 0.25) -> List[Dict[str, Any]]:
+    """
+    Compare two result sets case by case.
+
+    Args:
+        baseline: Results of the reference run, keyed by case name
+        current: Results of the candidate run, keyed by case name
+        metric: Latency metric to compare
+        threshold: Relative slowdown that counts as a regression
+        memory_threshold: Relative peak-memory growth that counts as a
+            regression, or None to ignore memory
+
+    Returns:
+        One row per case present in both runs, with a 'regression' flag
+    """
+    rows = []
+    for case in sorted(baseline.keys() & current.keys()):
+        before, after = baseline[case], current[case]
+        change = (after[metric] - before[metric]) / before[metric] if before[metric] else 0.0
+        memory_change = ((after['peak_mib'] - before['peak_mib']) / before['peak_mib']
+                         if before.get('peak_mib') else 0.0)
+        regression = change > threshold
+        if memory_threshold is not None and memory_change > memory_threshold:
+            regression = True
+        rows.append({
+            'case': case,
+            'before': before[metric],
+            'after': after[metric],
+            'change': change,
+            'memory_change': memory_change,
+            'regression': regression,
+        })
+    return rows
@@ -0,0 +1,141 @@
+"""
+Checks of the bottle image route (/images/bottles/<id>/<size>) against a stub
+image host.
+
+A local HTTP server stands in for the CDN and serves three catalog images:
+
+    /bottle.png    a 1200x800 PNG
+    /missing.png   404
+    /page.html     200 with a non-image content type
+
+The app's catalog image lookup is pointed at them and thumbnails are written
+to a temporary BOB_IMAGE_CACHE_DIR. The script checks that:
+
+    - every size in THUMBNAIL_SIZES is resized to its longest edge (needs Pillow)
+    - the source is downloaded once for all sizes
+    - plain URLs are cached for a day, ?v=<content hash> URLs are immutable
+      and a stale ?v= is not
+    - If-None-Match with the thumbnail's ETag gets a 304
+    - a source that 404s or isn't an image redirects to the original URL
+    - unknown sizes and bottles are 404s
+
+and exits non-zero if any check fails.
+
+Example (from the repository root):
+
+    python -m benchmarks.images
+"""
+import io
+import sys
+import logging
+import argparse
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+
+from PIL import Image
+
+SOURCE_SIZE = (1200, 800)
+
+class _StubImageHost(BaseHTTPRequestHandler):
+    """Serves `files` by path and counts the requests for each"""
+    files: Dict[str, Tuple[int, str, bytes]] = {}
+    requests: Dict[str, int] = {}
+
+    def do_GET(self):
+        self.requests[self.path] = self.requests.get(self.path, 0) + 1
+        status, content_type, body = self.files.get(self.path, (404, 'text/plain', b'not found'))
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def _png(size: Tuple[int, int]) -> bytes:
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (180, 120, 40)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def run_image_checks() -> List[Tuple[str, bool, str]]:
+    """(check, passed, detail) for each check of the image route"""
+    import app as web
+    import image_proxy
+
+    _StubImageHost.files = {
+        '/bottle.png': (200, 'image/png', _png(SOURCE_SIZE)),
+        '/missing.png': (404, 'text/plain', b'not found'),
+        '/page.html': (200, 'text/html; charset=utf-8', b'<html></html>'),
+    }
+    _StubImageHost.requests = {}
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _StubImageHost)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host = f"http://127.0.0.1:{server.server_address[1]}"
+    urls = {1: f"{host}/bottle.png", 2: f"{host}/missing.png", 3: f"{host}/page.html"}
+
+    checks = []
+
+    def check(name: str, passed: bool, detail: str = '') -> None:
+        checks.append((name, bool(passed), detail))
+
+    bottle_image_url, cache_root = web.bottle_image_url, web.thumbnail_cache.root
+    with tempfile.TemporaryDirectory() as directory:
+        web.bottle_image_url = urls.get
+        web.thumbnail_cache.root = directory
+        client = web.app.test_client()
+        try:
+            for size, edge in image_proxy.THUMBNAIL_SIZES.items():
+                response = client.get(f'/images/bottles/1/{size}')
+                if response.status_code != 200:
+                    check(f"{size} thumbnail", False, f"status {response.status_code}")
+                    continue
+                dimensions = Image.open(io.BytesIO(response.data)).size
+                check(f"{size} thumbnail is {edge}px", max(dimensions) == edge,
+                      f"{dimensions[0]}x{dimensions[1]} {response.mimetype}")
+            check("source fetched once for all sizes", _StubImageHost.requests.get('/bottle.png') == 1,
+                  f"{_StubImageHost.requests.get('/bottle.png', 0)} fetches")
+
+            response = client.get('/images/bottles/1/md')
+            etag = response.headers.get('ETag', '').strip('"')
+            cache_control = response.headers.get('Cache-Control', '')
+            check("plain URL cached for a day", 'max-age=86400' in cache_control and
+                  'immutable' not in cache_control, cache_control)
+            cache_control = client.get(f'/images/bottles/1/md?v={etag}').headers.get('Cache-Control', '')
+            check("?v=<hash> URL is immutable", 'immutable' in cache_control and
+                  'max-age=31536000' in cache_control, cache_control)
+            cache_control = client.get('/images/bottles/1/md?v=stale').headers.get('Cache-Control', '')
+            check("stale ?v= URL is not immutable", 'immutable' not in cache_control, cache_control)
+            response = client.get('/images/bottles/1/md', headers={'If-None-Match': f'"{etag}"'})
+            check("If-None-Match gets 304", response.status_code == 304, f"status {response.status_code}")
+
+            for bottle_id, label in ((2, "404 source"), (3, "non-image source")):
+                response = client.get(f'/images/bottles/{bottle_id}/md')
+                check(f"{label} redirects to the original", response.status_code == 302 and
+                      response.headers.get('Location') == urls[bottle_id],
+                      f"status {response.status_code} -> {response.headers.get('Location')}")
+            check("unknown size is 404", client.get('/images/bottles/1/xl').status_code == 404)
+            check("unknown bottle is 404", client.get('/images/bottles/99/md').status_code == 404)
+        finally:
+            web.bottle_image_url, web.thumbnail_cache.root = bottle_image_url, cache_root
+            server.shutdown()
+    return checks
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Check the bottle image route against a stub image host")
+    parser.parse_args(argv)
+    logging.basicConfig(level=logging.ERROR)
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    checks = run_image_checks()
+    for name, passed, detail in checks:
+        print(f"{'ok  ' if passed else 'FAIL'} {name:<44} {detail}", flush=True)
+    failed = sum(not passed for _, passed, _ in checks)
+    print(f"{len(checks) - failed}/{len(checks)} checks passed")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,240 @@
+"""
+Latency of /recommendations and /chat while BAXUS and OpenAI are down.
+
+BAXUS is replaced by a local HTTP server and OpenAI by a stub client. In the
+'outage' scenarios both hang: the server never answers within the timeout and
+the stub waits out the call's timeout before raising, as a dead upstream
+would. Every /recommendations request misses the bar cache (each user's bar
+is expired but within the stale TTL) and every /chat request, made without a
+user, asks a question that isn't cached, so each one has to consult its
+upstream. Scenarios:
+
+    healthy           upstreams answer
+    outage            upstreams hang; circuit breakers open after
+                      BOB_BREAKER_FAILURES failures
+    outage_no_breaker upstreams hang; breakers never open, so every request
+                      waits out the stage timeouts
+
+For each scenario and route it reports p50/p99 latency, the share of
+responses carrying X-Bob-Degraded and the upstream calls made before the
+route's breaker opened. It then checks that, during an outage, p99 stays
+within the stage timeout plus --margin and the breaker opens within
+BOB_BREAKER_FAILURES calls, and exits non-zero if either check fails.
+
+Examples (from the repository root):
+
+    python -m benchmarks.outage
+    python -m benchmarks.outage --repeat 50 --timeout 0.5 --output benchmarks/results/outage.json
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Any
+
+from benchmarks.harness import StubOpenAIClient, environment, measure, write_results
+from benchmarks.synthetic import generate_bar
+
+SCENARIOS = ('healthy', 'outage', 'outage_no_breaker')
+USERS = 20
+
+class _StubBaxus(BaseHTTPRequestHandler):
+    """Serves /bar/user/<name> from `bars`, or hangs while `down` is set"""
+    bars: Dict[str, Any] = {}
+    down = threading.Event()
+    hang = 30.0
+    requests = 0
+
+    def do_GET(self):
+        type(self).requests += 1
+        if self.down.is_set():
+            time.sleep(self.hang)
+            self.send_response(503)
+            self.end_headers()
+            return
+        body = json.dumps(self.bars.get(self.path.rsplit('/', 1)[-1], [])).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class _FlakyOpenAI(StubOpenAIClient):
+    """Stub client that, while `down`, waits out the call's timeout and raises"""
+
+    def __init__(self, latency: float):
+        super().__init__(latency)
+        self.down = False
+
+    def _create(self, **kwargs):
+        if self.down:
+            self.calls += 1
+            time.sleep(kwargs.get('timeout') or 0)
+            raise TimeoutError("Request timed out.")
+        return super()._create(**kwargs)
+
+def run_outage_benchmarks(repeat: int, timeout: float, latency: float, seed: int) -> List[Dict[str, Any]]:
+    import pandas as pd
+    import app as web
+    import baxus_api
+    import bob_chat
+    from bottle_dataset import _resolve_dataset_path, get_bottle_dataset
+    from request_context import user_cache
+    from resilience import baxus_breaker, openai_breaker
+
+    get_bottle_dataset()
+    raw_catalog = pd.read_csv(_resolve_dataset_path())
+    usernames = [f'bench-outage-{i}' for i in range(USERS)]
+    bars = {name: generate_bar(raw_catalog, 25, seed + i)['bar'] for i, name in enumerate(usernames)}
+    _StubBaxus.bars = bars
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _StubBaxus)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    baxus_api.BAXUS_API_BASE_URL = f"http://127.0.0.1:{server.server_address[1]}"
+    baxus_api.BAXUS_TIMEOUT = timeout
+    openai = _FlakyOpenAI(latency)
+    bob_chat.client = openai
+    bob_chat.OPENAI_TIMEOUT = timeout
+    os.environ.setdefault('OPENAI_API_KEY', 'bench')
+    web.OPENAI_API_KEY = os.environ['OPENAI_API_KEY']
+
+    client = web.app.test_client()
+    calls = {'n': 0, 'degraded': 0, 'scenario': '', 'opened_after': None}
+
+    def note_breaker(breaker, upstream_calls: int) -> None:
+        """Remember how many upstream calls the route made before its breaker first opened"""
+        if calls['opened_after'] is None and breaker.state != 'closed':
+            calls['opened_after'] = upstream_calls
+
+    def get_recommendations():
+        calls['n'] += 1
+        username = usernames[calls['n'] % USERS]
+        # Expired, so BAXUS is asked again, but young enough to serve while it's down
+        baxus_api.store_user_bar_data(username, {'bar': bars[username]},
+                                      fetched_at=time.time() - baxus_api.BAR_CACHE_TTL - 1)
+        with client.session_transaction() as session:
+            session['username'] = username
+        response = client.get('/recommendations')
+        assert response.status_code == 200, response.status_code
+        calls['degraded'] += 'X-Bob-Degraded' in response.headers
+        note_breaker(baxus_breaker, _StubBaxus.requests)
+
+    def post_chat():
+        calls['n'] += 1
+        # Anonymous, so the chat numbers are about OpenAI alone
+        with client.session_transaction() as session:
+            session.pop('chat_history', None)
+            session.pop('username', None)
+        response = client.post('/chat', json={'message': f"Tell me about Lagavulin ({calls['scenario']} {calls['n']})"})
+        assert response.status_code == 200, response.status_code
+        calls['degraded'] += 'X-Bob-Degraded' in response.headers
+        note_breaker(openai_breaker, openai.calls)
+
+    results = []
+    try:
+        for scenario in SCENARIOS:
+            down = scenario != 'healthy'
+            if down:
+                _StubBaxus.down.set()
+            else:
+                _StubBaxus.down.clear()
+            openai.down = down
+            for breaker in (baxus_breaker, openai_breaker):
+                breaker.reset()
+                breaker.failure_threshold = 10 ** 9 if scenario == 'outage_no_breaker' else \
+                    int(os.environ.get('BOB_BREAKER_FAILURES', 5))
+            for route, func in (('/recommendations', get_recommendations), ('/chat', post_chat)):
+                user_cache.clear()
+                web.recommendations_cache.clear()
+                calls.update(n=0, degraded=0, scenario=scenario, opened_after=None)
+                _StubBaxus.requests = openai.calls = 0
+                stats = measure(func, repeat=repeat, warmup=2)
+                row = {'case': f"{scenario}{route}", 'params': {'scenario': scenario, 'route': route,
+                                                                'timeout_s': timeout},
+                       'degraded_share': calls['degraded'] / max(1, calls['n']),
+                       'breaker_opened_after': calls['opened_after'], **stats}
+                print(f"{scenario:<18} {route:<16} p50 {stats['p50_ms']:8.1f} ms  p99 {stats['p99_ms']:8.1f} ms  "
+                      f"degraded {row['degraded_share']:4.0%}  breaker opened after "
+                      f"{'-' if calls['opened_after'] is None else calls['opened_after']} calls", flush=True)
+                results.append(row)
+    finally:
+        _StubBaxus.down.clear()
+        server.shutdown()
+        for breaker in (baxus_breaker, openai_breaker):
+            breaker.reset()
+    return results
+
+def check_outage_results(results: List[Dict[str, Any]], timeout: float, margin: float,
+                         failure_threshold: int) -> List[str]:
+    """
+    Failed expectations of an outage run.
+
+    Args:
+        results: Rows from run_outage_benchmarks
+        timeout: Stage timeout the run used, in seconds
+        margin: Seconds a request may take beyond the stage timeout
+        failure_threshold: Failures in a row that should open a breaker
+
+    Returns:
+        One message per failed check; empty if the run behaved as expected
+    """
+    failures = []
+    limit_ms = (timeout + margin) * 1000
+    for row in results:
+        scenario = row['params']['scenario']
+        if scenario == 'healthy':
+            continue
+        if row['p99_ms'] > limit_ms:
+            failures.append(f"{row['case']}: p99 {row['p99_ms']:.1f} ms exceeds the "
+                            f"{timeout * 1000:.0f} ms stage timeout plus {margin * 1000:.0f} ms")
+        if scenario == 'outage':
+            opened_after = row['breaker_opened_after']
+            if opened_after is None or opened_after > failure_threshold:
+                failures.append(f"{row['case']}: breaker opened after "
+                                f"{'no' if opened_after is None else opened_after} upstream calls, "
+                                f"expected at most {failure_threshold}")
+    return failures
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Measure route latency during an injected upstream outage")
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--timeout', type=float, default=1.0,
+                        help="BAXUS and OpenAI stage timeout in seconds (the services default to 3 and 8)")
+    parser.add_argument('--latency', type=float, default=0.05, help="Healthy OpenAI stub latency in seconds")
+    parser.add_argument('--margin', type=float, default=0.1,
+                        help="Seconds an outage request may take beyond the stage timeout")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmarks/results/outage.json')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.ERROR)
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    started = time.time()
+    results = run_outage_benchmarks(args.repeat, args.timeout, args.latency, args.seed)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    write_results(args.output, results, {
+        'started_at': started,
+        'duration_s': time.time() - started,
+        'seed': args.seed,
+        'repeat': args.repeat,
+        'timeout_s': args.timeout,
+        'environment': environment(),
+    })
+    print(f"Wrote {len(results)} results to {args.output}")
+
+    failures = check_outage_results(results, args.timeout, args.margin,
+                                    int(os.environ.get('BOB_BREAKER_FAILURES', 5)))
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
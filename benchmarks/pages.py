@@ -0,0 +1,138 @@
+"""
+Bytes transferred and server CPU per page view.
+
+Serves /, /chat and /recommendations through the Flask test client (the
+recommendations user's bar is placed in the BAXUS bar cache) and reports,
+for each page:
+
+    cpu_ms         server CPU per page render, with the {% cache %} fragments
+                   disabled ('plain') and warm ('fragments'); the page and
+                   user result caches are cleared so every view renders
+    first_kib      HTML plus linked local assets on a first visit: plain
+                   /static files, or the fingerprinted build in the best
+                   encoding a browser accepts ('br, gzip')
+    repeat_reqs    asset requests on a repeat visit: /static files are
+                   revalidated one by one, fingerprinted ones are immutable
+                   and not requested at all
+    asset_cpu_ms   server CPU to serve the page's assets once
+
+Examples (from the repository root):
+
+    python -m benchmarks.pages
+    python -m benchmarks.pages --repeat 200 --output benchmarks/results/pages.json
+"""
+import os
+import re
+import sys
+import time
+import logging
+import argparse
+from typing import Dict, List, Any
+
+from benchmarks.harness import environment, write_results
+from benchmarks.synthetic import generate_bar
+
+PAGES = ('/', '/chat', '/recommendations')
+ACCEPT_ENCODING = 'br, gzip'
+
+_LOCAL_ASSET_RE = re.compile(r'(?:src|href)="(/(?:static|assets)/[^"]+)"')
+
+def _cpu_per_call(func, repeat: int) -> float:
+    """Mean process CPU time of func in milliseconds"""
+    func()
+    started = time.process_time()
+    for _ in range(repeat):
+        func()
+    return (time.process_time() - started) / repeat * 1000
+
+def _fetch_assets(client, urls: List[str]) -> int:
+    """Bytes of the bodies of the given asset URLs"""
+    total = 0
+    for url in urls:
+        response = client.get(url, headers={'Accept-Encoding': ACCEPT_ENCODING})
+        assert response.status_code == 200, (url, response.status_code)
+        total += len(response.data)
+    return total
+
+def _revalidations(client, urls: List[str]) -> int:
+    """Asset requests a repeat visit makes: everything not cached as immutable"""
+    return sum('immutable' not in client.get(url).headers.get('Cache-Control', '') for url in urls)
+
+def run_page_benchmarks(repeat: int, seed: int) -> List[Dict[str, Any]]:
+    import pandas as pd
+    import app as web
+    from baxus_api import store_user_bar_data
+    from bottle_dataset import _resolve_dataset_path, get_bottle_dataset
+    from request_context import user_cache
+    from static_assets import asset_registry
+
+    get_bottle_dataset()
+    raw_catalog = pd.read_csv(_resolve_dataset_path())
+    username = 'bench-pages'
+    store_user_bar_data(username, generate_bar(raw_catalog, 25, seed), fetched_at=time.time() + 10 ** 6)
+    client = web.app.test_client()
+    with client.session_transaction() as session:
+        session['username'] = username
+    jinja_env = web.app.jinja_env
+
+    results = []
+    for page in PAGES:
+        def view():
+            web.recommendations_cache.clear()
+            response = client.get(page)
+            assert response.status_code == 200, (page, response.status_code)
+            return response
+
+        row: Dict[str, Any] = {'case': f"page_view{page}", 'params': {'page': page}}
+        # Rankings stay cached so the numbers are about rendering
+        view()
+        for mode, enabled in (('plain', False), ('fragments', True)):
+            jinja_env.fragment_cache_enabled = enabled
+            jinja_env.fragment_cache.clear()
+            row[f'cpu_ms_{mode}'] = _cpu_per_call(view, repeat)
+        jinja_env.fragment_cache_enabled = True
+
+        html = view().data
+        built_urls = _LOCAL_ASSET_RE.findall(html.decode())
+        # The same page as linked before the build: every asset under /static
+        by_path = {asset.path: name for name, asset in asset_registry.assets.items()}
+        plain_urls = [f"/static/{by_path.get(url[len('/assets/'):], url[len('/static/'):])}"
+                      if url.startswith('/assets/') else url for url in built_urls]
+
+        for mode, urls in (('plain', plain_urls), ('built', built_urls)):
+            row[f'first_kib_{mode}'] = (len(html) + _fetch_assets(client, urls)) / 1024
+            row[f'repeat_reqs_{mode}'] = _revalidations(client, urls)
+            row[f'asset_cpu_ms_{mode}'] = _cpu_per_call(lambda: _fetch_assets(client, urls), repeat)
+        user_cache.clear()
+
+        print(f"{page:<17} cpu {row['cpu_ms_plain']:6.2f} -> {row['cpu_ms_fragments']:6.2f} ms  "
+              f"first view {row['first_kib_plain']:6.1f} -> {row['first_kib_built']:6.1f} KiB  "
+              f"repeat-view asset requests {row['repeat_reqs_plain']} -> {row['repeat_reqs_built']}  "
+              f"asset cpu {row['asset_cpu_ms_plain']:5.2f} -> {row['asset_cpu_ms_built']:5.2f} ms", flush=True)
+        results.append(row)
+    return results
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Measure bytes and server CPU per page view")
+    parser.add_argument('--repeat', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmarks/results/pages.json')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    started = time.time()
+    results = run_page_benchmarks(args.repeat, args.seed)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    write_results(args.output, results, {
+        'started_at': started,
+        'duration_s': time.time() - started,
+        'seed': args.seed,
+        'repeat': args.repeat,
+        'environment': environment(),
+    })
+    print(f"Wrote {len(results)} results to {args.output}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,242 @@
+"""
+Benchmark runner for the recommendation and chat pipelines.
+
+Examples (from the repository root):
+
+    # Default sizes, results written to benchmarks/results/latest.json
+    python -m benchmarks.run run
+
+    # Full sweep up to a 1M-bottle catalog and 50k-bottle bars
+    python -m benchmarks.run run --full --output benchmarks/results/full.json
+
+    # Fail (exit 1) if any case got more than 10% slower than the baseline
+    python -m benchmarks.run compare baseline.json benchmarks/results/latest.json
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+from typing import Dict, List, Any, Callable
+
+from benchmarks.harness import (StubOpenAIClient, compare, environment, load_results,
+                                measure, write_results)
+from benchmarks.synthetic import generate_bar, generate_catalog
+
+DEFAULT_CATALOG_SIZES = [500, 5000, 50000]
+FULL_CATALOG_SIZES = [500, 5000, 50000, 250000, 1000000]
+DEFAULT_BAR_SIZES = [1, 10, 100, 1000]
+FULL_BAR_SIZES = [1, 10, 100, 1000, 10000, 50000]
+
+# Bar size used when sweeping catalog sizes, and catalog size used when sweeping bars
+REFERENCE_BAR_SIZE = 25
+REFERENCE_CATALOG_SIZE = 500
+
+def _parse_sizes(value: str) -> List[int]:
+    return [int(size) for size in value.split(',') if size.strip()]
+
+def _scaled_repeat(repeat: int, work: int) -> int:
+    """Fewer repetitions for very large inputs so a full sweep stays practical"""
+    return max(3, min(repeat, repeat * 5000 // max(work, 1)))
+
+class BenchmarkRun:
+    """Generates the inputs for one run and collects a result row per case"""
+
+    def __init__(self, workdir: str, repeat: int, seed: int):
+        self.workdir = workdir
+        self.repeat = repeat
+        self.seed = seed
+        self.results: List[Dict[str, Any]] = []
+        self._catalogs: Dict[int, str] = {}
+
+    def catalog_path(self, size: int) -> str:
+        """Write (once) and return the CSV path of a synthetic catalog"""
+        if size not in self._catalogs:
+            path = os.path.join(self.workdir, f"catalog_{size}.csv")
+            generate_catalog(size, self.seed).to_csv(path, index=False)
+            self._catalogs[size] = path
+        return self._catalogs[size]
+
+    def use_catalog(self, size: int) -> None:
+        """Point get_bottle_dataset() at a synthetic catalog"""
+        os.environ['BOB_DATASET_PATH'] = self.catalog_path(size)
+
+    def bar(self, catalog_size: int, bar_size: int) -> Dict[str, Any]:
+        import pandas as pd
+        catalog = pd.read_csv(self.catalog_path(catalog_size))
+        return generate_bar(catalog, bar_size, self.seed)
+
+    def case(self, name: str, func: Callable[[], Any], work: int = 1, items: int = 1,
+             **params: Any) -> None:
+        repeat = _scaled_repeat(self.repeat, work)
+        stats = measure(func, repeat=repeat, warmup=1, items=items)
+        self.results.append({'case': name, 'params': params, **stats})
+        print(f"{name:<55} p50 {stats['p50_ms']:>10.2f} ms  p99 {stats['p99_ms']:>10.2f} ms  "
+              f"{stats['items_per_sec']:>12.1f} items/s  peak {stats['peak_mib']:>8.1f} MiB",
+              flush=True)
+
+def run_benchmarks(catalog_sizes: List[int], bar_sizes: List[int], repeat: int,
+                   seed: int) -> BenchmarkRun:
+    """Run every pipeline case over the requested input sizes"""
+    from bottle_dataset import clear_catalog_cache, get_bottle_dataset
+    from candidate_index import get_candidate_index
+    from recommendation_engine import (analyze_preferences, generate_recommendations,
+                                       generate_recommendation_explanation, owned_bottle_ids)
+    from models import Bottle
+    import bob_chat
+
+    with tempfile.TemporaryDirectory(prefix='bob-bench-') as workdir:
+        run = BenchmarkRun(workdir, repeat, seed)
+
+        for size in catalog_sizes:
+            path = run.catalog_path(size)
+            # Cold load parses the CSV and builds the eager catalog artifacts
+            run.case(f"get_bottle_dataset/catalog={size}",
+                     lambda: (clear_catalog_cache(), get_bottle_dataset(path)),
+                     work=size, items=size, catalog_size=size)
+            run.case(f"get_bottle_dataset/warm,catalog={size}",
+                     lambda: get_bottle_dataset(path), catalog_size=size)
+
+        for bar_size in bar_sizes:
+            user_data = run.bar(max(REFERENCE_CATALOG_SIZE, min(bar_size, 50000)), bar_size)
+            run.case(f"analyze_preferences/bar={bar_size}",
+                     lambda: analyze_preferences(user_data), work=bar_size // 10,
+                     items=bar_size, bar_size=bar_size)
+
+        for size in catalog_sizes:
+            run.use_catalog(size)
+            user_data = run.bar(size, REFERENCE_BAR_SIZE)
+            preferences = analyze_preferences(user_data)
+            run.case(f"generate_recommendations/catalog={size},bar={REFERENCE_BAR_SIZE}",
+                     lambda: generate_recommendations(preferences, user_data),
+                     work=size, catalog_size=size, bar_size=REFERENCE_BAR_SIZE)
+            
+            # Candidate selection alone: the full-catalog mask it replaced, then
+            # the MSRP-sorted slice minus the owned-row bitset
+            catalog = get_bottle_dataset()
+            owned = owned_bottle_ids(user_data)
+            price_range = (max(0, preferences.average_bottle_price * 0.5), preferences.price_ceiling)
+            run.case(f"candidate_selection/mask,catalog={size}",
+                     lambda: catalog[~catalog['id'].isin(owned) & (catalog['msrp'] >= price_range[0]) &
+                                     (catalog['msrp'] <= price_range[1])].index.to_numpy(),
+                     work=size // 10, catalog_size=size)
+            run.case(f"candidate_selection/catalog={size}",
+                     lambda: get_candidate_index().candidates(*price_range, owned),
+                     catalog_size=size)
+
+        run.use_catalog(REFERENCE_CATALOG_SIZE)
+        for bar_size in bar_sizes:
+            user_data = run.bar(REFERENCE_CATALOG_SIZE, bar_size)
+            preferences = analyze_preferences(user_data)
+            run.case(f"generate_recommendations/catalog={REFERENCE_CATALOG_SIZE},bar={bar_size}",
+                     lambda: generate_recommendations(preferences, user_data),
+                     work=bar_size // 10, catalog_size=REFERENCE_CATALOG_SIZE,
+                     bar_size=bar_size)
+
+            # The explanation scans the user's bar, so its cost grows with bar size
+            bottle = Bottle.from_catalog(get_bottle_dataset(), [0])[0]
+            run.case(f"generate_recommendation_explanation/bar={bar_size}",
+                     lambda: generate_recommendation_explanation(bottle, preferences, user_data),
+                     work=bar_size // 10, bar_size=bar_size)
+
+        # Chat against a stubbed OpenAI backend: a cache miss builds the full
+        # prompt and calls the client, a hit returns straight from the cache
+        os.environ.setdefault('OPENAI_API_KEY', 'benchmark-stub')
+        stub = StubOpenAIClient()
+        original_client = bob_chat.client
+        bob_chat.client = stub
+        try:
+            user_data = run.bar(REFERENCE_CATALOG_SIZE, REFERENCE_BAR_SIZE)
+            preferences = analyze_preferences(user_data)
+            counter = iter(range(10 ** 9))
+            run.case("chat_with_bob/cache_miss",
+                     lambda: bob_chat.chat_with_bob(
+                         [{"role": "user", "content": f"Something smoky, take {next(counter)}?"}],
+                         'benchmark', preferences))
+            run.case("chat_with_bob/cache_hit",
+                     lambda: bob_chat.chat_with_bob(
+                         [{"role": "user", "content": "What is a single malt?"}],
+                         'benchmark', preferences))
+            # A follow-up: the key hashes the whole conversation prefix
+            follow_up = [{"role": "user", "content": "What is a single malt?"},
+                         {"role": "assistant", "content": "Malted barley from one distillery."},
+                         {"role": "user", "content": "Which ones under $40?"}]
+            bob_chat.chat_with_bob(follow_up, 'benchmark', preferences)
+            run.case("chat_with_bob/cache_hit_follow_up",
+                     lambda: bob_chat.chat_with_bob(follow_up, 'benchmark', preferences))
+        finally:
+            bob_chat.client = original_client
+        return run
+
+def command_run(args: argparse.Namespace) -> int:
+    catalog_sizes = _parse_sizes(args.catalog_sizes) if args.catalog_sizes else (
+        FULL_CATALOG_SIZES if args.full else DEFAULT_CATALOG_SIZES)
+    bar_sizes = _parse_sizes(args.bar_sizes) if args.bar_sizes else (
+        FULL_BAR_SIZES if args.full else DEFAULT_BAR_SIZES)
+
+    started = time.time()
+    run = run_benchmarks(catalog_sizes, bar_sizes, args.repeat, args.seed)
+    meta = {
+        'started_at': started,
+        'duration_s': time.time() - started,
+        'seed': args.seed,
+        'repeat': args.repeat,
+        'catalog_sizes': catalog_sizes,
+        'bar_sizes': bar_sizes,
+        'environment': environment(),
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    write_results(args.output, run.results, meta)
+    print(f"Wrote {len(run.results)} results to {args.output}")
+    return 0
+
+def command_compare(args: argparse.Namespace) -> int:
+    rows = compare(load_results(args.baseline), load_results(args.current),
+                   metric=args.metric, threshold=args.threshold,
+                   memory_threshold=None if args.ignore_memory else args.memory_threshold)
+    for row in rows:
+        flag = "REGRESSION" if row['regression'] else "ok"
+        print(f"{row['case']:<55} {row['before']:>10.2f} -> {row['after']:>10.2f} ms "
+              f"({row['change']:+.1%}, mem {row['memory_change']:+.1%})  {flag}")
+    regressions = [row for row in rows if row['regression']]
+    if regressions:
+        print(f"{len(regressions)} of {len(rows)} cases regressed")
+        return 1
+    print(f"No regressions across {len(rows)} cases")
+    return 0
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the recommendation and chat pipelines")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="Run the benchmark suite")
+    run_parser.add_argument('--catalog-sizes', help="Comma-separated catalog sizes")
+    run_parser.add_argument('--bar-sizes', help="Comma-separated bar sizes")
+    run_parser.add_argument('--full', action='store_true',
+                            help="Sweep catalogs up to 1M bottles and bars up to 50k")
+    run_parser.add_argument('--repeat', type=int, default=20, help="Timed calls per case")
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--output', default='benchmarks/results/latest.json')
+    run_parser.set_defaults(func=command_run)
+
+    compare_parser = subparsers.add_parser('compare', help="Compare two result files")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--metric', default='p50_ms',
+                                choices=['mean_ms', 'p50_ms', 'p90_ms', 'p99_ms'])
+    compare_parser.add_argument('--threshold', type=float, default=0.10,
+                                help="Relative slowdown treated as a regression")
+    compare_parser.add_argument('--memory-threshold', type=float, default=0.25,
+                                help="Relative peak-memory growth treated as a regression")
+    compare_parser.add_argument('--ignore-memory', action='store_true')
+    compare_parser.set_defaults(func=command_compare)
+
+    args = parser.parse_args(argv)
+    # Pipeline modules log at INFO/DEBUG on every call, which would dominate timings
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger().setLevel(logging.WARNING)
+    return args.func(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""
+Synthetic catalogs and BAXUS bar payloads for benchmarking.
+
+Everything is generated from a seeded numpy Generator so that two runs with
+the same sizes and seed see byte-identical inputs.
+"""
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Any
+
+# Spirit mix loosely follows the bundled dataset (mostly Bourbon, then Rye and Scotch)
+SPIRIT_TYPES = ['Bourbon', 'Rye', 'Whiskey', 'Scotch', 'Single Malt Scotch Whisky',
+                'Canadian Whisky', 'Irish Whiskey', 'Japanese Whisky', 'Tequila', 'Gins']
+SPIRIT_WEIGHTS = [0.55, 0.12, 0.09, 0.08, 0.05, 0.03, 0.03, 0.03, 0.01, 0.01]
+
+CATALOG_COLUMNS = ['id', 'name', 'size', 'proof', 'abv', 'spirit_type', 'brand_id',
+                   'popularity', 'image_url', 'avg_msrp', 'fair_price', 'shelf_price',
+                   'total_score', 'wishlist_count', 'vote_count', 'bar_count', 'ranking']
+
+def generate_catalog(num_bottles: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Generates a catalog with the same columns as the bundled dataset.csv.
+
+    Args:
+        num_bottles: Number of rows to generate
+        seed: Random seed
+
+    Returns:
+        DataFrame in the raw CSV layout (``avg_msrp`` rather than ``msrp``)
+    """
+    rng = np.random.default_rng(seed)
+    ids = np.arange(1, num_bottles + 1) * 7 + 100
+    spirit_index = rng.choice(len(SPIRIT_TYPES), size=num_bottles, p=SPIRIT_WEIGHTS)
+    abv = np.round(rng.uniform(40, 65, num_bottles) * 2) / 2
+    proof = abv * 2
+    # A fraction of rows are missing proof, as in the real data
+    proof[rng.random(num_bottles) < 0.15] = np.nan
+    msrp = np.round(np.exp(rng.normal(4.1, 0.6, num_bottles)), 2)
+    fair_price = np.round(msrp * rng.uniform(0.8, 2.5, num_bottles), 2)
+    shelf_price = np.round(msrp * rng.uniform(0.9, 3.0, num_bottles), 2)
+    popularity = rng.integers(0, 101000, num_bottles).astype(float)
+    popularity[rng.random(num_bottles) < 0.07] = np.nan
+    bar_count = rng.zipf(1.6, num_bottles).clip(max=60000)
+
+    return pd.DataFrame({
+        'id': ids,
+        'name': [f"Synthetic Bottle {i}" for i in ids],
+        'size': 750,
+        'proof': proof,
+        'abv': abv,
+        'spirit_type': np.array(SPIRIT_TYPES)[spirit_index],
+        'brand_id': rng.integers(1, max(num_bottles // 5, 2), num_bottles),
+        'popularity': popularity,
+        'image_url': [f"https://images.example.invalid/{i}" for i in ids],
+        'avg_msrp': msrp,
+        'fair_price': fair_price,
+        'shelf_price': shelf_price,
+        'total_score': rng.integers(10, 95000, num_bottles),
+        'wishlist_count': rng.integers(0, 9000, num_bottles),
+        'vote_count': rng.integers(0, 30000, num_bottles),
+        'bar_count': bar_count,
+        'ranking': np.arange(1, num_bottles + 1),
+    }, columns=CATALOG_COLUMNS)
+
+def write_catalog_csv(num_bottles: int, path: str, seed: int = 0) -> str:
+    """Generates a catalog and writes it as CSV, returning the path"""
+    generate_catalog(num_bottles, seed).to_csv(path, index=False)
+    return path
+
+def generate_bar(catalog: pd.DataFrame, num_bottles: int, seed: int = 0) -> Dict[str, Any]:
+    """
+    Generates a BAXUS bar payload by sampling bottles from a raw catalog.
+
+    Bars larger than the catalog sample with replacement, which mirrors users
+    holding several copies of the same release.
+
+    Args:
+        catalog: Raw catalog as returned by generate_catalog
+        num_bottles: Number of bar entries
+        seed: Random seed
+
+    Returns:
+        Dictionary in the shape returned by baxus_api.get_user_bar_data
+    """
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(catalog), size=num_bottles, replace=num_bottles > len(catalog))
+    sample = catalog.iloc[rows]
+    bar: List[Dict[str, Any]] = []
+    for release_id, name, spirit, msrp, brand, proof in zip(
+            sample['id'].tolist(), sample['name'].tolist(), sample['spirit_type'].tolist(),
+            sample['avg_msrp'].tolist(), sample['brand_id'].tolist(), sample['proof'].tolist()):
+        bar.append({
+            'release_id': release_id,
+            'product': {
+                'id': release_id,
+                'name': name,
+                'spirit': spirit,
+                'average_msrp': 0 if msrp != msrp else msrp,
+                'brand': str(brand),
+                'proof': 0 if proof != proof else proof,
+            }
+        })
+    return {'bar': bar}
@@ -1,20 +1,185 @@
 import os
+import re
+import json
 import logging
 import hashlib
+import threading
+from collections import OrderedDict
 from openai import OpenAI
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Optional, Tuple
 from functools import lru_cache
+from metrics import CHAT_CACHE, counter, timer
+from models import UserPreferences
+from catalog_search import get_catalog_search_index, retrieve_for_prompt
+from resilience import DeadlineExceeded, openai_breaker, record_degraded, stage_timeout
 
 logger = logging.getLogger(__name__)
 
-# Simple response cache to avoid repeated API calls
-response_cache = {
-    # Pre-populated responses for common questions
+OPENAI_REQUESTS = counter('bob_openai_requests_total', 'OpenAI chat completion calls by outcome', ('outcome',))
+
+# Cached replies: at most this many conversations, least recently used dropped first
+CHAT_CACHE_MAX_ENTRIES = int(os.environ.get('BOB_CHAT_CACHE_MAX_ENTRIES', 10000))
+# Conversations this deep or deeper share one depth bucket in the statistics
+MAX_REPORTED_DEPTH = 8
+# Seconds to wait for a completion, further capped by the request deadline
+OPENAI_TIMEOUT = float(os.environ.get('BOB_OPENAI_TIMEOUT', 8.0))
+# The client's own retries; the circuit breaker and rule-based fallback replace most of them
+OPENAI_MAX_RETRIES = int(os.environ.get('BOB_OPENAI_MAX_RETRIES', 0))
+
+def normalize_turn(content: str) -> str:
+    """Case- and whitespace-insensitive form of a message"""
+    return ' '.join(content.lower().split())
+
+def conversation_key(messages: List[Dict[str, str]]) -> Tuple[Optional[str], int]:
+    """
+    Rolling hash over a conversation up to and including its last user message.
+
+    Each turn's key hashes the previous key with the turn's role and normalized
+    content, so a conversation's key identifies its whole prefix and a follow-up
+    like "what about under $40?" gets a different key after each opening
+    question. A conversation of one user message hashes to the md5 of that
+    message, as single questions always have.
+
+    Args:
+        messages: Conversation turns with 'role' and 'content' (system turns are skipped)
+
+    Returns:
+        Tuple of (key, depth in user turns); key is None without a user message
+    """
+    last_user = max((i for i, m in enumerate(messages) if m["role"] == "user"), default=None)
+    if last_user is None:
+        return None, 0
+    key, depth = None, 0
+    for message in messages[:last_user + 1]:
+        role = message["role"]
+        if role == "system":
+            continue
+        text = normalize_turn(message["content"])
+        if key is None and role == "user":
+            key = hashlib.md5(text.encode()).hexdigest()
+        else:
+            key = hashlib.md5(f"{key or ''}|{role}:{text}".encode()).hexdigest()
+        depth += role == "user"
+    return key, depth
+
+class ConversationCache:
+    """
+    Bounded LRU of assistant replies keyed by conversation_key(), with hit
+    and miss counts per conversation depth. Pinned entries (the predefined
+    answers) are never evicted.
+    """
+
+    def __init__(self, max_entries: int = CHAT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, str]' = OrderedDict()
+        self._pinned: Dict[str, str] = {}
+        # depth -> [hits, misses]
+        self._stats: Dict[int, List[int]] = {}
+        # Unpinned replies stored so far; tells snapshot writers whether anything changed
+        self.changes = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, key: str, depth: int) -> Optional[str]:
+        """The cached reply for a conversation, counted in the per-depth statistics"""
+        bucket = min(depth, MAX_REPORTED_DEPTH)
+        with self._lock:
+            reply = self._pinned.get(key)
+            if reply is None:
+                reply = self._entries.get(key)
+                if reply is not None:
+                    self._entries.move_to_end(key)
+            self._stats.setdefault(bucket, [0, 0])[reply is None] += 1
+        CHAT_CACHE.inc(result='miss' if reply is None else 'hit', depth=bucket)
+        return reply
+
+    def get(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        """The cached reply without touching the statistics"""
+        with self._lock:
+            return self._pinned.get(key, self._entries.get(key, default))
+
+    def put(self, key: str, reply: str, pinned: bool = False) -> None:
+        with self._lock:
+            if pinned:
+                self._pinned[key] = reply
+                return
+            self._entries[key] = reply
+            self._entries.move_to_end(key)
+            self.changes += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._pinned or key in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._pinned) + len(self._entries)
+
+    def stats(self) -> Dict[int, Dict[str, float]]:
+        """Hits, misses and hit rate per conversation depth"""
+        with self._lock:
+            return {depth: {'hits': hits, 'misses': misses, 'hit_rate': hits / (hits + misses)}
+                    for depth, (hits, misses) in sorted(self._stats.items())}
+
+    def save(self, path: str) -> int:
+        """
+        Writes the unpinned replies to a JSON snapshot file, least recently
+        used first, replacing it atomically.
+
+        Returns:
+            Number of replies written
+        """
+        with self._lock:
+            entries = list(self._entries.items())
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'entries': entries}, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+        return len(entries)
+
+    def load(self, path: str) -> int:
+        """
+        Adds the replies of a snapshot written by save(); replies cached since
+        are kept and stay the most recently used.
+
+        Returns:
+            Number of replies read
+        """
+        with open(path, encoding='utf-8') as f:
+            entries = json.load(f)['entries']
+        with self._lock:
+            current = list(self._entries.items())
+            self._entries.clear()
+            for key, reply in entries[-self.max_entries:]:
+                self._entries[key] = reply
+            for key, reply in current:
+                self._entries[key] = reply
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return len(entries)
+
+    def clear(self) -> None:
+        """Drop cached replies (pinned ones stay) and reset the statistics"""
+        with self._lock:
+            self._entries.clear()
+            self._stats.clear()
+
+# Response cache to avoid repeated API calls
+response_cache = ConversationCache()
+
+# Pre-populated responses for common questions
+for _key, _reply in {
     "8d30f95900b08658ccd78bc1fbabe5e0": "For smoky flavors, I'd recommend Islay whiskies like Laphroaig, Ardbeg, or Lagavulin. They're known for their intense peat smoke character. If you want something less intense, try Highland Park or Talisker for a more balanced approach to smokiness.",
     "a5db6807fb4aa3b8b6a019f28d4f30b0": "The main whisky regions in Scotland are: Highlands, Lowlands, Speyside, Islay, and Campbeltown. Each has distinctive characteristics - Highlands are often full-bodied, Speyside known for fruity elegance, Islay for peaty smoke, Lowlands for lighter styles, and Campbeltown for a unique maritime character.",
     "c15f957a46e787c35b5a0b933e3e4e5c": "To start exploring whisky, I recommend trying these approachable options: Glenmorangie Original (Highland), Monkey Shoulder (Blended Scotch), Buffalo Trace (Bourbon), or Jameson (Irish). These are smooth, well-balanced, and give you a good introduction to different styles without overwhelming your palate.",
     "61afc5979b68f02e0b044be70eb4be24": "The difference between whisky and whiskey is primarily about origin. 'Whisky' (no 'e') is typically used in Scotland, Canada, and Japan. 'Whiskey' (with an 'e') is used in Ireland and the United States. The spelling reflects different traditions and sometimes different production methods."
-}
+}.items():
+    response_cache.put(_key, _reply, pinned=True)
 
 # Initialize the OpenAI client (lazily to avoid API calls unless needed)
 api_key = os.environ.get("OPENAI_API_KEY")
@@ -29,18 +194,33 @@ def get_openai_client():
             return None
         try:
             logger.info("Initializing OpenAI client")
-            client = OpenAI(api_key=api_key)
+            client = OpenAI(api_key=api_key, max_retries=OPENAI_MAX_RETRIES)
             return client
         except Exception as e:
             logger.error(f"Failed to initialize OpenAI client: {str(e)}")
             return None
     return client
 
+def generate_cache_key_for(question: str) -> Optional[str]:
+    """Cache key of a conversation opening with this question"""
+    return conversation_key([{"role": "user", "content": question}])[0]
+
 def add_to_cache(question: str, answer: str) -> None:
-    """Add a question and answer to the cache"""
-    key = hashlib.md5(question.lower().strip().encode()).hexdigest()
-    response_cache[key] = answer
-    logger.info(f"Added to cache: {key} - Question: {question}")
+    """Add an opening question and its answer to the cache"""
+    add_conversation_to_cache([{"role": "user", "content": question},
+                               {"role": "assistant", "content": answer}])
+
+def add_conversation_to_cache(messages: List[Dict[str, str]]) -> None:
+    """
+    Pins every assistant reply of a scripted conversation under its prefix,
+    so a flow such as an onboarding sequence is served from the cache turn by turn.
+    """
+    for i, message in enumerate(messages):
+        if message["role"] == "assistant":
+            key, _ = conversation_key(messages[:i])
+            if key is not None:
+                response_cache.put(key, message["content"], pinned=True)
+                logger.debug("Added to cache: %s", key)
 
 # Add more predefined responses to cache
 common_questions = {
@@ -61,6 +241,60 @@ common_questions = {
 for question, answer in common_questions.items():
     add_to_cache(question, answer)
 
+# Topics answered without OpenAI when it is unavailable: keywords -> cache key of a pinned answer.
+# Keywords match whole words (an optional plural 's' allowed), so 'pair' doesn't fire on 'repair'
+RULE_BASED_TOPICS = (
+    (('smoky', 'smoke', 'smoked', 'peat', 'peated', 'peaty'), "8d30f95900b08658ccd78bc1fbabe5e0"),
+    (('region',), "a5db6807fb4aa3b8b6a019f28d4f30b0"),
+    (('beginner', 'new to', 'start', 'starting'), "c15f957a46e787c35b5a0b933e3e4e5c"),
+    (('whiskey or whisky', 'whisky or whiskey', 'whisky and whiskey', 'whiskey and whisky', 'spelling'),
+     "61afc5979b68f02e0b044be70eb4be24"),
+    (('under $50', 'budget', 'cheap', 'affordable'), generate_cache_key_for("What's the best whisky under $50?")),
+    (('taste', 'tasting', 'nose'), generate_cache_key_for("How should I taste whisky properly?")),
+    (('food', 'pair', 'pairing'), generate_cache_key_for("What food pairs well with whisky?")),
+    (('single malt',), generate_cache_key_for("What is a single malt?")),
+)
+_RULE_BASED_PATTERNS = [(re.compile(r'(?<!\w)(?:' + '|'.join(map(re.escape, keywords)) + r')s?(?!\w)'), key)
+                        for keywords, key in RULE_BASED_TOPICS]
+
+def get_rule_based_response(message: str, catalog: bool = True) -> Optional[str]:
+    """
+    Answers a question without OpenAI: a pinned answer for a known topic, else
+    the catalog bottles the question names or filters for.
+
+    Args:
+        message: The user's question
+        catalog: Whether to fall back to catalog matches; most questions name
+            or filter for some bottle, so callers that can still reach OpenAI
+            turn this off
+
+    Returns:
+        The answer, or None if no rule applies
+    """
+    text = normalize_turn(message)
+    if not text:
+        return None
+    for pattern, key in _RULE_BASED_PATTERNS:
+        if pattern.search(text):
+            answer = response_cache.get(key)
+            if answer is not None:
+                return answer
+    if not catalog:
+        return None
+    try:
+        matches = get_catalog_search_index().search(message, 3)
+    except Exception as e:
+        logger.warning(f"Catalog search for a rule-based answer failed: {str(e)}")
+        return None
+    if not matches:
+        return None
+    picks = []
+    for match in matches:
+        details = ', '.join(part for part in (match.region, f"${match.msrp:.0f}" if match.msrp > 0 else '') if part)
+        picks.append(f"{match.name} ({details})" if details else match.name)
+    return (f"From the BAXUS catalog, you might look at {', '.join(picks[:-1])}"
+            f"{' or ' if len(picks) > 1 else ''}{picks[-1]}.")
+
 # BOB's personality and knowledge system prompt
 BOB_SYSTEM_PROMPT = """
 You are "Bob the Whisky Expert," a friendly and knowledgeable AI assistant specializing in whisky recommendations.
@@ -83,23 +317,12 @@ When responding to users:
 IMPORTANT: While you're an AI and don't actually drink whisky, respond as if you have experienced these spirits professionally through your expert knowledge.
 """
 
-def add_to_cache(question: str, answer: str) -> None:
-    """Add a question and answer to the cache"""
-    key = hashlib.md5(question.lower().strip().encode()).hexdigest()
-    response_cache[key] = answer
-    logger.info(f"Added to cache: {key} - Question: {question}")
-    
 def generate_cache_key(messages: List[Dict[str, str]]) -> Optional[str]:
-    """Generate a cache key based on the user's message content"""
-    # Only use the last user message for caching to keep it simple
-    for message in reversed(messages):
-        if message["role"] == "user":
-            # Create hash of the message content
-            return hashlib.md5(message["content"].lower().strip().encode()).hexdigest()
-    return None
+    """Generate a cache key for the conversation up to the user's latest message"""
+    return conversation_key(messages)[0]
 
 def chat_with_bob(messages: List[Dict[str, str]], username: Optional[str] = None, 
-                user_preferences: Optional[Dict[str, Any]] = None) -> str:
+                user_preferences: Optional[UserPreferences] = None) -> str:
     """
     Generate a response from Bob the Whisky Expert.
     
@@ -116,87 +339,120 @@ def chat_with_bob(messages: List[Dict[str, str]], username: Optional[str] = None
         logger.error("OpenAI API key not available in environment when chat_with_bob was called")
         return "I apologize, but I'm having trouble connecting to my whisky knowledge base. The API key is missing. Please try again later."
     
-    # Check if we have a cached response for this question
-    cache_key = generate_cache_key(messages)
-    if cache_key and cache_key in response_cache:
-        logger.info(f"Using cached response for question: {cache_key}")
-        return response_cache[cache_key]
+    # Check if we have a cached response for this conversation
+    with timer('chat_cache_lookup'):
+        cache_key, depth = conversation_key(messages)
+        cached_response = response_cache.lookup(cache_key, depth) if cache_key else None
+    if cached_response is not None:
+        logger.debug("Using cached response for conversation: %s (depth %d)", cache_key, depth)
+        return cached_response
     
     # Start with the system message defining Bob's persona
     system_message = {"role": "system", "content": BOB_SYSTEM_PROMPT}
     
     # If we have user preferences, add them to the system message for context
-    if username and user_preferences:
+    if username and user_preferences is not None:
         preference_info = f"\nAdditional context about {username}:\n"
         
         # Add region preferences if available
-        if 'preferred_regions' in user_preferences and user_preferences['preferred_regions']:
+        if user_preferences.preferred_regions:
             regions = []
-            for region, value in user_preferences['preferred_regions'].items():
+            for region, value in user_preferences.preferred_regions.items():
                 if value > 10:  # Only consider significant preferences
                     regions.append(f"{region} ({value:.1f}%)")
             if regions:
                 preference_info += f"- Preferred regions: {', '.join(regions)}\n"
         
         # Add spirit type preferences if available
-        if 'spirit_types' in user_preferences and user_preferences['spirit_types']:
+        if user_preferences.spirit_types:
             spirits = []
-            for spirit, value in user_preferences['spirit_types'].items():
+            for spirit, value in user_preferences.spirit_types.items():
                 if value > 10:  # Only consider significant preferences
                     spirits.append(f"{spirit} ({value:.1f}%)")
             if spirits:
                 preference_info += f"- Preferred spirit types: {', '.join(spirits)}\n"
         
         # Add flavor profile preferences if available
-        if 'flavor_profiles' in user_preferences and user_preferences['flavor_profiles']:
+        if user_preferences.flavor_profiles.any():
             flavors = []
-            for flavor, value in user_preferences['flavor_profiles'].items():
+            for flavor, value in user_preferences.flavor_items():
                 if value > 30:  # Only consider strong flavor preferences
                     flavors.append(f"{flavor}")
             if flavors:
                 preference_info += f"- Preferred flavor profiles: {', '.join(flavors)}\n"
         
         # Add price preferences if available
-        if 'average_bottle_price' in user_preferences:
-            avg_price = user_preferences['average_bottle_price']
+        if user_preferences.average_bottle_price:
+            avg_price = user_preferences.average_bottle_price
             preference_info += f"- Average bottle price: ${avg_price:.2f}\n"
         
         # Update the system message with user preference information
         system_message["content"] += preference_info
     
+    # Ground the answer in catalog bottles matching the latest question
+    question = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+    with timer('catalog_retrieval'):
+        catalog_context = retrieve_for_prompt(question)
+    if catalog_context:
+        system_message["content"] += catalog_context
+    
     # Prepare the full conversation history with the system message first
     conversation = [system_message] + messages
     
+    # Get the OpenAI client (lazy initialization)
+    client = get_openai_client()
+    if client is None:
+        return "I apologize, but I'm having trouble connecting to my whisky knowledge base. The API key is missing. Please try again later."
+    
+    # Don't start a completion that can't finish in time or that a failing upstream would refuse
+    try:
+        timeout = stage_timeout(OPENAI_TIMEOUT)
+    except DeadlineExceeded:
+        return _fallback_response(question, 'deadline')
+    if not openai_breaker.allow():
+        OPENAI_REQUESTS.inc(outcome='circuit_open')
+        return _fallback_response(question, 'circuit_open')
+    
     try:
-        # Get the OpenAI client (lazy initialization)
-        client = get_openai_client()
-        if client is None:
-            return "I apologize, but I'm having trouble connecting to my whisky knowledge base. The API key is missing. Please try again later."
-            
         # Call the OpenAI API with optimized settings for free plan
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",  # Use more economical model for free plan
-            messages=conversation,
-            temperature=0.7,  # Balanced between creativity and consistency
-            max_tokens=250,  # Reduced token usage
-            presence_penalty=0.6,  # Encourage model to be more concise
-        )
+        with timer('openai_call'):
+            response = client.chat.completions.create(
+                model="gpt-3.5-turbo",  # Use more economical model for free plan
+                messages=conversation,
+                temperature=0.7,  # Balanced between creativity and consistency
+                max_tokens=250,  # Reduced token usage
+                presence_penalty=0.6,  # Encourage model to be more concise
+                timeout=timeout,
+            )
+        openai_breaker.record_success()
+        OPENAI_REQUESTS.inc(outcome='ok')
         
         # Extract the response content
         response_text = response.choices[0].message.content
         
         # Cache the response if we have a valid cache key
         if cache_key:
-            response_cache[cache_key] = response_text
-            logger.info(f"Cached response for question: {cache_key}")
+            response_cache.put(cache_key, response_text)
+            logger.debug("Cached response for question: %s", cache_key)
             
         return response_text
     
     except Exception as e:
         error_str = str(e)
         logger.exception(f"Error calling OpenAI API: {error_str}")
+        openai_breaker.record_failure()
+        OPENAI_REQUESTS.inc(outcome='error')
         
         if "insufficient_quota" in error_str or "exceeded your current quota" in error_str:
-            return "I apologize, but I'm not available right now due to API quota limitations. Please contact the administrator to update the OpenAI API key with additional credits."
+            apology = "I apologize, but I'm not available right now due to API quota limitations. Please contact the administrator to update the OpenAI API key with additional credits."
         else:
-            return "I apologize, but I'm having trouble connecting to my whisky knowledge base at the moment. Please try again shortly."
\ No newline at end of file
+            apology = None
+        return _fallback_response(question, 'upstream_error', apology)
+
+def _fallback_response(question: str, reason: str, apology: Optional[str] = None) -> str:
+    """The rule-based answer while OpenAI can't be used, else an apology"""
+    record_degraded('chat', reason)
+    answer = get_rule_based_response(question)
+    if answer is not None:
+        return answer
+    return apology or "I apologize, but I'm having trouble connecting to my whisky knowledge base at the moment. Please try again shortly."
\ No newline at end of file
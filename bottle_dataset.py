@@ -1,29 +1,129 @@
 import pandas as pd
 import logging
 import os
-from typing import List, Dict, Any, Optional
+import hashlib
+import threading
+from typing import List, Dict, Any, Optional, Callable, Tuple
+from metrics import timer
 
 logger = logging.getLogger(__name__)
 
-def get_bottle_dataset() -> pd.DataFrame:
-    """
-    Loads the real whisky bottle dataset.
-    
-    Returns:
-        A pandas DataFrame containing all bottles with their attributes
-    """
+# The loaded catalog is shared by every request until the underlying file
+# changes. Its version identifies derived artifacts built from it.
+_catalog_lock = threading.RLock()
+_catalog: Dict[str, Any] = {'key': None, 'df': None, 'version': None}
+
+# Artifacts derived from the catalog (indexes, score columns, ...), rebuilt
+# whenever the catalog version changes: name -> (builder, eager)
+_artifact_builders: Dict[str, Tuple[Callable[[pd.DataFrame], Any], bool]] = {}
+_artifacts: Dict[str, Tuple[str, Any]] = {}
+
+def _resolve_dataset_path(dataset_path: Optional[str] = None) -> Optional[str]:
+    """Find the catalog CSV to load, or None to use the fallback dataset"""
     # Try to load the real dataset from multiple possible locations
     possible_paths = [
         'attached_assets/dataset.csv',
         'static/data/dataset.csv'
     ]
+    override_path = dataset_path or os.environ.get('BOB_DATASET_PATH')
+    if override_path:
+        possible_paths = [override_path]
     
-    dataset_path = None
     for path in possible_paths:
         if os.path.exists(path):
-            dataset_path = path
-            break
-            
+            return path
+    return None
+
+def get_bottle_dataset(dataset_path: Optional[str] = None) -> pd.DataFrame:
+    """
+    Loads the real whisky bottle dataset.
+    
+    The catalog is parsed once and shared until the CSV file changes on disk,
+    so callers must treat the returned DataFrame as read-only.
+    
+    Args:
+        dataset_path: Optional CSV path overriding the BOB_DATASET_PATH
+            environment variable and the bundled dataset locations
+    
+    Returns:
+        A pandas DataFrame containing all bottles with their attributes
+    """
+    path = _resolve_dataset_path(dataset_path)
+    if path:
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    else:
+        key = ('fallback',)
+    
+    if _catalog['key'] == key:
+        return _catalog['df']
+    
+    with _catalog_lock:
+        # Another thread may have loaded it while we waited
+        if _catalog['key'] == key:
+            return _catalog['df']
+        
+        df = _load_bottle_dataset(path)
+        version = hashlib.sha1(repr(key).encode()).hexdigest()[:12]
+        _catalog.update(key=key, df=df, version=version)
+        
+        # Build eager artifacts now so the first request doesn't pay for them
+        for name, (builder, eager) in list(_artifact_builders.items()):
+            if eager:
+                _build_artifact(name, builder, df, version)
+        return df
+
+def get_catalog_version() -> str:
+    """Short identifier of the currently loaded catalog"""
+    get_bottle_dataset()
+    return _catalog['version']
+
+def clear_catalog_cache() -> None:
+    """Drop the loaded catalog and all derived artifacts (used by benchmarks)"""
+    with _catalog_lock:
+        _catalog.update(key=None, df=None, version=None)
+        _artifacts.clear()
+
+def register_catalog_artifact(name: str, builder: Callable[[pd.DataFrame], Any],
+                              eager: bool = True) -> None:
+    """
+    Registers something derived from the catalog, built once per catalog version.
+    
+    Args:
+        name: Unique artifact name
+        builder: Function taking the catalog DataFrame and returning the artifact
+        eager: Build as part of catalog load rather than on first access
+    """
+    _artifact_builders[name] = (builder, eager)
+
+def get_catalog_artifact(name: str) -> Any:
+    """
+    Returns a registered artifact for the current catalog version, building it
+    if the catalog changed since it was last built.
+    """
+    df = get_bottle_dataset()
+    version = _catalog['version']
+    cached = _artifacts.get(name)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    with _catalog_lock:
+        cached = _artifacts.get(name)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        builder, _ = _artifact_builders[name]
+        return _build_artifact(name, builder, df, version)
+
+def _build_artifact(name: str, builder: Callable[[pd.DataFrame], Any],
+                    df: pd.DataFrame, version: str) -> Any:
+    with timer(f'artifact_{name}'):
+        value = builder(df)
+    _artifacts[name] = (version, value)
+    logger.info(f"Built catalog artifact '{name}' for catalog {version}")
+    return value
+
+@timer('catalog_load')
+def _load_bottle_dataset(dataset_path: Optional[str]) -> pd.DataFrame:
+    """Parse the catalog CSV and derive the columns the recommender needs"""
     if not dataset_path:
         logger.warning(f"Dataset file not found in any of the expected locations, using fallback data")
         return _get_fallback_dataset()  # Use fallback if file not found
@@ -0,0 +1,152 @@
+"""
+Price-sorted candidate partitions of the catalog.
+
+Ranking and the deals endpoint both start from "bottles within a price
+window, optionally of one spirit type or region, that the user doesn't own".
+Masking every catalog row for that is linear in the catalog on every request.
+At catalog load this index sorts the row positions by MSRP, once for the
+whole catalog and once per spirit type and region (one array per dimension,
+grouped by value, with an offset table as in the IVF index). A price window
+is then two binary searches and a slice, and owned bottles are dropped with a
+bitset over row positions, so selecting candidates costs time proportional to
+the window rather than the catalog.
+
+Rows are returned in catalog order, so callers see exactly the candidates a
+full-catalog mask would have produced.
+"""
+import logging
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, Iterable, Optional, Tuple
+from bottle_dataset import register_catalog_artifact, get_catalog_artifact
+
+logger = logging.getLogger(__name__)
+
+# Columns the catalog is partitioned by
+PARTITION_COLUMNS = ('spirit_type', 'region')
+
+class CandidateIndex:
+    """Catalog row positions sorted by MSRP, overall and within each partition"""
+
+    def __init__(self, df: pd.DataFrame):
+        self.num_rows = len(df)
+        msrp = pd.to_numeric(df['msrp'], errors='coerce').to_numpy(dtype=np.float64)
+        # NaN prices sort last: outside any window with an upper bound, inside one without
+        self.rows = np.argsort(msrp, kind='stable').astype(np.int32)
+        self.msrp = msrp[self.rows]
+
+        # Per dimension: rows grouped by value, MSRP-sorted within each group
+        self.codes: Dict[str, np.ndarray] = {}
+        self._values: Dict[str, Dict[Any, int]] = {}
+        self._partitions: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        for column in PARTITION_COLUMNS:
+            if column not in df.columns:
+                continue
+            codes, uniques = pd.factorize(df[column])
+            self.codes[column] = codes.astype(np.int32)
+            self._values[column] = {value: code for code, value in enumerate(uniques)}
+            # Sorting the MSRP-ordered rows by code keeps each group in MSRP order
+            order = self.rows[np.argsort(codes[self.rows], kind='stable')]
+            order = order[codes[order] >= 0]
+            ptr = np.zeros(len(uniques) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(codes[order], minlength=len(uniques)), out=ptr[1:])
+            self._partitions[column] = (order, msrp[order], ptr)
+
+        # Sorted ids map owned bottles to rows with a binary search
+        self._ids = df['id'].to_numpy()
+        self._id_order = np.argsort(self._ids, kind='stable')
+        self._sorted_ids = self._ids[self._id_order]
+
+    def _partition(self, column: str, value: Any) -> Tuple[np.ndarray, np.ndarray]:
+        """(rows, their MSRPs) of one partition, both MSRP-sorted; empty for unknown values"""
+        code = self._values.get(column, {}).get(value)
+        if code is None:
+            return _EMPTY_ROWS, _EMPTY_PRICES
+        rows, msrp, ptr = self._partitions[column]
+        return rows[ptr[code]:ptr[code + 1]], msrp[ptr[code]:ptr[code + 1]]
+
+    def price_window(self, min_price: Optional[float] = None, max_price: Optional[float] = None,
+                     spirit_type: Optional[str] = None, region: Optional[str] = None) -> np.ndarray:
+        """
+        Catalog rows priced within [min_price, max_price], optionally of one
+        spirit type and/or region.
+
+        Args:
+            min_price: Lowest MSRP, inclusive (None for no lower bound)
+            max_price: Highest MSRP, inclusive (None for no upper bound)
+            spirit_type: Optional spirit type to restrict to
+            region: Optional region to restrict to
+
+        Returns:
+            int32 array of catalog row positions in catalog order
+        """
+        rows, msrp = self.rows, self.msrp
+        filters = [(column, value) for column, value in (('spirit_type', spirit_type), ('region', region))
+                   if value and column in self._partitions]
+        if filters:
+            # Slice the smallest matching partition and check any other filter on the window only
+            filters.sort(key=lambda item: len(self._partition(*item)[0]))
+            rows, msrp = self._partition(*filters[0])
+        lo = 0 if min_price is None else np.searchsorted(msrp, min_price, side='left')
+        hi = len(msrp) if max_price is None else np.searchsorted(msrp, max_price, side='right')
+        window = rows[lo:hi]
+        for column, value in filters[1:]:
+            window = window[self.codes[column][window] == self._values[column].get(value, -2)]
+        return np.sort(window)
+
+    def rows_of_ids(self, bottle_ids: Iterable[Any]) -> np.ndarray:
+        """Catalog rows of the given bottle ids, including duplicate listings; unknown ids are skipped"""
+        bottle_ids = list(bottle_ids)
+        if not bottle_ids or not len(self._sorted_ids):
+            return _EMPTY_ROWS
+        if self._sorted_ids.dtype.kind not in 'iu':
+            return np.flatnonzero(pd.Series(self._ids).isin(bottle_ids)).astype(np.int32)
+        # Like Series.isin, only integral numbers match integer ids ('12' doesn't, 12.0 does)
+        ids = np.asarray([i for i in bottle_ids if isinstance(i, (int, np.integer)) or
+                          (isinstance(i, (float, np.floating)) and float(i).is_integer())],
+                         dtype=self._sorted_ids.dtype)
+        left = np.searchsorted(self._sorted_ids, ids, side='left')
+        counts = np.searchsorted(self._sorted_ids, ids, side='right') - left
+        starts = np.repeat(left, counts)
+        offsets = np.arange(len(starts)) - np.repeat(np.cumsum(counts) - counts, counts)
+        return self._id_order[starts + offsets].astype(np.int32)
+
+    def first_rows(self, bottle_ids: np.ndarray) -> np.ndarray:
+        """Catalog row of each id's first listing, aligned with bottle_ids; -1 for unknown ids"""
+        bottle_ids = np.asarray(bottle_ids)
+        if not len(bottle_ids) or not len(self._sorted_ids):
+            return np.full(len(bottle_ids), -1, dtype=np.int32)
+        positions = np.searchsorted(self._sorted_ids, bottle_ids, side='left')
+        clipped = np.minimum(positions, len(self._sorted_ids) - 1)
+        found = (positions < len(self._sorted_ids)) & (self._sorted_ids[clipped] == bottle_ids)
+        return np.where(found, self._id_order[clipped], -1).astype(np.int32)
+
+    def owned_bitset(self, bottle_ids: Iterable[Any]) -> np.ndarray:
+        """One bit per catalog row, set for the rows of the given bottle ids"""
+        bits = np.zeros((self.num_rows + 7) // 8, dtype=np.uint8)
+        rows = self.rows_of_ids(bottle_ids)
+        np.bitwise_or.at(bits, rows >> 3, (1 << (rows & 7)).astype(np.uint8))
+        return bits
+
+    def candidates(self, min_price: Optional[float], max_price: Optional[float],
+                   exclude_ids: Optional[Iterable[Any]] = None, **partition) -> np.ndarray:
+        """
+        Rows in a price window (see price_window) that aren't listings of exclude_ids.
+
+        Returns:
+            int32 array of catalog row positions in catalog order
+        """
+        window = self.price_window(min_price, max_price, **partition)
+        if exclude_ids and len(window):
+            bits = self.owned_bitset(exclude_ids)
+            window = window[((bits[window >> 3] >> (window & 7).astype(np.uint8)) & 1) == 0]
+        return window
+
+_EMPTY_ROWS = np.empty(0, dtype=np.int32)
+_EMPTY_PRICES = np.empty(0, dtype=np.float64)
+
+register_catalog_artifact('candidate_index', CandidateIndex)
+
+def get_candidate_index() -> CandidateIndex:
+    """The candidate index for the currently loaded catalog"""
+    return get_catalog_artifact('candidate_index')
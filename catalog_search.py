@@ -0,0 +1,322 @@
+"""
+Catalog retrieval for Bob's prompts.
+
+Bob otherwise answers questions about specific bottles from what the model
+happens to know. Before each chat completion the user's question is searched
+against the catalog and the best matches, with their prices, are added to the
+system prompt so the answer can name real bottles and real prices.
+
+The search is a BM25-ranked inverted index over bottle names (the catalog
+carries brands only as numeric ids, and names start with the brand), plus
+structured filters parsed from the question:
+
+    "smoky scotch under $80"   region=Scotland, price <= 80
+    "best bourbon for $50"     spirit=Bourbon, price <= 50
+
+Questions that only set filters get the most popular bottles that pass them.
+The injected block is capped at RETRIEVAL_TOP_K lines and RETRIEVAL_MAX_CHARS
+characters, so it adds a bounded number of prompt tokens.
+"""
+import os
+import re
+import logging
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass
+from typing import Dict, List, Any, Optional, Tuple
+from bottle_dataset import register_catalog_artifact, get_catalog_artifact
+from popularity_index import get_popularity_index
+from metrics import counter
+
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_TOP_K = int(os.environ.get('BOB_RETRIEVAL_TOP_K', 5))
+# Roughly 4 characters per token: the default adds at most ~150 prompt tokens
+RETRIEVAL_MAX_CHARS = int(os.environ.get('BOB_RETRIEVAL_MAX_CHARS', 600))
+
+# Matches of one brand taken before other brands get a turn, so "weller vs
+# buffalo trace" shows both
+MATCHES_PER_BRAND = 2
+
+# Candidates ranked per requested match; leaves room for skipping duplicate listings
+SHORTLIST_PER_MATCH = 20
+
+# BM25 parameters (the usual defaults)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+CATALOG_RETRIEVALS = counter('bob_catalog_retrievals_total', 'Catalog searches for chat prompts by result',
+                             ('result',))
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+# "under $50", "for $40", "below 100 dollars"; a bare number needs a price
+# word in front and must not be an age or a strength ("under 12 years")
+_PRICE_CAP_RE = re.compile(r"(?:under|below|less than|cheaper than|up to|max(?:imum)?|budget of|for)\s*"
+                           r"(?:about\s*|around\s*)?\$\s*(\d+(?:\.\d+)?)"
+                           r"|(?:under|below|less than|cheaper than|up to)\s*(\d+(?:\.\d+)?)"
+                           r"(?!\s*(?:\d|\.|%|yo\b|y\.o|years?|yrs?|proof|abv|ml|cl))")
+
+# Words that carry no information about which bottle is meant
+STOPWORDS = frozenset("""
+a about an and any are best bottle bottles bucks buy can could do does dollars for from get give good great have
+how i in is it like me my of on or recommend recommendation recommendations should some something
+suggest tell than that the there this to try under versus vs want what whats which whisky whiskey whiskies with
+worth would you your
+""".split())
+
+# Question words -> catalog region
+REGION_TERMS = {
+    'scotch': 'Scotland', 'scottish': 'Scotland', 'scotland': 'Scotland', 'islay': 'Scotland',
+    'speyside': 'Scotland', 'highland': 'Scotland', 'highlands': 'Scotland', 'lowland': 'Scotland',
+    'campbeltown': 'Scotland',
+    'american': 'America', 'america': 'America', 'kentucky': 'America', 'tennessee': 'America',
+    'irish': 'Ireland', 'ireland': 'Ireland',
+    'japanese': 'Japan', 'japan': 'Japan',
+    'canadian': 'Canada', 'canada': 'Canada',
+}
+
+# Spirit types too generic to filter on
+_GENERIC_SPIRITS = frozenset({'whisky', 'whiskey'})
+
+def tokenize(text: str) -> List[str]:
+    """Lower-case alphanumeric tokens; apostrophes are dropped so "blanton's" matches "blantons" """
+    return _TOKEN_RE.findall(str(text).lower().replace("'", "").replace("’", ""))
+
+@dataclass
+class QueryFilters:
+    """Structured constraints parsed from a question"""
+    region: Optional[str] = None
+    spirit_type: Optional[str] = None
+    max_price: Optional[float] = None
+
+    def __bool__(self) -> bool:
+        return self.region is not None or self.spirit_type is not None or self.max_price is not None
+
+@dataclass(frozen=True)
+class CatalogMatch:
+    """A retrieved bottle"""
+    row: int
+    id: Any
+    name: str
+    spirit_type: str
+    region: str
+    msrp: float
+    score: float
+
+class CatalogSearchIndex:
+    """
+    Inverted index over bottle names with BM25 scoring, built once per catalog version.
+
+    Postings are numpy arrays (row positions and term frequencies), so a query
+    costs one array update per query term plus a top-k selection.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        names = df['name'].astype(object).fillna('').astype(str).tolist()
+        self.ids = df['id'].to_numpy()
+        self.names = names
+        # Categories as int codes: filtering compares integers, not strings
+        self.spirit_codes, spirit_values = pd.factorize(df['spirit_type'].astype(object).fillna('').astype(str))
+        self.region_codes, region_values = pd.factorize(df['region'].astype(object).fillna('').astype(str))
+        self.spirit_values: List[str] = spirit_values.tolist()
+        self.region_values: List[str] = region_values.tolist()
+        self.msrp = pd.to_numeric(df['msrp'], errors='coerce').fillna(0).to_numpy(dtype=np.float32)
+        # Bottles without a brand count as brands of their own
+        brand_ids = pd.to_numeric(df['brand_id'], errors='coerce') if 'brand_id' in df.columns \
+            else pd.Series(np.nan, index=df.index)
+        self.brands = np.where(brand_ids.isna(), -1 - np.arange(len(df)), brand_ids.fillna(0)).astype(np.int64)
+
+        self.popularity = get_popularity_index().scores
+        self.by_popularity = np.argsort(-self.popularity, kind='stable')
+
+        postings: Dict[str, Dict[int, int]] = {}
+        lengths = np.zeros(len(names), dtype=np.float32)
+        for row, name in enumerate(names):
+            tokens = tokenize(name)
+            lengths[row] = len(tokens)
+            for token in tokens:
+                rows = postings.setdefault(token, {})
+                rows[row] = rows.get(row, 0) + 1
+
+        num_docs = max(1, len(names))
+        average_length = float(lengths.mean()) if len(names) else 1.0
+        # Length normalization of BM25, precomputed per row
+        self._norm = (BM25_K1 * (1 - BM25_B + BM25_B * lengths / max(average_length, 1e-6))).astype(np.float32)
+        self.postings: Dict[str, Tuple[np.ndarray, np.ndarray, float]] = {}
+        for token, rows in postings.items():
+            idf = float(np.log(1 + (num_docs - len(rows) + 0.5) / (len(rows) + 0.5)))
+            self.postings[token] = (np.fromiter(rows.keys(), dtype=np.int32, count=len(rows)),
+                                    np.fromiter(rows.values(), dtype=np.float32, count=len(rows)),
+                                    idf)
+
+        # Lower-cased spirit type phrase -> catalog value, longest first so
+        # "canadian whisky" wins over "whisky"
+        spirits = {value.lower(): value for value in self.spirit_values if value}
+        self.spirit_phrases = sorted(((phrase, value) for phrase, value in spirits.items()
+                                      if phrase not in _GENERIC_SPIRITS),
+                                     key=lambda item: -len(item[0]))
+        self.known_regions = frozenset(self.region_values)
+
+    def parse_filters(self, question: str) -> Tuple[QueryFilters, List[str]]:
+        """
+        Pulls region, spirit type and price cap out of a question.
+
+        Returns:
+            Tuple of (filters, remaining free-text tokens for BM25)
+        """
+        text = question.lower()
+        filters = QueryFilters()
+
+        match = _PRICE_CAP_RE.search(text)
+        if match:
+            filters.max_price = float(match.group(1) or match.group(2))
+            text = text[:match.start()] + ' ' + text[match.end():]
+
+        padded = f" {' '.join(tokenize(text))} "
+        for phrase, value in self.spirit_phrases:
+            needle = f" {' '.join(tokenize(phrase))} "
+            if needle.strip() and needle in padded:
+                filters.spirit_type = value
+                padded = padded.replace(needle, ' ')
+                break
+
+        tokens = []
+        for token in padded.split():
+            region = REGION_TERMS.get(token)
+            if region is not None and region in self.known_regions:
+                if filters.region is None:
+                    filters.region = region
+                continue
+            if token not in STOPWORDS:
+                tokens.append(token)
+        return filters, tokens
+
+    def _filter_mask(self, filters: QueryFilters) -> Optional[np.ndarray]:
+        if not filters:
+            return None
+        mask = np.ones(len(self.ids), dtype=bool)
+        if filters.region is not None:
+            mask &= self.region_codes == self.region_values.index(filters.region)
+        if filters.spirit_type is not None:
+            mask &= self.spirit_codes == self.spirit_values.index(filters.spirit_type)
+        if filters.max_price is not None:
+            mask &= (self.msrp > 0) & (self.msrp <= filters.max_price)
+        return mask
+
+    def search(self, question: str, k: int = RETRIEVAL_TOP_K) -> List[CatalogMatch]:
+        """
+        Finds the catalog bottles a question is most likely about.
+
+        Args:
+            question: The user's message
+            k: Maximum number of matches
+
+        Returns:
+            Matches, best first; empty when the question names no bottle and sets no filter
+        """
+        filters, tokens = self.parse_filters(question)
+        scores = None
+        for token in tokens:
+            posting = self.postings.get(token)
+            if posting is None:
+                continue
+            rows, tf, idf = posting
+            if scores is None:
+                scores = np.zeros(len(self.ids), dtype=np.float32)
+            scores[rows] += idf * tf * (BM25_K1 + 1) / (tf + self._norm[rows])
+
+        mask = self._filter_mask(filters)
+        shortlist = SHORTLIST_PER_MATCH * k
+        if scores is not None:
+            if mask is not None:
+                scores[~mask] = 0
+            candidates = np.flatnonzero(scores > 0)
+            if len(candidates) > shortlist:
+                candidates = candidates[np.argpartition(-scores[candidates], shortlist)[:shortlist]]
+            text_scores = scores[candidates]
+        elif mask is not None:
+            # Rows are already in popularity order
+            candidates = self.by_popularity[mask[self.by_popularity]][:shortlist]
+            text_scores = np.zeros(len(candidates), dtype=np.float32)
+        else:
+            return []
+        if not len(candidates):
+            return []
+
+        # Popularity breaks ties between equal text scores and ranks filter-only queries
+        order = np.lexsort((-self.popularity[candidates], -text_scores))
+        matches: List[CatalogMatch] = []
+        seen = set()
+        per_brand: Dict[int, int] = {}
+        # First pass spreads matches over brands, the second fills what is left
+        for brand_limit in (MATCHES_PER_BRAND, k):
+            for i in order.tolist():
+                row = int(candidates[i])
+                # The catalog lists some bottles several times; keep the most popular listing
+                key = self.names[row].lower()
+                brand = int(self.brands[row])
+                if key in seen or per_brand.get(brand, 0) >= brand_limit:
+                    continue
+                seen.add(key)
+                per_brand[brand] = per_brand.get(brand, 0) + 1
+                matches.append(CatalogMatch(row=row, id=self.ids[row], name=self.names[row],
+                                            spirit_type=self.spirit_values[self.spirit_codes[row]],
+                                            region=self.region_values[self.region_codes[row]],
+                                            msrp=float(self.msrp[row]), score=float(text_scores[i])))
+                if len(matches) >= k:
+                    return sorted(matches, key=lambda m: -m.score)
+        return sorted(matches, key=lambda m: -m.score)
+
+register_catalog_artifact('catalog_search', CatalogSearchIndex)
+
+def get_catalog_search_index() -> CatalogSearchIndex:
+    """The search index for the currently loaded catalog"""
+    return get_catalog_artifact('catalog_search')
+
+def format_matches(matches: List[CatalogMatch], max_chars: int = RETRIEVAL_MAX_CHARS) -> str:
+    """
+    Renders matches as a compact prompt block, one bottle per line, stopping
+    before the block would exceed max_chars.
+    """
+    if not matches:
+        return ""
+    header = "\nBottles from the BAXUS catalog matching the question (MSRP, name match score):\n"
+    lines = []
+    used = len(header)
+    for match in matches:
+        name = match.name if len(match.name) <= 60 else match.name[:57] + '...'
+        price = f"${match.msrp:.0f}" if match.msrp > 0 else "price n/a"
+        score = f" | {match.score:.1f}" if match.score > 0 else ""
+        line = f"- {name} | {match.spirit_type}, {match.region} | {price}{score}\n"
+        if used + len(line) > max_chars:
+            break
+        lines.append(line)
+        used += len(line)
+    if not lines:
+        return ""
+    return header + ''.join(lines) + "Prefer these bottles and prices when they fit the question.\n"
+
+def retrieve_for_prompt(question: str, k: int = RETRIEVAL_TOP_K,
+                        max_chars: int = RETRIEVAL_MAX_CHARS) -> str:
+    """
+    Catalog context for a chat question, or an empty string if nothing matches.
+
+    Args:
+        question: The user's latest message
+        k: Maximum number of bottles
+        max_chars: Size limit of the returned block
+
+    Returns:
+        Text to append to the system prompt
+    """
+    if k <= 0 or not question:
+        return ""
+    try:
+        matches = get_catalog_search_index().search(question, k)
+    except Exception as e:
+        # Retrieval only improves answers; never fail the chat over it
+        logger.warning(f"Catalog retrieval failed: {str(e)}")
+        CATALOG_RETRIEVALS.inc(result='error')
+        return ""
+    CATALOG_RETRIEVALS.inc(result='hit' if matches else 'empty')
+    return format_matches(matches, max_chars)
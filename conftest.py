@@ -0,0 +1,37 @@
+"""
+Shared pytest fixtures. Tests run from the repository root against the bundled
+catalog, with bars seeded into the BAXUS client's cache so nothing is fetched.
+"""
+import pandas as pd
+import pytest
+
+import baxus_api
+from benchmarks.synthetic import generate_bar
+from resilience import baxus_breaker, openai_breaker
+
+RAW_CATALOG_PATH = 'static/data/dataset.csv'
+
+@pytest.fixture(scope='session')
+def raw_catalog() -> pd.DataFrame:
+    """The bundled catalog in its CSV layout, as benchmarks.synthetic expects it"""
+    return pd.read_csv(RAW_CATALOG_PATH)
+
+@pytest.fixture
+def seed_bar(raw_catalog):
+    """Caches a bar for a username, as if it had just been fetched from BAXUS"""
+    def seed(username: str, num_bottles: int = 12, seed: int = 0):
+        user_data = generate_bar(raw_catalog, num_bottles, seed=seed)
+        baxus_api.store_user_bar_data(username, user_data)
+        return user_data
+    return seed
+
+@pytest.fixture(autouse=True)
+def isolated_upstreams(monkeypatch):
+    """Fails any real BAXUS call and leaves caches and breakers as each test found them"""
+    def no_network(*args, **kwargs):
+        raise baxus_api.requests.ConnectionError("tests don't reach BAXUS")
+    monkeypatch.setattr(baxus_api.requests, 'get', no_network)
+    yield
+    baxus_api.clear_bar_cache()
+    baxus_breaker.reset()
+    openai_breaker.reset()
@@ -0,0 +1,416 @@
+"""
+Collaborative-filtering signal from bottles that sit together in BAXUS bars.
+
+Bars are folded into a sparse, symmetric item-item co-occurrence matrix,
+which is factorized offline (PPMI + truncated SVD) into unit-length item
+vectors. At request time a user's bar is averaged into a profile vector and
+candidates are scored by cosine similarity to it.
+
+    # Ingest bar dumps (JSON lines) or the live-fetch spool into the matrix
+    python cooccurrence.py ingest bars.jsonl data/bar_spool.jsonl
+    # Factorize the matrix into item vectors used for ranking
+    python cooccurrence.py vectors --dim 32
+"""
+import os
+import sys
+import json
+import logging
+import argparse
+import threading
+import numpy as np
+import scipy.sparse as sp
+from typing import Dict, List, Any, Optional, Iterable, Iterator, Tuple
+from sklearn.decomposition import TruncatedSVD
+from baxus_api import add_bar_listener
+from bottle_dataset import get_bottle_dataset, get_catalog_version
+from metrics import timer
+
+logger = logging.getLogger(__name__)
+
+MATRIX_PATH = os.environ.get('BOB_COOCCURRENCE_PATH', 'data/cooccurrence.npz')
+VECTORS_PATH = os.environ.get('BOB_ITEM_VECTORS_PATH', 'data/item_vectors.npz')
+# When set, every bar fetched from BAXUS is appended here for the next ingest
+SPOOL_PATH = os.environ.get('BOB_BAR_SPOOL_PATH')
+
+# Pairs grow quadratically with bar size, so very large bars contribute an
+# evenly spaced sample of this many bottles
+MAX_BAR_ITEMS = 500
+# Pending pair updates held before folding them into the sparse matrix
+FLUSH_PAIRS = 4_000_000
+DEFAULT_DIM = 32
+# Items seen in fewer bars than this get no vector (their co-occurrences are noise)
+MIN_ITEM_BARS = 2
+
+def bar_bottle_ids(bar: Optional[List[Dict[str, Any]]]) -> List[int]:
+    """Catalog bottle ids (release ids) in a BAXUS bar payload"""
+    if not bar:
+        return []
+    return [entry['release_id'] for entry in bar if entry.get('release_id')]
+
+class CoOccurrenceMatrix:
+    """
+    Weighted count of bars containing each pair of bottles.
+
+    Each user's current bottle set is kept, so re-ingesting a changed bar
+    replaces its contribution instead of double counting it. Updates are
+    buffered as coordinate triples and folded into CSR in bounded chunks.
+
+    Attributes:
+        item_ids: Bottle id of each matrix row/column
+        item_bars: Weighted number of bars containing each item
+    """
+
+    def __init__(self):
+        self.item_ids: List[int] = []
+        self.item_bars = np.zeros(0, dtype=np.float32)
+        self._column_of: Dict[int, int] = {}
+        self._user_items: Dict[str, np.ndarray] = {}
+        self._counts = sp.csr_matrix((0, 0), dtype=np.float32)
+        self._pending: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        self._pending_pairs = 0
+
+    @property
+    def num_users(self) -> int:
+        return len(self._user_items)
+
+    @property
+    def num_pairs(self) -> int:
+        """Number of (user, bottle) pairs ingested"""
+        return sum(len(items) for items in self._user_items.values())
+
+    def _columns(self, bottle_ids: Iterable[Any]) -> np.ndarray:
+        """Matrix columns of the given bottle ids, allocating new ones as needed"""
+        columns = []
+        for bottle_id in bottle_ids:
+            column = self._column_of.get(bottle_id)
+            if column is None:
+                column = self._column_of[bottle_id] = len(self.item_ids)
+                self.item_ids.append(bottle_id)
+            columns.append(column)
+        if len(self.item_ids) > len(self.item_bars):
+            grown = np.zeros(max(len(self.item_ids), 2 * len(self.item_bars)), dtype=np.float32)
+            grown[:len(self.item_bars)] = self.item_bars
+            self.item_bars = grown
+        return np.unique(np.asarray(columns, dtype=np.int32))
+
+    def update_bar(self, username: str, bottle_ids: Iterable[Any]) -> bool:
+        """
+        Sets a user's bar, replacing any earlier contribution of that user.
+
+        Args:
+            username: BAXUS username
+            bottle_ids: Catalog ids of the bottles in the bar
+
+        Returns:
+            Whether the user's bar changed
+        """
+        columns = self._columns(bottle_ids)
+        previous = self._user_items.get(username)
+        if previous is not None and np.array_equal(previous, columns):
+            return False
+        if previous is not None:
+            self._add_bar(previous, -1.0)
+        if len(columns):
+            self._user_items[username] = columns
+            self._add_bar(columns, 1.0)
+        else:
+            self._user_items.pop(username, None)
+        return True
+
+    def remove_user(self, username: str) -> bool:
+        """Drops a user's contribution, e.g. after they delete their account"""
+        previous = self._user_items.pop(username, None)
+        if previous is None:
+            return False
+        self._add_bar(previous, -1.0)
+        return True
+
+    def _add_bar(self, columns: np.ndarray, sign: float) -> None:
+        # Large collections say less about any single pair, and would
+        # otherwise dominate the counts
+        weight = sign / np.log2(2 + len(columns))
+        self.item_bars[columns] += sign
+        if len(columns) > MAX_BAR_ITEMS:
+            columns = columns[np.linspace(0, len(columns) - 1, MAX_BAR_ITEMS).astype(np.int64)]
+        first, second = np.triu_indices(len(columns), k=1)
+        if not len(first):
+            return
+        self._pending.append((columns[first], columns[second],
+                              np.full(len(first), weight, dtype=np.float32)))
+        self._pending_pairs += len(first)
+        if self._pending_pairs >= FLUSH_PAIRS:
+            self._fold()
+
+    def _fold(self) -> None:
+        """Fold pending updates into the symmetric CSR matrix"""
+        n_items = len(self.item_ids)
+        counts = self._counts
+        if counts.shape[0] < n_items:
+            counts = sp.csr_matrix((counts.data, counts.indices,
+                                    np.pad(counts.indptr, (0, n_items - counts.shape[0]), mode='edge')),
+                                   shape=(n_items, n_items))
+        if self._pending:
+            rows = np.concatenate([p[0] for p in self._pending])
+            cols = np.concatenate([p[1] for p in self._pending])
+            data = np.concatenate([p[2] for p in self._pending])
+            upper = sp.csr_matrix((data, (rows, cols)), shape=(n_items, n_items), dtype=np.float32)
+            counts = counts + upper + upper.T
+            # Removals leave float residue where a pair went back to zero
+            counts.data[np.abs(counts.data) < 1e-4] = 0
+            counts.eliminate_zeros()
+        self._counts = counts.astype(np.float32)
+        self._pending = []
+        self._pending_pairs = 0
+
+    @property
+    def counts(self) -> sp.csr_matrix:
+        """The item-item matrix, with all pending updates applied"""
+        if self._pending or self._counts.shape[0] != len(self.item_ids):
+            self._fold()
+        return self._counts
+
+    def save(self, path: str) -> None:
+        """Write the matrix and per-user bars atomically"""
+        counts = self.counts
+        usernames = list(self._user_items)
+        user_items = [self._user_items[name] for name in usernames]
+        user_indptr = np.zeros(len(usernames) + 1, dtype=np.int64)
+        np.cumsum([len(items) for items in user_items], out=user_indptr[1:])
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.tmp-{os.getpid()}.npz"
+        # Native dtype, as in ItemVectors: release ids aren't always integers
+        np.savez(tmp_path, item_ids=np.asarray(self.item_ids),
+                 item_bars=self.item_bars[:len(self.item_ids)],
+                 data=counts.data, indices=counts.indices, indptr=counts.indptr,
+                 usernames=np.asarray(usernames, dtype=str), user_indptr=user_indptr,
+                 user_items=np.concatenate(user_items) if user_items else np.zeros(0, dtype=np.int32))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'CoOccurrenceMatrix':
+        matrix = cls()
+        with np.load(path, allow_pickle=False) as data:
+            matrix.item_ids = data['item_ids'].tolist()
+            matrix._column_of = {bottle_id: column for column, bottle_id in enumerate(matrix.item_ids)}
+            matrix.item_bars = data['item_bars'].astype(np.float32)
+            n_items = len(matrix.item_ids)
+            matrix._counts = sp.csr_matrix((data['data'], data['indices'], data['indptr']),
+                                           shape=(n_items, n_items))
+            user_indptr, user_items = data['user_indptr'], data['user_items'].astype(np.int32)
+            for i, username in enumerate(data['usernames'].tolist()):
+                matrix._user_items[username] = user_items[user_indptr[i]:user_indptr[i + 1]]
+        return matrix
+
+class ItemVectors:
+    """
+    Unit-length item vectors factorized from the co-occurrence matrix.
+
+    Attributes:
+        item_ids: Bottle id of each vector
+        vectors: float32 array of shape (n_items, dim); zero rows for items
+            with too little data
+    """
+
+    def __init__(self, item_ids: np.ndarray, vectors: np.ndarray):
+        self.item_ids = np.asarray(item_ids)
+        self.vectors = vectors.astype(np.float32)
+
+    @classmethod
+    @timer('item_vectors')
+    def from_cooccurrence(cls, matrix: CoOccurrenceMatrix, dim: int = DEFAULT_DIM,
+                          min_bars: int = MIN_ITEM_BARS, seed: int = 0) -> 'ItemVectors':
+        """
+        Factorizes positive pointwise mutual information of the co-occurrence
+        counts, so popular bottles don't look similar to everything.
+
+        Args:
+            matrix: The co-occurrence matrix
+            dim: Vector dimensionality
+            min_bars: Minimum number of bars an item needs to get a vector
+            seed: Random seed of the randomized SVD
+
+        Returns:
+            The item vectors
+        """
+        counts = matrix.counts.tocoo()
+        n_items = counts.shape[0]
+        totals = np.asarray(matrix.counts.sum(axis=1)).ravel()
+        grand_total = totals.sum()
+        if n_items < 2 or grand_total <= 0:
+            return cls(np.asarray(matrix.item_ids), np.zeros((n_items, dim), dtype=np.float32))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pmi = np.log(counts.data * grand_total / (totals[counts.row] * totals[counts.col]))
+        keep = np.isfinite(pmi) & (pmi > 0)
+        ppmi = sp.csr_matrix((pmi[keep].astype(np.float32), (counts.row[keep], counts.col[keep])),
+                             shape=(n_items, n_items))
+
+        components = max(1, min(dim, n_items - 1))
+        svd = TruncatedSVD(n_components=components, algorithm='randomized', random_state=seed)
+        # U * sqrt(sigma) balances the two factors, the usual choice for word/item vectors
+        vectors = svd.fit_transform(ppmi) / np.sqrt(np.maximum(svd.singular_values_, 1e-12))
+        if components < dim:
+            vectors = np.pad(vectors, ((0, 0), (0, dim - components)))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = np.where(norms > 0, vectors / np.where(norms > 0, norms, 1), 0)
+        vectors[matrix.item_bars[:n_items] < min_bars] = 0
+        return cls(np.asarray(matrix.item_ids), vectors)
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.tmp-{os.getpid()}.npz"
+        np.savez(tmp_path, item_ids=self.item_ids, vectors=self.vectors)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'ItemVectors':
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data['item_ids'], data['vectors'])
+
+class CatalogItemVectors:
+    """
+    Item vectors aligned with the catalog rows, so scoring candidates is a
+    single matrix-vector product.
+
+    Attributes:
+        vectors: float32 array of shape (catalog rows, dim), zero for unknown bottles
+        known: Whether each catalog row has a vector
+    """
+
+    def __init__(self, item_vectors: ItemVectors, catalog_ids: np.ndarray):
+        row_of_item = {bottle_id: row for row, bottle_id in enumerate(item_vectors.item_ids.tolist())}
+        item_rows = np.array([row_of_item.get(bottle_id, -1) for bottle_id in catalog_ids.tolist()],
+                             dtype=np.int64)
+        self.vectors = np.zeros((len(catalog_ids), item_vectors.vectors.shape[1]), dtype=np.float32)
+        present = item_rows >= 0
+        self.vectors[present] = item_vectors.vectors[item_rows[present]]
+        self.known = np.linalg.norm(self.vectors, axis=1) > 0
+        self._row_of_id = {bottle_id: row for row, bottle_id in enumerate(catalog_ids.tolist())}
+
+    def profile(self, owned_ids: Iterable[Any]) -> Optional[np.ndarray]:
+        """Unit-length mean of the vectors of the user's bottles, or None if none are known"""
+        rows = [self._row_of_id.get(bottle_id) for bottle_id in owned_ids]
+        rows = [row for row in rows if row is not None and self.known[row]]
+        if not rows:
+            return None
+        profile = self.vectors[rows].mean(axis=0)
+        norm = np.linalg.norm(profile)
+        return profile / norm if norm > 0 else None
+
+# Catalog-aligned vectors, rebuilt when the catalog or the vectors file changes
+_aligned_lock = threading.Lock()
+_aligned: Dict[str, Any] = {'key': None, 'value': None}
+
+def get_catalog_item_vectors() -> Optional[CatalogItemVectors]:
+    """Item vectors for the current catalog, or None if no vectors have been built"""
+    try:
+        stat = os.stat(VECTORS_PATH)
+    except OSError:
+        return None
+    key = (get_catalog_version(), stat.st_mtime_ns, stat.st_size)
+    if _aligned['key'] == key:
+        return _aligned['value']
+    with _aligned_lock:
+        if _aligned['key'] != key:
+            try:
+                value = CatalogItemVectors(ItemVectors.load(VECTORS_PATH), get_bottle_dataset()['id'].to_numpy())
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Ignoring unreadable item vectors at {VECTORS_PATH}: {str(e)}")
+                value = None
+            _aligned.update(key=key, value=value)
+        return _aligned['value']
+
+def cf_scores(owned_ids: Iterable[Any], rows: np.ndarray) -> Optional[np.ndarray]:
+    """
+    Collaborative-filtering scores of catalog rows for a user.
+
+    Args:
+        owned_ids: Bottle ids in the user's bar
+        rows: Catalog row positions to score
+
+    Returns:
+        Scores in [0, 1] (0.5 is neutral, unknown bottles score 0), or None
+        when there are no item vectors or none of the user's bottles has one
+    """
+    aligned = get_catalog_item_vectors()
+    if aligned is None:
+        return None
+    profile = aligned.profile(owned_ids)
+    if profile is None:
+        return None
+    scores = (aligned.vectors[rows] @ profile + 1) / 2
+    return np.where(aligned.known[rows], scores, 0).astype(np.float32)
+
+_spool_lock = threading.Lock()
+
+def spool_bar(username: str, user_data: Dict[str, Any]) -> None:
+    """Append a freshly fetched bar to the spool file for the next offline ingest"""
+    record = json.dumps({'username': username, 'bottle_ids': bar_bottle_ids(user_data.get('bar'))})
+    try:
+        with _spool_lock, open(SPOOL_PATH, 'a', encoding='utf-8') as spool:
+            spool.write(record + '\n')
+    except OSError as e:
+        logger.warning(f"Could not spool bar for {username}: {str(e)}")
+
+if SPOOL_PATH:
+    add_bar_listener(spool_bar)
+
+def read_bar_records(path: str) -> Iterator[Tuple[str, List[Any]]]:
+    """
+    Streams (username, bottle ids) from a JSON-lines dump.
+
+    Each line holds a username and either a raw BAXUS bar payload under
+    "bar" or already extracted ids under "bottle_ids".
+    """
+    with open(path, encoding='utf-8') as dump:
+        for line_number, line in enumerate(dump, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                username = record['username']
+            except (ValueError, KeyError, TypeError):
+                logger.warning(f"Skipping malformed record at {path}:{line_number}")
+                continue
+            if 'bottle_ids' in record:
+                yield username, record['bottle_ids']
+            else:
+                yield username, bar_bottle_ids(record.get('bar'))
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Build the bar co-occurrence model")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    ingest_parser = subparsers.add_parser('ingest', help="Fold bar dumps into the co-occurrence matrix")
+    ingest_parser.add_argument('dumps', nargs='+', help="JSON-lines files of bars")
+    ingest_parser.add_argument('--matrix', default=MATRIX_PATH)
+    ingest_parser.add_argument('--fresh', action='store_true', help="Ignore the existing matrix")
+
+    vectors_parser = subparsers.add_parser('vectors', help="Factorize the matrix into item vectors")
+    vectors_parser.add_argument('--matrix', default=MATRIX_PATH)
+    vectors_parser.add_argument('--output', default=VECTORS_PATH)
+    vectors_parser.add_argument('--dim', type=int, default=DEFAULT_DIM)
+    vectors_parser.add_argument('--min-bars', type=int, default=MIN_ITEM_BARS)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == 'ingest':
+        matrix = (CoOccurrenceMatrix.load(args.matrix)
+                  if os.path.exists(args.matrix) and not args.fresh else CoOccurrenceMatrix())
+        changed = 0
+        for path in args.dumps:
+            for username, bottle_ids in read_bar_records(path):
+                changed += matrix.update_bar(username, bottle_ids)
+        matrix.save(args.matrix)
+        print(f"Updated {changed} bars; {matrix.num_users} users, {len(matrix.item_ids)} bottles, "
+              f"{matrix.num_pairs} user-bottle pairs, {matrix.counts.nnz} item pairs -> {args.matrix}")
+    else:
+        vectors = ItemVectors.from_cooccurrence(CoOccurrenceMatrix.load(args.matrix),
+                                                args.dim, args.min_bars)
+        vectors.save(args.output)
+        print(f"Wrote {len(vectors.item_ids)} item vectors (dim {vectors.vectors.shape[1]}) to {args.output}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+from typing import List, Tuple
+from models import FLAVORS, UserPreferences
+
+# Numeric bottle attributes used as recommendation features, before the
+# one-hot encoded spirit type and region columns
+NUMERIC_FEATURES = [
+    'abv', 'msrp',
+    'flavor_profile_peated', 'flavor_profile_sherried', 
+    'flavor_profile_fruity', 'flavor_profile_spicy',
+    'flavor_profile_smoky', 'flavor_profile_vanilla', 'flavor_profile_caramel'
+]
+
+def encode_bottle_features(bottles: pd.DataFrame) -> Tuple[np.ndarray, List[str]]:
+    """
+    Builds the unscaled feature matrix for a set of bottles.
+    
+    Args:
+        bottles: Catalog rows to encode
+        
+    Returns:
+        Tuple of (float feature matrix, feature column names)
+    """
+    feature_columns = list(NUMERIC_FEATURES)
+    
+    # One-hot encode categorical features
+    bottles_encoded = pd.get_dummies(
+        bottles, 
+        columns=['spirit_type', 'region'],
+        prefix=['spirit', 'region']
+    )
+    
+    # Add the one-hot encoded columns to our feature list
+    encoded_features = [col for col in bottles_encoded.columns 
+                       if col.startswith('spirit_') or col.startswith('region_')]
+    feature_columns.extend(encoded_features)
+    
+    # Ensure all feature columns exist in the dataframe
+    feature_columns = [col for col in feature_columns if col in bottles_encoded.columns]
+    
+    return bottles_encoded[feature_columns].to_numpy(dtype=float), feature_columns
+
+def build_user_vector(feature_columns: List[str], preferences: UserPreferences) -> np.ndarray:
+    """
+    Places a user's preferences in the same (unscaled) feature space as the bottles.
+    
+    Args:
+        feature_columns: Feature names returned by encode_bottle_features
+        preferences: Analyzed user preferences
+        
+    Returns:
+        Feature vector of shape (n_features,)
+    """
+    # Create a user preference vector based on their collection
+    user_vector = np.zeros(len(feature_columns))
+    
+    # Set numeric preferences
+    for i, col in enumerate(feature_columns):
+        if col == 'abv':
+            # Calculate weighted average ABV preference
+            user_vector[i] = (
+                (preferences.abv_share('low') * 40) + 
+                (preferences.abv_share('medium') * 46) + 
+                (preferences.abv_share('high') * 55)
+            ) / 100
+        elif col == 'msrp':
+            user_vector[i] = preferences.average_bottle_price
+        elif col.startswith('flavor_profile_'):
+            flavor = col.replace('flavor_profile_', '')
+            user_vector[i] = preferences.flavor(flavor) if flavor in FLAVORS else 0
+        elif col.startswith('spirit_'):
+            spirit = col.replace('spirit_', '')
+            user_vector[i] = preferences.spirit_types.get(spirit, 0) / 100
+        elif col.startswith('region_'):
+            region = col.replace('region_', '')
+            user_vector[i] = preferences.preferred_regions.get(region, 0) / 100
+    
+    return user_vector
+
+def min_max_scale(X: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Scales each column to [0, 1] like sklearn's MinMaxScaler.
+    
+    Returns:
+        Tuple of (scaled matrix, column minimums, column ranges); constant
+        columns get a range of 1 so they scale to zero
+    """
+    minimum = X.min(axis=0) if len(X) else np.zeros(X.shape[1])
+    spread = (X.max(axis=0) - minimum) if len(X) else np.ones(X.shape[1])
+    spread[spread == 0] = 1.0
+    return (X - minimum) / spread, minimum, spread
@@ -0,0 +1,300 @@
+"""
+Local thumbnails of catalog bottle images.
+
+Recommendation cards used to hot-link full-size CDN images and shrink them in
+CSS. Instead, each catalog image is fetched once, resized to the standard
+sizes in THUMBNAIL_SIZES and kept on disk under BOB_IMAGE_CACHE_DIR. The
+file name carries a hash of the thumbnail's bytes, which the page puts in
+the image URL, so browsers and CDNs can cache it forever.
+
+Only images referenced by the catalog are proxied (looked up by bottle id),
+so the route can't be used to fetch arbitrary URLs.
+
+Resizing needs Pillow. Without it the original image is cached and served
+for every size, which still removes the page's dependency on the CDN.
+
+Usage:
+    # Pre-thumbnail the whole catalog before the cards are first shown
+    python image_proxy.py prefetch --concurrency 8 --rate 10
+"""
+import os
+import io
+import sys
+import time
+import hashlib
+import logging
+import argparse
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Any, Optional, Tuple
+from bottle_dataset import register_catalog_artifact, get_catalog_artifact
+from metrics import counter, timer
+
+try:
+    from PIL import Image
+except ImportError:  # Optional: thumbnails fall back to the original image
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+IMAGE_CACHE_DIR = os.environ.get('BOB_IMAGE_CACHE_DIR', 'data/images')
+# Longest edge in pixels; 'lg' is 'md' at 2x for high-density screens
+THUMBNAIL_SIZES = {'sm': 100, 'md': 200, 'lg': 400}
+THUMBNAIL_QUALITY = 80
+FETCH_TIMEOUT = float(os.environ.get('BOB_IMAGE_FETCH_TIMEOUT', 10))
+MAX_SOURCE_BYTES = 10 * 1024 * 1024
+# Seconds before a failed source image is tried again
+FAILURE_TTL = 600
+
+IMAGE_CACHE = counter('bob_image_cache_lookups_total', 'Thumbnail cache lookups by result', ('result',))
+
+_EXTENSIONS = {'image/webp': 'webp', 'image/jpeg': 'jpg', 'image/png': 'png', 'image/gif': 'gif'}
+_MIMETYPES = {ext: mimetype for mimetype, ext in _EXTENSIONS.items()}
+
+@dataclass(frozen=True)
+class Thumbnail:
+    """A cached thumbnail file"""
+    path: str
+    mimetype: str
+    # Hash of the file contents, used as validator and cache-busting version
+    content_hash: str
+
+def url_key(image_url: str) -> str:
+    """Cache directory name of a source image URL"""
+    return hashlib.sha1(image_url.encode()).hexdigest()[:20]
+
+class ThumbnailCache:
+    """
+    On-disk thumbnails keyed by source URL: <root>/<key[:2]>/<key>/<size>-<hash>.<ext>.
+
+    Each source is downloaded at most once at a time; concurrent requests for
+    the same image wait for the first download. Failed sources are not retried
+    for FAILURE_TTL seconds.
+    """
+
+    def __init__(self, root: str = IMAGE_CACHE_DIR):
+        self.root = root
+        # (key, size) -> thumbnail, for files already found on disk
+        self._known: Dict[Tuple[str, str], Thumbnail] = {}
+        self._failed: Dict[str, float] = {}
+        # key -> [lock, number of requests holding or waiting on it]
+        self._locks: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def _directory(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def lookup(self, image_url: str, size: str) -> Optional[Thumbnail]:
+        """The cached thumbnail, without fetching anything"""
+        key = url_key(image_url)
+        thumbnail = self._known.get((key, size))
+        if thumbnail is not None:
+            return thumbnail
+        directory = self._directory(key)
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return None
+        for name in names:
+            stem, _, ext = name.partition('.')
+            label, _, content_hash = stem.partition('-')
+            if label == size and ext in _MIMETYPES:
+                thumbnail = Thumbnail(os.path.join(directory, name), _MIMETYPES[ext], content_hash)
+                self._known[(key, size)] = thumbnail
+                return thumbnail
+        return None
+
+    def get(self, image_url: str, size: str) -> Optional[Thumbnail]:
+        """
+        The thumbnail of an image at a standard size, fetching and resizing
+        the source on a miss.
+
+        Args:
+            image_url: Source image URL from the catalog
+            size: One of THUMBNAIL_SIZES
+
+        Returns:
+            The thumbnail, or None if the source could not be fetched or decoded
+        """
+        thumbnail = self.lookup(image_url, size)
+        if thumbnail is not None:
+            IMAGE_CACHE.inc(result='hit')
+            return thumbnail
+
+        key = url_key(image_url)
+        with self._lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        lock = entry[0]
+        try:
+            with lock:
+                # Another request may have created it while we waited
+                thumbnail = self.lookup(image_url, size)
+                if thumbnail is not None:
+                    IMAGE_CACHE.inc(result='hit')
+                    return thumbnail
+                if self._failed.get(key, 0) > time.time():
+                    IMAGE_CACHE.inc(result='failed')
+                    return None
+                IMAGE_CACHE.inc(result='miss')
+                if not self._create(image_url, key):
+                    self._failed[key] = time.time() + FAILURE_TTL
+                    return None
+        finally:
+            # Dropped only by the last waiter, so a later request can't create
+            # a second lock while one is still held
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+        return self.lookup(image_url, size)
+
+    def _create(self, image_url: str, key: str) -> bool:
+        """Fetch a source image and write every thumbnail size of it"""
+        source = _fetch(image_url)
+        if source is None:
+            return False
+        data, mimetype = source
+        try:
+            with timer('thumbnail_resize'):
+                variants = _resize(data, mimetype)
+        except Exception as e:
+            logger.warning(f"Could not decode image {image_url}: {str(e)}")
+            return False
+
+        directory = self._directory(key)
+        os.makedirs(directory, exist_ok=True)
+        for size, (content, content_type) in variants.items():
+            content_hash = hashlib.sha1(content).hexdigest()[:12]
+            path = os.path.join(directory, f"{size}-{content_hash}.{_EXTENSIONS[content_type]}")
+            # Write-then-rename so readers never see a partial file
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+            self._known[(key, size)] = Thumbnail(path, content_type, content_hash)
+        return True
+
+@timer('image_fetch')
+def _fetch(image_url: str) -> Optional[Tuple[bytes, str]]:
+    """Download a source image; returns (bytes, mimetype) or None"""
+    try:
+        with requests.get(image_url, timeout=FETCH_TIMEOUT, stream=True) as response:
+            if response.status_code != 200:
+                logger.warning("Image fetch failed for %s: status %d", image_url, response.status_code)
+                return None
+            mimetype = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+            if not mimetype.startswith('image/'):
+                logger.warning("Image fetch for %s returned %s", image_url, mimetype or 'no content type')
+                return None
+            chunks, total = [], 0
+            for chunk in response.iter_content(64 * 1024):
+                total += len(chunk)
+                if total > MAX_SOURCE_BYTES:
+                    logger.warning("Image %s exceeds %d bytes", image_url, MAX_SOURCE_BYTES)
+                    return None
+                chunks.append(chunk)
+            return b''.join(chunks), mimetype
+    except requests.RequestException as e:
+        logger.warning(f"Image fetch error for {image_url}: {str(e)}")
+        return None
+
+def _resize(data: bytes, mimetype: str) -> Dict[str, Tuple[bytes, str]]:
+    """Every standard size of an image as (bytes, mimetype)"""
+    if Image is None:
+        if mimetype not in _EXTENSIONS:
+            raise ValueError(f"unsupported type {mimetype} without Pillow")
+        return {size: (data, mimetype) for size in THUMBNAIL_SIZES}
+
+    source = Image.open(io.BytesIO(data))
+    source.load()
+    if source.mode not in ('RGB', 'RGBA'):
+        source = source.convert('RGBA' if 'A' in source.getbands() or 'transparency' in source.info else 'RGB')
+    variants = {}
+    for size, edge in THUMBNAIL_SIZES.items():
+        image = source.copy()
+        # Never upscale: small sources are only re-encoded
+        image.thumbnail((edge, edge), Image.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, format='WEBP', quality=THUMBNAIL_QUALITY, method=4)
+        variants[size] = (buffer.getvalue(), 'image/webp')
+    return variants
+
+def _image_urls(df) -> Dict[Any, str]:
+    """Bottle id -> image URL for bottles that have one"""
+    urls = df[['id', 'image_url']].dropna()
+    urls = urls[urls['image_url'].astype(str).str.startswith(('http://', 'https://'))]
+    return dict(zip(urls['id'].tolist(), urls['image_url'].tolist()))
+
+register_catalog_artifact('image_urls', _image_urls, eager=False)
+
+thumbnail_cache = ThumbnailCache()
+
+def bottle_image_url(bottle_id: Any) -> Optional[str]:
+    """The catalog image URL of a bottle, or None"""
+    return get_catalog_artifact('image_urls').get(bottle_id)
+
+def prefetch_catalog(concurrency: int = 8, rate: float = 10.0, limit: Optional[int] = None,
+                     progress_interval: float = 10.0) -> Dict[str, Any]:
+    """
+    Creates thumbnails for every catalog image that doesn't have them yet.
+
+    Args:
+        concurrency: Parallel downloads
+        rate: Maximum downloads per second toward the image host (0 for no limit)
+        limit: Only the first N catalog images
+        progress_interval: Seconds between progress log lines
+
+    Returns:
+        Dictionary with counts of cached, created and failed images and the run time
+    """
+    from warmup import RateLimiter
+
+    urls = list(dict.fromkeys(get_catalog_artifact('image_urls').values()))[:limit]
+    pending = [url for url in urls if thumbnail_cache.lookup(url, 'md') is None]
+    stats = {'images': len(urls), 'cached': len(urls) - len(pending), 'created': 0, 'failed': 0}
+    limiter = RateLimiter(rate)
+    lock = threading.Lock()
+    started = time.perf_counter()
+    last_logged = [started]
+
+    def work(url: str) -> None:
+        limiter.acquire()
+        outcome = 'created' if thumbnail_cache.get(url, 'md') is not None else 'failed'
+        with lock:
+            stats[outcome] += 1
+            now = time.perf_counter()
+            if now - last_logged[0] >= progress_interval:
+                last_logged[0] = now
+                done = stats['created'] + stats['failed']
+                logger.info(f"Thumbnails: {done}/{len(pending)} "
+                            f"({done / (now - started):.1f} images/s, {stats['failed']} failed)")
+
+    logger.info(f"Creating thumbnails for {len(pending)} of {len(urls)} catalog images")
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='thumbnails') as pool:
+        list(pool.map(work, pending))
+    stats['duration_s'] = time.perf_counter() - started
+    return stats
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Manage the bottle image thumbnail cache")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    prefetch_parser = subparsers.add_parser('prefetch', help="Thumbnail every catalog image")
+    prefetch_parser.add_argument('--concurrency', type=int, default=8)
+    prefetch_parser.add_argument('--rate', type=float, default=10.0,
+                                 help="Downloads per second (0 for no limit)")
+    prefetch_parser.add_argument('--limit', type=int, default=None)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if Image is None:
+        logger.warning("Pillow is not installed; original images will be cached without resizing")
+    stats = prefetch_catalog(args.concurrency, args.rate, args.limit)
+    print(f"{stats['images']} catalog images: {stats['cached']} already cached, {stats['created']} created, "
+          f"{stats['failed']} failed in {stats['duration_s']:.1f}s")
+    return 1 if stats['failed'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
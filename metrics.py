@@ -0,0 +1,196 @@
+import time
+import logging
+import threading
+import functools
+from bisect import bisect_left
+from typing import Dict, List, Tuple, Optional, Callable, Any
+from structured_logging import log_enabled
+
+# Latency buckets in seconds, tuned for stages between ~100us (cache lookups)
+# and tens of seconds (slow OpenAI calls)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class _Metric:
+    """Base class for a metric family with an optional fixed set of label names"""
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], Any] = {}
+
+    def _label_values(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format_labels(self, values: Tuple[str, ...], extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(zip(self.labelnames, values))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+                   for _, value in pairs)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            children = sorted(self._children.items())
+        for values, child in children:
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values: Tuple[str, ...], child: Any) -> List[str]:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    """A monotonically increasing count, e.g. cache hits or upstream errors"""
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            self._children[key] = self._children.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._children.get(self._label_values(labels), 0)
+
+    def _render_child(self, values: Tuple[str, ...], child: float) -> List[str]:
+        return [f"{self.name}{self._format_labels(values)} {child}"]
+
+class Histogram(_Metric):
+    """A distribution of observations over fixed, cumulative buckets"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._label_values(labels)
+        # Only the matching bucket is incremented; cumulative counts are built at render time
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            child[0][index] += 1
+            child[1] += value
+            child[2] += 1
+
+    def count(self, **labels: str) -> int:
+        child = self._children.get(self._label_values(labels))
+        return child[2] if child else 0
+
+    def _render_child(self, values: Tuple[str, ...], child: list) -> List[str]:
+        counts, total, count = child
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            lines.append(f"{self.name}_bucket{self._format_labels(values, ('le', repr(float(bound))))} {cumulative}")
+        lines.append(f"{self.name}_bucket{self._format_labels(values, ('le', '+Inf'))} {count}")
+        lines.append(f"{self.name}_sum{self._format_labels(values)} {total}")
+        lines.append(f"{self.name}_count{self._format_labels(values)} {count}")
+        return lines
+
+_registry: Dict[str, _Metric] = {}
+_registry_lock = threading.Lock()
+
+def _register(metric: _Metric) -> _Metric:
+    with _registry_lock:
+        existing = _registry.get(metric.name)
+        if existing is not None:
+            return existing
+        _registry[metric.name] = metric
+        return metric
+
+def counter(name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+    """Get or create a registered counter"""
+    return _register(Counter(name, documentation, labelnames))
+
+def histogram(name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+              buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+    """Get or create a registered histogram"""
+    return _register(Histogram(name, documentation, labelnames, buckets))
+
+# Shared metric families used across the pipeline
+STAGE_SECONDS = histogram('bob_stage_duration_seconds',
+                          'Time spent in each recommendation and chat pipeline stage',
+                          ('stage',))
+STAGE_ERRORS = counter('bob_stage_errors_total',
+                       'Pipeline stages that raised an exception',
+                       ('stage',))
+HTTP_SECONDS = histogram('bob_http_request_duration_seconds',
+                         'End-to-end Flask request latency by endpoint',
+                         ('endpoint', 'method'))
+CHAT_CACHE = counter('bob_chat_cache_lookups_total',
+                     'Chat response cache lookups by result and conversation depth in user turns',
+                     ('result', 'depth'))
+
+_stage_logger = logging.getLogger('bob.stages')
+
+def _log_stage(stage: str, seconds: float) -> None:
+    if log_enabled(_stage_logger):
+        _stage_logger.debug("stage %s took %.2fms", stage, seconds * 1000,
+                            extra={'fields': {'stage': stage, 'ms': round(seconds * 1000, 3)}})
+
+class timer:
+    """
+    Times a pipeline stage into STAGE_SECONDS.
+
+    Usable both as a context manager (``with timer('knn'):``) and as a
+    decorator (``@timer('analyze_preferences')``). Exceptions are counted in
+    STAGE_ERRORS and re-raised.
+    """
+    __slots__ = ('stage', '_start')
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self._start = 0.0
+
+    def __enter__(self) -> 'timer':
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        elapsed = time.perf_counter() - self._start
+        STAGE_SECONDS.observe(elapsed, stage=self.stage)
+        _log_stage(self.stage, elapsed)
+        if exc_type is not None:
+            STAGE_ERRORS.inc(stage=self.stage)
+        return False
+
+    def __call__(self, func: Callable) -> Callable:
+        stage = self.stage
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                STAGE_ERRORS.inc(stage=stage)
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                STAGE_SECONDS.observe(elapsed, stage=stage)
+                _log_stage(stage, elapsed)
+        return wrapper
+
+def render_prometheus() -> str:
+    """Render every registered metric in the Prometheus text exposition format"""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    lines: List[str] = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
@@ -1,41 +1,167 @@
-# Currently unused, but could be expanded if database persistence is needed
-from dataclasses import dataclass
-from typing import List, Dict, Any
+"""
+Typed records passed through the recommendation pipeline.
 
-@dataclass
+Both classes are slotted, so instances carry no per-object __dict__, and the
+fixed-vocabulary fields (flavors, price ranges, ABV levels) are numpy
+arrays in a fixed order rather than nested dicts.
+"""
+import weakref
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass, field, fields
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+
+# Fixed orders of the array-valued fields
+FLAVORS = ('peated', 'sherried', 'fruity', 'spicy', 'smoky', 'vanilla', 'caramel')
+PRICE_RANGES = ('entry', 'mid', 'premium', 'luxury')  # $0-50, $51-100, $101-200, $201+
+ABV_LEVELS = ('low', 'medium', 'high')                 # <43%, 43-50%, >50%
+
+FLAVOR_COLUMNS = tuple(f'flavor_profile_{flavor}' for flavor in FLAVORS)
+
+def _zeros(size: int, dtype=np.float64) -> np.ndarray:
+    return np.zeros(size, dtype=dtype)
+
+@dataclass(slots=True)
 class Bottle:
     """Represents a whisky bottle with all its attributes"""
-    id: str
+    id: int
     name: str
-    size: str = None
-    proof: float = None
-    abv: float = None
-    spirit_type: str = None
-    brand_id: str = None
-    region: str = None
-    popularity: float = None
-    image_url: str = None
-    msrp: float = None
-    fair_price: float = None
-    shelf_price: float = None
-    total_score: float = None
-    wishlist_count: int = None
-    vote_count: int = None
-    bar_count: int = None
-    ranking: int = None
-    flavor_profile: Dict[str, float] = None
-    tasting_notes: List[str] = None
-
-@dataclass
+    size: Optional[int] = None
+    proof: Optional[float] = None
+    abv: Optional[float] = None
+    spirit_type: Optional[str] = None
+    brand_id: Optional[float] = None
+    region: Optional[str] = None
+    popularity: Optional[float] = None
+    image_url: Optional[str] = None
+    msrp: Optional[float] = None
+    fair_price: Optional[float] = None
+    shelf_price: Optional[float] = None
+    total_score: Optional[float] = None
+    wishlist_count: Optional[int] = None
+    vote_count: Optional[int] = None
+    bar_count: Optional[int] = None
+    ranking: Optional[int] = None
+    # Intensity per flavor in FLAVORS order
+    flavor_profile: np.ndarray = field(default_factory=lambda: _zeros(len(FLAVORS), np.float32))
+    explanation: str = ''
+
+    def flavor(self, name: str) -> float:
+        """Intensity of a single flavor"""
+        return float(self.flavor_profile[FLAVORS.index(name)])
+
+    def flavor_items(self) -> Iterator[Tuple[str, float]]:
+        """(flavor, intensity) pairs in FLAVORS order"""
+        return zip(FLAVORS, self.flavor_profile.tolist())
+
+    def flavor_dict(self) -> Dict[str, float]:
+        return dict(self.flavor_items())
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Flat dictionary in the catalog's column layout, for JSON responses"""
+        data = {f.name: getattr(self, f.name) for f in fields(self) if f.name != 'flavor_profile'}
+        data.update(zip(FLAVOR_COLUMNS, self.flavor_profile.tolist()))
+        return data
+
+    @classmethod
+    def from_catalog(cls, df: pd.DataFrame, rows: np.ndarray) -> List['Bottle']:
+        """
+        Builds bottles for catalog rows from whole columns.
+
+        Each column is extracted with a single tolist() call rather than
+        building an intermediate dict per row; missing values become None.
+
+        Args:
+            df: The catalog
+            rows: Row positions, in output order
+
+        Returns:
+            List of bottles
+        """
+        arrays, flavor_matrix = _catalog_columns(df)
+        columns = {}
+        for name, array in arrays.items():
+            values = array[rows]
+            column = values.tolist()
+            if values.dtype.kind in 'fO':
+                for i in np.flatnonzero(pd.isna(values)):
+                    column[i] = None
+            columns[name] = column
+        flavors = flavor_matrix[rows]
+        names = list(columns)
+        return [cls(**dict(zip(names, values)), flavor_profile=flavors[i])
+                for i, values in enumerate(zip(*columns.values()))]
+
+# Column arrays of the last catalog converted, so repeated conversions skip
+# per-column DataFrame access (which also registers copy-on-write references)
+_column_cache: Tuple[Any, Dict[str, np.ndarray], np.ndarray] = (None, {}, None)
+
+def _catalog_columns(df: pd.DataFrame) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+    """Bottle fields of a catalog as numpy arrays, plus a (rows, FLAVORS) float32 matrix"""
+    global _column_cache
+    ref, arrays, flavors = _column_cache
+    if ref is not None and ref() is df:
+        return arrays, flavors
+    arrays = {f.name: df[f.name].to_numpy() for f in fields(Bottle) if f.name in df.columns}
+    flavors = np.zeros((len(df), len(FLAVORS)), dtype=np.float32)
+    for j, column in enumerate(FLAVOR_COLUMNS):
+        if column in df.columns:
+            flavors[:, j] = df[column].to_numpy()
+    _column_cache = (weakref.ref(df), arrays, flavors)
+    return arrays, flavors
+
+@dataclass(slots=True)
 class UserPreferences:
     """Represents a user's whisky preferences extracted from their collection"""
-    preferred_regions: Dict[str, float] = None
-    flavor_profiles: Dict[str, float] = None
-    price_ranges: Dict[str, float] = None
-    age_statements: Dict[str, float] = None
-    spirit_types: Dict[str, float] = None
-    brand_preferences: Dict[str, float] = None
-    abv_preferences: Dict[str, float] = None
-    average_bottle_price: float = None
-    price_ceiling: float = None
-    collection_size: int = None
+    # Open-ended categories: percentage of the collection per key
+    preferred_regions: Dict[str, float] = field(default_factory=dict)
+    spirit_types: Dict[str, float] = field(default_factory=dict)
+    brand_preferences: Dict[str, float] = field(default_factory=dict)
+    # Average intensity per bottle, in FLAVORS order
+    flavor_profiles: np.ndarray = field(default_factory=lambda: _zeros(len(FLAVORS)))
+    # Percentage of priced bottles per range, in PRICE_RANGES order
+    price_ranges: np.ndarray = field(default_factory=lambda: _zeros(len(PRICE_RANGES)))
+    # Percentage of bottles with a known proof per level, in ABV_LEVELS order
+    abv_preferences: np.ndarray = field(default_factory=lambda: _zeros(len(ABV_LEVELS)))
+    average_bottle_price: float = 0.0
+    price_ceiling: float = 0.0
+    collection_size: int = 0
+
+    def flavor(self, name: str) -> float:
+        return float(self.flavor_profiles[FLAVORS.index(name)])
+
+    def abv_share(self, level: str) -> float:
+        return float(self.abv_preferences[ABV_LEVELS.index(level)])
+
+    def flavor_items(self) -> Iterator[Tuple[str, float]]:
+        """(flavor, average intensity) pairs in FLAVORS order"""
+        return zip(FLAVORS, self.flavor_profiles.tolist())
+
+    def price_range_items(self) -> Iterator[Tuple[str, float]]:
+        return zip(PRICE_RANGES, self.price_ranges.tolist())
+
+    def abv_items(self) -> Iterator[Tuple[str, float]]:
+        return zip(ABV_LEVELS, self.abv_preferences.tolist())
+
+    def flavor_dict(self) -> Dict[str, float]:
+        return dict(self.flavor_items())
+
+    def top_price_range(self) -> Optional[str]:
+        """The price range with the largest share, or None without priced bottles"""
+        if not self.price_ranges.any():
+            return None
+        return PRICE_RANGES[int(self.price_ranges.argmax())]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Nested dictionary layout used by the JSON responses"""
+        return {
+            'preferred_regions': self.preferred_regions,
+            'spirit_types': self.spirit_types,
+            'flavor_profiles': self.flavor_dict(),
+            'price_ranges': dict(self.price_range_items()),
+            'brand_preferences': self.brand_preferences,
+            'abv_preferences': dict(self.abv_items()),
+            'average_bottle_price': self.average_bottle_price,
+            'price_ceiling': self.price_ceiling,
+            'collection_size': self.collection_size,
+        }
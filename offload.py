@@ -0,0 +1,212 @@
+"""
+Optional process pool for the CPU-bound part of recommendation ranking.
+
+Feature encoding, scaling and the kNN search hold the GIL for most of their
+run time, so under load they starve the I/O-bound chat requests served by
+the same worker. With BOB_RANKING_EXECUTOR=process, rankings run in a pool
+of worker processes that loaded the catalog and its derived artifacts when
+they started.
+
+Only compact values cross the process boundary: the analyzed preferences
+and the ids of the bottles the user owns go in, and the catalog version and
+ranked row positions come back. Rows ranked against an older catalog than
+the one the request sees are re-ranked in the request.
+
+Backpressure: at most BOB_RANKING_MAX_PENDING jobs may be queued or running.
+A request that cannot get a slot within BOB_RANKING_QUEUE_WAIT seconds, or
+whose job takes longer than BOB_RANKING_TIMEOUT seconds, raises RankingBusy
+rather than piling up behind the pool. Both waits are also capped by the
+request deadline (see resilience.py); running out of it raises
+DeadlineExceeded instead.
+"""
+import os
+import time
+import logging
+import threading
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Any, Optional, Tuple
+from bottle_dataset import get_catalog_version
+from metrics import counter, histogram
+from resilience import DeadlineExceeded, remaining, stage_timeout
+
+logger = logging.getLogger(__name__)
+
+RANKING_EXECUTORS = ('inline', 'process')
+RANKING_EXECUTOR = os.environ.get('BOB_RANKING_EXECUTOR', 'inline').lower()
+if RANKING_EXECUTOR not in RANKING_EXECUTORS:
+    logger.warning(f"Unknown BOB_RANKING_EXECUTOR '{RANKING_EXECUTOR}', ranking inline")
+    RANKING_EXECUTOR = 'inline'
+
+RANKING_WORKERS = int(os.environ.get('BOB_RANKING_WORKERS', 2))
+RANKING_MAX_PENDING = int(os.environ.get('BOB_RANKING_MAX_PENDING', 4 * RANKING_WORKERS))
+# Seconds a request waits for a free slot, and for its job to finish
+RANKING_QUEUE_WAIT = float(os.environ.get('BOB_RANKING_QUEUE_WAIT', 0.5))
+RANKING_TIMEOUT = float(os.environ.get('BOB_RANKING_TIMEOUT', 5.0))
+
+RANKING_JOBS = counter('bob_ranking_jobs_total', 'Rankings sent to the process pool by outcome',
+                       ('outcome',))
+RANKING_WAIT_SECONDS = histogram('bob_ranking_queue_wait_seconds',
+                                 'Time ranking jobs waited for a process pool slot')
+
+class RankingBusy(Exception):
+    """The ranking pool is saturated or too slow; the request should be retried later"""
+
+    def __init__(self, message: str, retry_after: int = 2):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(max(1, RANKING_MAX_PENDING))
+
+# Seconds start_ranking_pool waits for every worker to load the catalog
+RANKING_START_TIMEOUT = 120.0
+
+def _init_worker(ready) -> None:
+    """
+    Load the catalog and what ranking reads from it before the first job
+    arrives, then wait on the `ready` barrier until every worker has, so the
+    start-up pings can't all be answered by the first worker to finish.
+    """
+    import importlib
+    from threading import BrokenBarrierError
+    # Imported for its side effect: it registers the catalog artifacts ranking uses
+    importlib.import_module('recommendation_engine')
+    from bottle_dataset import get_bottle_dataset
+    from cooccurrence import get_catalog_item_vectors
+    from value_scoring import get_value_scores
+    started = time.perf_counter()
+    get_bottle_dataset()
+    get_value_scores()
+    get_catalog_item_vectors()
+    logger.info(f"Ranking worker {os.getpid()} ready in {time.perf_counter() - started:.2f}s")
+    try:
+        ready.wait(RANKING_START_TIMEOUT)
+    except BrokenBarrierError:
+        logger.warning(f"Ranking worker {os.getpid()} gave up waiting for the other workers to start")
+
+def in_worker_process() -> bool:
+    """
+    Whether this process is a spawned worker, including while spawn re-imports
+    the parent's main module (before parent_process() is set).
+    """
+    return multiprocessing.parent_process() is not None or \
+        bool(getattr(multiprocessing.current_process(), '_inheriting', False))
+
+def _ping(_: int) -> int:
+    return os.getpid()
+
+def _rank_job(preferences, collection_ids: List[Any], num_recommendations: int,
+              value_weight: float, cf_weight: float, knn_mode: str) -> Tuple[str, np.ndarray]:
+    """Runs in a worker: rank and return (catalog version, int32 row positions)"""
+    from recommendation_engine import rank_collection
+    rows = rank_collection(preferences, collection_ids, num_recommendations,
+                           value_weight, cf_weight, knn_mode)
+    return get_catalog_version(), np.asarray(rows, dtype=np.int32)
+
+def start_ranking_pool() -> Optional[ProcessPoolExecutor]:
+    """
+    Starts the worker pool (if process mode is configured) and waits for every
+    worker to load the catalog, so the first requests don't pay for it. Each
+    worker's initializer blocks on a barrier sized to the pool, so none of
+    them takes a job until all of them are ready.
+    """
+    global _pool
+    # Pool workers import the app again under spawn; they must not start pools of their own
+    if RANKING_EXECUTOR != 'process' or in_worker_process():
+        return None
+    with _pool_lock:
+        if _pool is None:
+            started = time.perf_counter()
+            workers = max(1, RANKING_WORKERS)
+            context = multiprocessing.get_context('spawn')
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                        initargs=(context.Barrier(workers),))
+            # One ping per worker makes the pool start them all; each waits in the barrier until all have loaded
+            list(_pool.map(_ping, range(workers)))
+            logger.info(f"Started {workers} ranking workers in {time.perf_counter() - started:.2f}s")
+        return _pool
+
+def shutdown_ranking_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+def _raise_if_past_deadline() -> None:
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded("request deadline passed while ranking")
+
+def rank_in_pool(preferences, collection_ids: List[Any], num_recommendations: int,
+                 value_weight: float, cf_weight: float, knn_mode: str) -> np.ndarray:
+    """
+    Ranks a user's recommendations in the worker pool.
+    
+    Args:
+        preferences: Analyzed user preferences
+        collection_ids: Ids of the bottles the user owns
+        num_recommendations, value_weight, cf_weight, knn_mode: As for rank_recommendations
+        
+    Returns:
+        Array of catalog row positions, best recommendation first
+        
+    Raises:
+        RankingBusy: No slot freed up within RANKING_QUEUE_WAIT, or the job
+            did not finish within RANKING_TIMEOUT
+        DeadlineExceeded: The request deadline passed while waiting
+    """
+    from recommendation_engine import rank_collection
+    
+    waited = time.perf_counter()
+    if not _slots.acquire(timeout=stage_timeout(RANKING_QUEUE_WAIT)):
+        RANKING_JOBS.inc(outcome='rejected')
+        _raise_if_past_deadline()
+        raise RankingBusy(f"All {RANKING_MAX_PENDING} ranking slots are busy")
+    RANKING_WAIT_SECONDS.observe(time.perf_counter() - waited)
+    
+    pool = start_ranking_pool()
+    if pool is None:
+        # Already inside a pool worker (or a child of one): rank here
+        _slots.release()
+        return rank_collection(preferences, collection_ids, num_recommendations,
+                               value_weight, cf_weight, knn_mode)
+    try:
+        future = pool.submit(_rank_job, preferences, list(collection_ids), num_recommendations,
+                             value_weight, cf_weight, knn_mode)
+    except (BrokenProcessPool, RuntimeError) as e:
+        # A crashed worker breaks the whole pool: replace it and rank here this time
+        _slots.release()
+        logger.error(f"Ranking pool unavailable ({str(e)}), restarting it")
+        RANKING_JOBS.inc(outcome='error')
+        shutdown_ranking_pool()
+        return rank_collection(preferences, collection_ids, num_recommendations,
+                               value_weight, cf_weight, knn_mode)
+    # The slot is held until the job actually ends, even if the request gave up on it
+    future.add_done_callback(lambda _: _slots.release())
+    
+    try:
+        version, rows = future.result(timeout=stage_timeout(RANKING_TIMEOUT))
+    except (FutureTimeoutError, DeadlineExceeded):
+        future.cancel()
+        RANKING_JOBS.inc(outcome='timeout')
+        _raise_if_past_deadline()
+        raise RankingBusy(f"Ranking did not finish within {RANKING_TIMEOUT:g}s")
+    except BrokenProcessPool as e:
+        logger.error(f"Ranking worker died ({str(e)}), restarting the pool")
+        RANKING_JOBS.inc(outcome='error')
+        shutdown_ranking_pool()
+        return rank_collection(preferences, collection_ids, num_recommendations,
+                               value_weight, cf_weight, knn_mode)
+    
+    if version != get_catalog_version():
+        # The worker ranked against another catalog file than this process holds
+        RANKING_JOBS.inc(outcome='stale')
+        return rank_collection(preferences, collection_ids, num_recommendations,
+                               value_weight, cf_weight, knn_mode)
+    RANKING_JOBS.inc(outcome='ok')
+    return rows
@@ -0,0 +1,161 @@
+import logging
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Any, Optional, Tuple, Iterable
+from bottle_dataset import register_catalog_artifact, get_catalog_artifact
+from models import UserPreferences
+
+logger = logging.getLogger(__name__)
+
+# Price bands match the ones used for user preferences in analyze_preferences
+PRICE_BANDS = [
+    ('entry', 0, 50),       # $0-50
+    ('mid', 50, 100),       # $51-100
+    ('premium', 100, 200),  # $101-200
+    ('luxury', 200, np.inf) # $201+
+]
+
+# How many bottles to keep per segment; enough to fill a page after removing owned bottles
+TOP_N = 100
+
+# Weight of each catalog signal in the composite popularity score
+SIGNAL_WEIGHTS = {
+    'popularity': 0.25,
+    'bar_count': 0.25,
+    'wishlist_count': 0.2,
+    'total_score': 0.15,
+    'ranking': 0.15,  # Lower ranking is better, so it is inverted below
+}
+
+def price_band(price: float) -> str:
+    """Name of the price band a price falls into"""
+    for name, low, high in PRICE_BANDS:
+        if price <= high:
+            return name
+    return PRICE_BANDS[-1][0]
+
+def price_band_codes(prices: np.ndarray) -> np.ndarray:
+    """Vectorized price_band: index into PRICE_BANDS for each price"""
+    upper_bounds = [high for _, _, high in PRICE_BANDS[:-1]]
+    return np.searchsorted(upper_bounds, prices, side='left')
+
+class PopularityIndex:
+    """
+    Per-segment top-N bottle lists, precomputed once per catalog version.
+
+    Each segment (the whole catalog, a region, a spirit type or a price band)
+    maps to an int32 array of catalog row positions sorted by a composite
+    popularity score, so serving a cold-start user is an array slice.
+    """
+
+    def __init__(self, df: pd.DataFrame, top_n: int = TOP_N):
+        self.top_n = top_n
+        self.scores = self._composite_score(df)
+        order = np.argsort(-self.scores, kind='stable').astype(np.int32)
+        self.ids = df['id'].to_numpy()
+
+        self.segments: Dict[Tuple[str, str], np.ndarray] = {('all', ''): order[:top_n]}
+        for dimension, column in (('region', 'region'), ('spirit_type', 'spirit_type')):
+            if column not in df.columns:
+                continue
+            values = df[column].astype(str).to_numpy()[order]
+            for value in pd.unique(values):
+                self.segments[(dimension, value)] = order[values == value][:top_n]
+
+        bands = price_band_codes(df['msrp'].to_numpy())[order]
+        for code, (name, _, _) in enumerate(PRICE_BANDS):
+            self.segments[('price_band', name)] = order[bands == code][:top_n]
+
+    @staticmethod
+    def _composite_score(df: pd.DataFrame) -> np.ndarray:
+        """Weighted mean of percentile ranks of the available popularity signals"""
+        score = np.zeros(len(df))
+        total_weight = 0.0
+        for column, weight in SIGNAL_WEIGHTS.items():
+            if column not in df.columns:
+                continue
+            values = pd.to_numeric(df[column], errors='coerce')
+            ascending = column != 'ranking'
+            ranks = values.rank(pct=True, ascending=ascending).fillna(0).to_numpy()
+            score += weight * ranks
+            total_weight += weight
+        return score / total_weight if total_weight else score
+
+    def top(self, dimension: str = 'all', value: str = '', limit: int = 10,
+            exclude_ids: Optional[Iterable[Any]] = None) -> np.ndarray:
+        """
+        Returns the most popular catalog row positions in a segment.
+
+        Args:
+            dimension: 'all', 'region', 'spirit_type' or 'price_band'
+            value: Segment value, e.g. 'America' or 'mid' (ignored for 'all')
+            limit: Maximum number of rows to return
+            exclude_ids: Bottle ids to skip, e.g. bottles the user already owns
+
+        Returns:
+            Array of row positions into the catalog DataFrame
+        """
+        rows = self.segments.get((dimension, value if dimension != 'all' else ''))
+        if rows is None:
+            return _EMPTY_ROWS
+        if exclude_ids:
+            rows = rows[~np.isin(self.ids[rows], list(exclude_ids))]
+        return rows[:limit]
+
+_EMPTY_ROWS = np.empty(0, dtype=np.int32)
+
+register_catalog_artifact('popularity_index', PopularityIndex)
+
+def get_popularity_index() -> PopularityIndex:
+    """The popularity index for the currently loaded catalog"""
+    return get_catalog_artifact('popularity_index')
+
+def popular_rows(preferences: Optional[UserPreferences] = None,
+                 exclude_ids: Optional[Iterable[Any]] = None,
+                 limit: int = 5) -> List[int]:
+    """
+    Picks popular catalog rows for a user with little or no collection data.
+
+    Segments are consulted in order of how specific they are to the user:
+    their dominant spirit type, region and price band, then the whole catalog.
+    Users without any preferences get the global top list.
+
+    Args:
+        preferences: Analyzed (possibly empty) user preferences
+        exclude_ids: Bottle ids the user already owns
+        limit: Number of rows wanted
+
+    Returns:
+        List of distinct catalog row positions
+    """
+    index = get_popularity_index()
+    exclude_ids = set(exclude_ids or ())
+    segments: List[Tuple[str, str]] = []
+    if preferences is not None:
+        for dimension, counts in (('spirit_type', preferences.spirit_types),
+                                  ('region', preferences.preferred_regions)):
+            if counts and max(counts.values()) > 0:
+                segments.append((dimension, max(counts, key=counts.get)))
+        price_range = preferences.top_price_range()
+        if price_range:
+            segments.append(('price_band', price_range))
+    segments.append(('all', ''))
+
+    # Spread picks across the user's segments rather than filling from the first one
+    per_segment = max(1, -(-limit // len(segments)))
+    picked: List[int] = []
+    seen = set()
+    for round_limit in (per_segment, limit):
+        for dimension, value in segments:
+            taken = 0
+            for row in index.top(dimension, value, limit + len(seen), exclude_ids).tolist():
+                if row in seen:
+                    continue
+                picked.append(row)
+                seen.add(row)
+                taken += 1
+                if taken >= round_limit or len(picked) >= limit:
+                    break
+            if len(picked) >= limit:
+                return picked
+    return picked
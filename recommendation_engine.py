@@ -1,14 +1,53 @@
 import pandas as pd
 import numpy as np
 import logging
-from typing import Dict, List, Any, Tuple
+from typing import Dict, List, Any, Tuple, Optional, Callable
 from sklearn.neighbors import NearestNeighbors
 from sklearn.preprocessing import MinMaxScaler
+from ann_index import KNN_INDEX_MODE, get_ivf_index
 from bottle_dataset import get_bottle_dataset
+from candidate_index import get_candidate_index
+from cooccurrence import cf_scores
+from features import build_user_vector, encode_bottle_features
+from metrics import timer
+from structured_logging import log_enabled
+from models import ABV_LEVELS, FLAVORS, PRICE_RANGES, Bottle, UserPreferences
+from offload import RANKING_EXECUTOR, rank_in_pool
+from popularity_index import popular_rows
+from similarity_graph import similar_rows
+from value_scoring import DEAL_RATIO, get_value_scores
 
 logger = logging.getLogger(__name__)
 
-def analyze_preferences(user_data: Dict[str, Any]) -> Dict[str, Any]:
+# Collections smaller than this don't say enough for kNN; serve popular bottles instead
+SPARSE_PROFILE_THRESHOLD = 3
+
+# Share of the final ranking given to the catalog value score versus kNN closeness
+VALUE_RANKING_WEIGHT = 0.2
+
+# Share given to the co-ownership (collaborative-filtering) score when item
+# vectors are available; without them ranking is purely content-based
+CF_RANKING_WEIGHT = 0.3
+
+def empty_preferences() -> UserPreferences:
+    """
+    Returns the preference profile of a user with no collection.
+    
+    Returns:
+        UserPreferences with every category present and zeroed
+    """
+    return UserPreferences()
+
+# Flavor intensities implied by a spirit type, as (FLAVORS position, amount)
+_SPIRIT_FLAVORS = {
+    'Bourbon': ((FLAVORS.index('vanilla'), 60), (FLAVORS.index('caramel'), 70), (FLAVORS.index('spicy'), 40)),
+    'Scotch': ((FLAVORS.index('peated'), 40), (FLAVORS.index('smoky'), 30)),
+    'Rye': ((FLAVORS.index('spicy'), 80),),
+    'Gin': ((FLAVORS.index('fruity'), 50),),
+}
+
+@timer('analyze_preferences')
+def analyze_preferences(user_data: Dict[str, Any]) -> UserPreferences:
     """
     Analyzes a user's whisky preferences based on their bar collection.
     
@@ -16,36 +55,9 @@ def analyze_preferences(user_data: Dict[str, Any]) -> Dict[str, Any]:
         user_data: Dictionary containing the user's bar data from BAXUS API
         
     Returns:
-        Dictionary of user preferences including regions, flavor profiles, etc.
-    """
-    preferences = {
-        'preferred_regions': {},
-        'spirit_types': {},
-        'flavor_profiles': {
-            'peated': 0,
-            'sherried': 0,
-            'fruity': 0,
-            'spicy': 0,
-            'smoky': 0,
-            'vanilla': 0,
-            'caramel': 0
-        },
-        'price_ranges': {
-            'entry': 0,  # $0-50
-            'mid': 0,    # $51-100
-            'premium': 0,  # $101-200
-            'luxury': 0   # $201+
-        },
-        'brand_preferences': {},
-        'abv_preferences': {
-            'low': 0,    # <43%
-            'medium': 0, # 43-50%
-            'high': 0    # >50%
-        },
-        'average_bottle_price': 0,
-        'price_ceiling': 0,
-        'collection_size': 0
-    }
+        UserPreferences including regions, flavor profiles, etc.
+    """
+    preferences = empty_preferences()
     
     # Extract collection data
     if 'bar' not in user_data or not user_data['bar']:
@@ -53,34 +65,46 @@ def analyze_preferences(user_data: Dict[str, Any]) -> Dict[str, Any]:
         return preferences
     
     collection = user_data['bar']
-    preferences['collection_size'] = len(collection)
+    preferences.collection_size = len(collection)
     
-    if preferences['collection_size'] == 0:
+    if preferences.collection_size == 0:
         return preferences
     
     # Process each bottle in the collection
     total_price = 0
     price_ceiling = 0
-    
-    logger.debug(f"Processing {len(collection)} bottles from user's collection")
+    spirit_types = preferences.spirit_types
+    regions = preferences.preferred_regions
+    brands = preferences.brand_preferences
+    # Fixed-order counters, in PRICE_RANGES, ABV_LEVELS and FLAVORS order
+    price_counts = [0] * len(PRICE_RANGES)
+    abv_counts = [0] * len(ABV_LEVELS)
+    flavor_totals = [0] * len(FLAVORS)
+    
+    # Checked once: the per-bottle debug records are too costly to build on every request
+    debug = log_enabled(logger)
+    if debug:
+        logger.debug("Processing %d bottles from user's collection", len(collection))
     
     for bottle in collection:
         # Each item in the collection has a 'product' field with bottle details
         product = bottle.get('product')
         if not product:
-            logger.debug("No product information found in bottle entry")
+            if debug:
+                logger.debug("No product information found in bottle entry")
             continue
         
         # Extract relevant information from the product
         product_id = product.get('id')
         if not product_id:
-            logger.debug("No product ID found")
+            if debug:
+                logger.debug("No product ID found")
             continue
         
         # Extract spirit type (e.g., Bourbon, Single Malt, etc.)
         spirit_type = product.get('spirit')
         if spirit_type:
-            preferences['spirit_types'][spirit_type] = preferences['spirit_types'].get(spirit_type, 0) + 1
+            spirit_types[spirit_type] = spirit_types.get(spirit_type, 0) + 1
         
         # Extract region based on spirit type
         region = None
@@ -96,7 +120,7 @@ def analyze_preferences(user_data: Dict[str, Any]) -> Dict[str, Any]:
             region = "Canada"
         
         if region:
-            preferences['preferred_regions'][region] = preferences['preferred_regions'].get(region, 0) + 1
+            regions[region] = regions.get(region, 0) + 1
         
         # Update price range preferences based on average_msrp
         price = product.get('average_msrp', 0)
@@ -105,328 +129,611 @@ def analyze_preferences(user_data: Dict[str, Any]) -> Dict[str, Any]:
             price_ceiling = max(price_ceiling, price)
             
             if price <= 50:
-                preferences['price_ranges']['entry'] += 1
+                price_counts[0] += 1
             elif price <= 100:
-                preferences['price_ranges']['mid'] += 1
+                price_counts[1] += 1
             elif price <= 200:
-                preferences['price_ranges']['premium'] += 1
+                price_counts[2] += 1
             else:
-                preferences['price_ranges']['luxury'] += 1
+                price_counts[3] += 1
         
         # Update brand preferences
         brand = product.get('brand')
         if brand:
-            preferences['brand_preferences'][brand] = preferences['brand_preferences'].get(brand, 0) + 1
+            brands[brand] = brands.get(brand, 0) + 1
         
         # Update ABV preferences based on proof
         proof = product.get('proof', 0)
         if proof:
             abv = proof / 2  # Convert proof to ABV
             if abv < 43:
-                preferences['abv_preferences']['low'] += 1
+                abv_counts[0] += 1
             elif abv <= 50:
-                preferences['abv_preferences']['medium'] += 1
+                abv_counts[1] += 1
             else:
-                preferences['abv_preferences']['high'] += 1
+                abv_counts[2] += 1
                 
         # For flavor profiles, derive from spirit types since real flavor data is not in API
         # This is a simplified approach - in a real implementation we'd use machine learning or a database
-        if spirit_type == "Bourbon":
-            preferences['flavor_profiles']['vanilla'] += 60
-            preferences['flavor_profiles']['caramel'] += 70
-            preferences['flavor_profiles']['spicy'] += 40
-        elif "Scotch" in str(spirit_type):
-            preferences['flavor_profiles']['peated'] += 40
-            preferences['flavor_profiles']['smoky'] += 30
-        elif spirit_type == "Rye":
-            preferences['flavor_profiles']['spicy'] += 80
-        elif spirit_type == "Gin":
-            preferences['flavor_profiles']['fruity'] += 50
+        flavor_key = 'Scotch' if "Scotch" in str(spirit_type) else spirit_type
+        for position, amount in _SPIRIT_FLAVORS.get(flavor_key, ()):
+            flavor_totals[position] += amount
     
     # Calculate average bottle price
-    if preferences['collection_size'] > 0:
-        preferences['average_bottle_price'] = total_price / preferences['collection_size']
+    preferences.average_bottle_price = total_price / preferences.collection_size
     
     # Set price ceiling (with 20% buffer for recommendations)
-    preferences['price_ceiling'] = price_ceiling * 1.2
+    preferences.price_ceiling = price_ceiling * 1.2
     
     # Normalize flavor profiles to an average per bottle
-    for flavor in preferences['flavor_profiles'].keys():
-        preferences['flavor_profiles'][flavor] /= max(preferences['collection_size'], 1)
+    preferences.flavor_profiles = np.array(flavor_totals, dtype=np.float64) / preferences.collection_size
     
     # Convert counts to percentages for categorical preferences
-    for category in ['preferred_regions', 'spirit_types', 'price_ranges', 'brand_preferences', 'abv_preferences']:
-        total = sum(preferences[category].values())
+    for category in (spirit_types, regions, brands):
+        total = sum(category.values())
         if total > 0:
-            for key in preferences[category]:
-                preferences[category][key] = (preferences[category][key] / total) * 100
+            for key in category:
+                category[key] = (category[key] / total) * 100
+    preferences.price_ranges = _percentages(price_counts)
+    preferences.abv_preferences = _percentages(abv_counts)
     
     return preferences
 
-def generate_recommendations(preferences: Dict[str, Any], user_data: Dict[str, Any], 
-                            num_recommendations: int = 5) -> List[Dict[str, Any]]:
+def _percentages(counts: List[int]) -> np.ndarray:
+    """Counts as percentages of their total (all zero when there are none)"""
+    counts = np.array(counts, dtype=np.float64)
+    total = counts.sum()
+    return counts / total * 100 if total > 0 else counts
+
+def generate_recommendations(preferences: UserPreferences, user_data: Dict[str, Any], 
+                            num_recommendations: int = 5,
+                            value_weight: float = VALUE_RANKING_WEIGHT,
+                            cf_weight: float = CF_RANKING_WEIGHT) -> List[Bottle]:
     """
     Generates personalized bottle recommendations based on user preferences.
     
     Args:
-        preferences: Dictionary of analyzed user preferences
+        preferences: Analyzed user preferences
         user_data: Original user data from BAXUS API
         num_recommendations: Number of recommendations to generate
+        value_weight: Weight of the value/deal score when ordering the kNN
+            shortlist (0 ranks purely by similarity)
+        cf_weight: Weight of the co-ownership score from other users' bars
         
     Returns:
-        List of recommended bottles with detailed information
+        List of recommended bottles, each with an explanation
     """
-    # Get the bottle dataset
-    bottle_df = get_bottle_dataset()
+    # Sparse profiles are served from the precomputed popularity index, no kNN needed
+    if is_sparse_profile(preferences):
+        return generate_popular_recommendations(preferences, user_data, num_recommendations)
+    
+    rows = rank_recommendations(preferences, user_data, num_recommendations, value_weight, cf_weight)
+    recommendations = Bottle.from_catalog(get_bottle_dataset(), rows)
+    for bottle in recommendations:
+        # Generate explanation for this recommendation
+        bottle.explanation = generate_recommendation_explanation(bottle, preferences, user_data)
     
+    return recommendations
+
+def owned_bottle_ids(user_data: Optional[Dict[str, Any]]) -> List[Any]:
+    """Ids of the bottles in a user's bar"""
+    if not user_data or not user_data.get('bar'):
+        return []
+    return [bottle.get('release_id') for bottle in user_data['bar'] if bottle.get('release_id')]
+
+def rank_recommendations(preferences: UserPreferences, user_data: Dict[str, Any],
+                         num_recommendations: int = 5,
+                         value_weight: float = VALUE_RANKING_WEIGHT,
+                         cf_weight: float = CF_RANKING_WEIGHT,
+                         knn_mode: str = KNN_INDEX_MODE) -> np.ndarray:
+    """
+    Ranks catalog bottles for a user without materializing them.
+    
+    With BOB_RANKING_EXECUTOR=process the kNN ranking runs in the worker pool
+    (see offload.py); only the preferences and owned ids are sent to it.
+    
+    Args:
+        preferences: Analyzed user preferences
+        user_data: Original user data from BAXUS API
+        num_recommendations: Number of bottles to rank
+        value_weight: Weight of the value/deal score when ordering the kNN shortlist
+        cf_weight: Weight of the co-ownership score from other users' bars
+        knn_mode: 'exact' to fit kNN over the filtered candidates, 'ivf' to
+            search the approximate index (defaults to BOB_KNN_INDEX)
+        
+    Returns:
+        Array of catalog row positions, best recommendation first
+    """
     # Extract user's collection IDs to avoid recommending bottles they already have
-    collection_ids = []
-    if 'bar' in user_data and user_data['bar']:
-        collection_ids = [bottle.get('release_id') for bottle in user_data['bar'] if bottle.get('release_id')]
+    collection_ids = owned_bottle_ids(user_data)
     
-    logger.debug(f"Found {len(collection_ids)} bottles in user collection: {collection_ids[:5]}...")
+    if log_enabled(logger):
+        logger.debug("Found %d bottles in user collection: %s...", len(collection_ids), collection_ids[:5])
     
-    # Remove bottles already in the user's collection
-    candidate_bottles = bottle_df[~bottle_df['id'].isin(collection_ids)].copy()
+    if is_sparse_profile(preferences):
+        return np.asarray(popular_rows(preferences, collection_ids, num_recommendations), dtype=np.int32)
     
-    if candidate_bottles.empty:
-        logger.warning("No candidate bottles available for recommendation")
-        return []
+    if RANKING_EXECUTOR == 'process':
+        return rank_in_pool(preferences, collection_ids, num_recommendations,
+                            value_weight, cf_weight, knn_mode)
+    return rank_collection(preferences, collection_ids, num_recommendations,
+                           value_weight, cf_weight, knn_mode)
+
+def rank_collection(preferences: UserPreferences, collection_ids: List[Any],
+                    num_recommendations: int = 5,
+                    value_weight: float = VALUE_RANKING_WEIGHT,
+                    cf_weight: float = CF_RANKING_WEIGHT,
+                    knn_mode: str = KNN_INDEX_MODE) -> np.ndarray:
+    """
+    The kNN ranking behind rank_recommendations, in this process.
+    
+    Args:
+        preferences: Analyzed user preferences (not a sparse profile)
+        collection_ids: Ids of the bottles the user already owns
+        num_recommendations: Number of bottles to rank
+        value_weight, cf_weight, knn_mode: As for rank_recommendations
+        
+    Returns:
+        Array of catalog row positions, best recommendation first
+    """
+    return score_collection(preferences, collection_ids, num_recommendations,
+                            value_weight, cf_weight, knn_mode)[0]
+
+def score_collection(preferences: UserPreferences, collection_ids: List[Any],
+                     num_recommendations: int = 5,
+                     value_weight: float = VALUE_RANKING_WEIGHT,
+                     cf_weight: float = CF_RANKING_WEIGHT,
+                     knn_mode: str = KNN_INDEX_MODE) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    rank_collection, also returning the score each bottle was ranked by: the
+    blended closeness/value/co-ownership score, or plain closeness to the
+    user (1 for the nearest shortlisted bottle, 0 for the furthest) when the
+    shortlist isn't reranked.
+    
+    Returns:
+        Tuple of (catalog row positions, float32 scores), best recommendation first
+    """
+    # Get the bottle dataset
+    bottle_df = get_bottle_dataset()
     
     # Price filter: Don't recommend bottles much more expensive than user's price ceiling
-    price_ceiling = preferences.get('price_ceiling', float('inf'))
-    price_floor = max(0, preferences.get('average_bottle_price', 0) * 0.5)
-    candidate_bottles = candidate_bottles[(candidate_bottles['msrp'] <= price_ceiling) & 
-                                         (candidate_bottles['msrp'] >= price_floor)]
+    price_ceiling = preferences.price_ceiling
+    price_floor = max(0, preferences.average_bottle_price * 0.5)
+    
+    if knn_mode == 'ivf':
+        # Approximate search over the prebuilt index; the filters are applied
+        # to the scanned cells, and candidate positions are catalog rows
+        index = get_ivf_index()
+        query = index.query_vector(preferences)
+        # Every listing of an owned bottle, whatever the id type (see CandidateIndex.rows_of_ids)
+        owned_rows = get_candidate_index().rows_of_ids(collection_ids)
+        with timer('knn'):
+            candidate_indices, candidate_distances = index.search(
+                query, num_recommendations * 3, price_range=(price_floor, price_ceiling),
+                exclude_rows=owned_rows)
+        if not len(candidate_indices):
+            logger.warning("No candidate bottles available for recommendation")
+            return _NO_ROWS, _NO_SCORES
+        catalog_rows = np.arange(len(bottle_df))
+        
+        def distances_to_user(rows):
+            return index.distances(query, rows)
+        
+        def eligible(rows):
+            msrp = bottle_df['msrp'].to_numpy()[rows]
+            return (msrp >= price_floor) & (msrp <= price_ceiling) & ~np.isin(rows, owned_rows)
+    else:
+        # Bottles in the price range that the user doesn't already own: a slice of
+        # the MSRP-sorted catalog minus a bitset of owned rows
+        with timer('candidate_selection'):
+            candidate_rows = get_candidate_index().candidates(price_floor, price_ceiling, collection_ids)
+        
+        if not len(candidate_rows):
+            logger.warning("No unowned bottles in appropriate price range")
+            return _NO_ROWS, _NO_SCORES
+        candidate_bottles = bottle_df.iloc[candidate_rows]
+        
+        # Encode candidates and the user's preferences into the same scaled feature space
+        X_scaled, user_vector_scaled = _encode_features(candidate_bottles, preferences)
+        
+        # Use k-nearest neighbors to find similar bottles
+        with timer('knn'):
+            knn = NearestNeighbors(n_neighbors=min(num_recommendations * 3, len(X_scaled)), 
+                                  algorithm='auto', metric='euclidean')
+            knn.fit(X_scaled)
+            
+            distances, indices = knn.kneighbors(user_vector_scaled)
+        
+        # Get candidate recommendation indices (positions into candidate_rows)
+        candidate_indices = indices[0]
+        candidate_distances = distances[0]
+        catalog_rows = candidate_rows
+        eligible = None
+        
+        def distances_to_user(positions):
+            return np.linalg.norm(X_scaled[positions] - user_vector_scaled[0], axis=1)
+    
+    # Bottles that other collectors keep next to this user's bottles join the
+    # shortlist even when their content features are further away
+    cf = cf_scores(collection_ids, catalog_rows) if cf_weight > 0 else None
+    if cf is not None:
+        if eligible is not None:
+            cf = np.where(eligible(catalog_rows), cf, 0)
+        candidate_indices, candidate_distances = _add_cf_candidates(
+            candidate_indices, candidate_distances, cf, distances_to_user, num_recommendations * 3)
+        cf = cf[candidate_indices]
+    else:
+        cf_weight = 0
     
-    if candidate_bottles.empty:
-        logger.warning("No bottles in appropriate price range")
-        return []
+    # Among similar bottles, move the better deals (and co-owned bottles) up
+    if (value_weight > 0 or cf_weight > 0) and len(candidate_indices) > 1:
+        candidate_indices, scores = _rerank_shortlist(candidate_indices, candidate_distances, catalog_rows,
+                                                      value_weight, cf, cf_weight)
+    else:
+        scores = _closeness(candidate_distances)
     
-    # Prepare feature matrix for recommendation
-    feature_columns = [
-        'abv', 'msrp',
-        'flavor_profile_peated', 'flavor_profile_sherried', 
-        'flavor_profile_fruity', 'flavor_profile_spicy',
-        'flavor_profile_smoky', 'flavor_profile_vanilla', 'flavor_profile_caramel'
-    ]
+    picked = _diversify(bottle_df, catalog_rows[candidate_indices], num_recommendations)
+    return catalog_rows[candidate_indices[picked]], scores[picked].astype(np.float32)
+
+_NO_ROWS = np.empty(0, dtype=np.int32)
+_NO_SCORES = np.empty(0, dtype=np.float32)
+
+def _diversify(bottle_df: pd.DataFrame, shortlist: np.ndarray, num_recommendations: int,
+               max_per_group: int = 2) -> np.ndarray:
+    """
+    Picks the final recommendations from a ranked shortlist, allowing at most
+    max_per_group bottles of the same region or spirit type, then topping up in
+    shortlist order if that leaves too few.
     
-    # One-hot encode categorical features
-    candidate_bottles_encoded = pd.get_dummies(
-        candidate_bottles, 
-        columns=['spirit_type', 'region'],
-        prefix=['spirit', 'region']
-    )
+    Args:
+        bottle_df: The catalog
+        shortlist: Ranked catalog row positions
+        num_recommendations: Number of rows wanted
+        max_per_group: Cap per region and per spirit type in the first pass
+        
+    Returns:
+        Positions into shortlist of the picked rows, in pick order
+    """
+    regions = bottle_df['region'].to_numpy()[shortlist].tolist()
+    spirit_types = bottle_df['spirit_type'].to_numpy()[shortlist].tolist()
+    region_counts: Dict[Any, int] = {}
+    spirit_counts: Dict[Any, int] = {}
+    
+    picked: List[int] = []
+    for i, (region, spirit_type) in enumerate(zip(regions, spirit_types)):
+        # Skip if we already have enough bottles of this region or spirit type
+        if region_counts.get(region, 0) >= max_per_group or spirit_counts.get(spirit_type, 0) >= max_per_group:
+            continue
+        region_counts[region] = region_counts.get(region, 0) + 1
+        spirit_counts[spirit_type] = spirit_counts.get(spirit_type, 0) + 1
+        picked.append(i)
+        if len(picked) >= num_recommendations:
+            break
     
-    # Add the one-hot encoded columns to our feature list
-    encoded_features = [col for col in candidate_bottles_encoded.columns 
-                       if col.startswith('spirit_') or col.startswith('region_')]
-    feature_columns.extend(encoded_features)
+    # If we don't have enough recommendations, add more
+    if len(picked) < num_recommendations:
+        chosen = set(picked)
+        for i in range(len(shortlist)):
+            if i not in chosen:
+                picked.append(i)
+                if len(picked) >= num_recommendations:
+                    break
+    
+    return np.asarray(picked, dtype=np.intp)
+
+def _add_cf_candidates(indices: np.ndarray, distances: np.ndarray, cf: np.ndarray,
+                       distances_to_user: Callable[[np.ndarray], np.ndarray],
+                       count: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Extends a kNN shortlist with the candidates scoring highest on co-ownership.
     
-    # Ensure all feature columns exist in the dataframe
-    feature_columns = [col for col in feature_columns if col in candidate_bottles_encoded.columns]
+    Args:
+        indices: Shortlist positions into the candidate DataFrame
+        distances: kNN distances matching indices
+        cf: Co-ownership score of every candidate (0 for ineligible ones)
+        distances_to_user: Distance of candidate positions to the user vector
+        count: Number of co-owned candidates to consider
+        
+    Returns:
+        Tuple of (extended positions, matching distances to the user vector)
+    """
+    count = min(count, len(cf))
+    top = np.argpartition(-cf, count - 1)[:count]
+    top = top[(cf[top] > 0) & ~np.isin(top, indices)]
+    if not len(top):
+        return indices, distances
+    extra_distances = distances_to_user(top)
+    return np.concatenate([indices, top]), np.concatenate([distances, extra_distances])
+
+def _rerank_shortlist(indices: np.ndarray, distances: np.ndarray, catalog_rows: np.ndarray,
+                      value_weight: float, cf: Optional[np.ndarray] = None,
+                      cf_weight: float = 0.0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reorders a kNN shortlist by blending closeness with the catalog value score
+    and, when available, the co-ownership score.
     
-    # Create feature matrix
-    X = candidate_bottles_encoded[feature_columns].values
+    Args:
+        indices: Shortlist positions into the candidate DataFrame
+        distances: kNN distances matching indices
+        catalog_rows: Catalog row position of each candidate (its index labels)
+        value_weight: Share of the blended score given to value
+        cf: Co-ownership score matching indices, or None
+        cf_weight: Share of the blended score given to co-ownership
+        
+    Returns:
+        Tuple of (shortlist positions, their blended scores), best blended score first
+    """
+    value = np.nan_to_num(get_value_scores().value_score[catalog_rows[indices]])
+    blended = (1 - value_weight - cf_weight) * _closeness(distances) + value_weight * value
+    if cf is not None and cf_weight > 0:
+        blended += cf_weight * cf
+    order = np.argsort(-blended, kind='stable')
+    return indices[order], blended[order]
+
+def _closeness(distances: np.ndarray) -> np.ndarray:
+    """kNN distances rescaled to 1 for the nearest and 0 for the furthest"""
+    spread = distances.max() - distances.min()
+    if spread > 0:
+        return 1 - (distances - distances.min()) / spread
+    return np.ones_like(distances)
+
+@timer('feature_encoding')
+def _encode_features(candidate_bottles: pd.DataFrame,
+                     preferences: UserPreferences) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Builds the scaled feature matrix for the candidate bottles and the matching
+    scaled user preference vector.
+    
+    Args:
+        candidate_bottles: Bottles that passed the ownership and price filters
+        preferences: Analyzed user preferences
+        
+    Returns:
+        Tuple of (scaled candidate features, scaled user vector of shape (1, n_features))
+    """
+    X, feature_columns = encode_bottle_features(candidate_bottles)
     
     # Normalize features
     scaler = MinMaxScaler()
     X_scaled = scaler.fit_transform(X)
     
-    # Create a user preference vector based on their collection
-    user_vector = np.zeros(len(feature_columns))
-    
-    # Set numeric preferences
-    for i, col in enumerate(feature_columns):
-        if col == 'abv':
-            # Calculate weighted average ABV preference
-            abv_pref = preferences['abv_preferences']
-            user_vector[i] = (
-                (abv_pref.get('low', 0) * 40) + 
-                (abv_pref.get('medium', 0) * 46) + 
-                (abv_pref.get('high', 0) * 55)
-            ) / 100
-        elif col == 'msrp':
-            user_vector[i] = preferences.get('average_bottle_price', 0)
-        elif col.startswith('flavor_profile_'):
-            flavor = col.replace('flavor_profile_', '')
-            user_vector[i] = preferences['flavor_profiles'].get(flavor, 0)
-        elif col.startswith('spirit_'):
-            spirit = col.replace('spirit_', '')
-            user_vector[i] = preferences['spirit_types'].get(spirit, 0) / 100
-        elif col.startswith('region_'):
-            region = col.replace('region_', '')
-            user_vector[i] = preferences['preferred_regions'].get(region, 0) / 100
+    user_vector = build_user_vector(feature_columns, preferences)
     
     # Scale user vector
     user_vector_scaled = scaler.transform(user_vector.reshape(1, -1))
     
-    # Use k-nearest neighbors to find similar bottles
-    knn = NearestNeighbors(n_neighbors=min(num_recommendations * 3, len(X_scaled)), 
-                          algorithm='auto', metric='euclidean')
-    knn.fit(X_scaled)
-    
-    distances, indices = knn.kneighbors(user_vector_scaled)
+    return X_scaled, user_vector_scaled
+
+@timer('popular_recommendations')
+def generate_popular_recommendations(preferences: Optional[UserPreferences],
+                                     user_data: Optional[Dict[str, Any]],
+                                     num_recommendations: int = 5) -> List[Bottle]:
+    """
+    Recommends popular bottles for cold-start and sparse-profile users.
     
-    # Get candidate recommendation indices
-    candidate_indices = indices[0]
+    Args:
+        preferences: Analyzed user preferences, or None if the user has no bar
+        user_data: Original user data from BAXUS API, or None
+        num_recommendations: Number of recommendations to generate
+        
+    Returns:
+        List of recommended bottles, each with an explanation
+    """
+    bottle_df = get_bottle_dataset()
+    user_data = user_data or {}
+    collection_ids = owned_bottle_ids(user_data)
     
-    # Prepare final recommendations with diversity
-    recommendations = []
-    recommended_regions = set()
-    recommended_spirit_types = set()
+    rows = popular_rows(preferences, collection_ids, num_recommendations)
+    recommendations = Bottle.from_catalog(bottle_df, rows)
+    for bottle in recommendations:
+        bottle.explanation = explain_popular_bottle(bottle, preferences, user_data)
+    return recommendations
+
+def is_sparse_profile(preferences: Optional[UserPreferences]) -> bool:
+    """Whether a profile is too thin for kNN and gets popularity-ranked bottles"""
+    return preferences is None or preferences.collection_size < SPARSE_PROFILE_THRESHOLD
+
+def explain_popular_bottle(bottle: Bottle, preferences: Optional[UserPreferences],
+                           user_data: Optional[Dict[str, Any]]) -> str:
+    """
+    Explains a bottle picked from the popularity index.
     
-    for idx in candidate_indices:
-        bottle = candidate_bottles.iloc[idx].to_dict()
-        
-        # Ensure diversity by avoiding too many of the same region or spirit type
-        region = bottle.get('region')
-        spirit_type = bottle.get('spirit_type')
-        
-        # Skip if we already have two bottles of this region or spirit type
-        if (region in recommended_regions and len([r for r in recommendations if r.get('region') == region]) >= 2) or \
-           (spirit_type in recommended_spirit_types and len([r for r in recommendations if r.get('spirit_type') == spirit_type]) >= 2):
-            continue
-        
-        # Add region and spirit type to tracking sets
-        recommended_regions.add(region)
-        recommended_spirit_types.add(spirit_type)
-        
-        # Generate explanation for this recommendation
-        explanation = generate_recommendation_explanation(bottle, preferences, user_data)
-        bottle['explanation'] = explanation
-        
-        recommendations.append(bottle)
+    Args:
+        bottle: The recommended bottle
+        preferences: User preferences, or None for a user without a bar
+        user_data: Original user data from BAXUS API, or None
         
-        # Stop once we have enough recommendations
-        if len(recommendations) >= num_recommendations:
-            break
-    
-    # If we don't have enough recommendations, add more
-    if len(recommendations) < num_recommendations:
-        for idx in candidate_indices:
-            bottle = candidate_bottles.iloc[idx].to_dict()
-            if any(r.get('id') == bottle.get('id') for r in recommendations):
-                continue
-            
-            explanation = generate_recommendation_explanation(bottle, preferences, user_data)
-            bottle['explanation'] = explanation
-            
-            recommendations.append(bottle)
-            
-            if len(recommendations) >= num_recommendations:
-                break
+    Returns:
+        String containing the explanation
+    """
+    explanation = f"A BAXUS favorite, found in {int(bottle.bar_count or 0):,} bars."
+    if preferences is not None and preferences.collection_size:
+        explanation += " " + generate_recommendation_explanation(bottle, preferences, user_data or {})
+    return explanation
+
+def get_similar_bottles(bottle_id: Any, k: int = 5) -> List[Dict[str, Any]]:
+    """
+    Retrieves the bottles most similar to a given bottle from the similarity graph.
     
-    return recommendations
+    Args:
+        bottle_id: Id of the bottle
+        k: Maximum number of similar bottles
+        
+    Returns:
+        List of dictionaries with id, name, spirit_type, region, msrp and similarity
+    """
+    rows, scores = similar_rows(bottle_id, k)
+    if len(rows) == 0:
+        return []
+    bottles = get_bottle_dataset().iloc[rows][['id', 'name', 'spirit_type', 'region', 'msrp']]
+    bottles = bottles.astype(object).where(bottles.notna(), None).to_dict('records')
+    for bottle, score in zip(bottles, scores.tolist()):
+        bottle['similarity'] = round(score, 3)
+    return bottles
 
-def generate_recommendation_explanation(bottle: Dict[str, Any], 
-                                       preferences: Dict[str, Any],
+# Sentences of a recommendation explanation, in the order they appear. Snapshots
+# (snapshot_store.py) store the ids of the sentences an explanation is made of
+# and render them at serve time with the same arguments as a live request.
+EXPLANATION_TEMPLATES = (
+    "This {region} whisky aligns with your preference for bottles from this region.",
+    "Like your {similar_bottle}, this is also from {region}.",
+    "This would add diversity to your collection with a {region} whisky.",
+    "This {spirit_type} matches your preferred style.",
+    "This {spirit_type} would add variety to your collection.",
+    "The {flavors} notes in this whisky match your flavor preferences.",
+    "This whisky's {flavor} character would complement your collection.",
+    "At ${price:.2f}, this is a good value compared to your collection average.",
+    "This is priced similarly to most bottles in your collection.",
+    "This premium offering is slightly above your usual price range but worth considering.",
+    "At ${price:.2f}, this is a bottle worth considering for your collection.",
+    "Its MSRP is well below its ${fair_price:.2f} fair market price.",
+    "This highly-rated whisky is widely regarded as exceptional.",
+    "This well-rated whisky offers excellent quality.",
+    "This solid whisky has positive ratings overall.",
+    "This bottle would make a nice addition to your whisky collection.",
+)
+_DEFAULT_EXPLANATION = len(EXPLANATION_TEMPLATES) - 1
+
+@timer('explanation')
+def generate_recommendation_explanation(bottle: Bottle, 
+                                       preferences: UserPreferences,
                                        user_data: Dict[str, Any]) -> str:
     """
     Generates a personalized explanation for why a bottle is recommended.
     
     Args:
-        bottle: Dictionary containing bottle information from our dataset
-        preferences: Dictionary of user preferences
+        bottle: The recommended bottle
+        preferences: Analyzed user preferences
         user_data: Original user data from BAXUS API
         
     Returns:
         String containing personalized explanation
     """
-    explanation_parts = []
+    template_ids = explanation_template_ids(bottle, preferences, user_data)
+    return render_explanation(template_ids, bottle, preferences, user_data)
+
+def explanation_template_ids(bottle: Bottle, preferences: UserPreferences,
+                             user_data: Dict[str, Any]) -> List[int]:
+    """
+    Picks the EXPLANATION_TEMPLATES sentences explaining a recommended bottle.
+    
+    Args:
+        bottle: The recommended bottle
+        preferences: Analyzed user preferences
+        user_data: Original user data from BAXUS API
+        
+    Returns:
+        Ascending template ids
+    """
+    template_ids = []
     
     # Region-based explanation
-    region = bottle.get('region')
-    region_pref = preferences.get('preferred_regions', {})
+    region = bottle.region
+    region_pref = preferences.preferred_regions
     if region and region in region_pref and region_pref[region] > 20:
-        explanation_parts.append(f"This {region} whisky aligns with your preference for bottles from this region.")
+        template_ids.append(0)
     elif region:
-        # Find example bottle from user's collection with same region
-        similar_region_bottle = None
-        for user_bottle in user_data.get('bar', []):
-            product = user_bottle.get('product')
-            if product:
-                # Determine region of user's bottle based on spirit type
-                user_region = None
-                spirit = product.get('spirit')
-                if spirit:
-                    if "Scotch" in str(spirit):
-                        user_region = "Scotland"
-                    elif spirit == "Bourbon" or spirit == "Rye":
-                        user_region = "America"
-                    elif spirit == "Japanese Whisky":
-                        user_region = "Japan"
-                    elif spirit == "Irish Whiskey":
-                        user_region = "Ireland"
-                    elif spirit == "Canadian Whisky":
-                        user_region = "Canada"
-                    
-                    if user_region == region:
-                        similar_region_bottle = product.get('name')
-                        break
-        
-        if similar_region_bottle:
-            explanation_parts.append(f"Like your {similar_region_bottle}, this is also from {region}.")
+        if _similar_region_bottle(region, user_data):
+            template_ids.append(1)
         elif region not in region_pref or region_pref[region] < 10:
-            explanation_parts.append(f"This would add diversity to your collection with a {region} whisky.")
+            template_ids.append(2)
     
     # Spirit type explanation
-    spirit_type = bottle.get('spirit_type')
-    spirit_pref = preferences.get('spirit_types', {})
+    spirit_type = bottle.spirit_type
+    spirit_pref = preferences.spirit_types
     if spirit_type and spirit_type in spirit_pref and spirit_pref[spirit_type] > 20:
-        explanation_parts.append(f"This {spirit_type} matches your preferred style.")
+        template_ids.append(3)
     elif spirit_type and (spirit_type not in spirit_pref or spirit_pref[spirit_type] < 10):
-        explanation_parts.append(f"This {spirit_type} would add variety to your collection.")
+        template_ids.append(4)
     
     # Flavor profile explanation
-    flavor_prefs = preferences.get('flavor_profiles', {})
-    bottle_flavors = {}
-    for key, value in bottle.items():
-        if key.startswith('flavor_profile_'):
-            flavor = key.replace('flavor_profile_', '')
-            bottle_flavors[flavor] = value
-    
-    # Find dominant flavors in the bottle and user preferences
-    dominant_bottle_flavors = sorted(bottle_flavors.items(), key=lambda x: x[1], reverse=True)[:2]
-    dominant_user_flavors = sorted(flavor_prefs.items(), key=lambda x: x[1], reverse=True)[:2]
-    
-    flavor_matches = [flavor for flavor, _ in dominant_bottle_flavors 
-                     if flavor in dict(dominant_user_flavors)]
-    
+    dominant_bottle_flavors, flavor_matches = _flavor_matches(bottle, preferences)
     if flavor_matches:
-        flavor_text = ", ".join(flavor_matches)
-        explanation_parts.append(f"The {flavor_text} notes in this whisky match your flavor preferences.")
-    else:
-        complementary_flavor = dominant_bottle_flavors[0][0] if dominant_bottle_flavors else None
-        if complementary_flavor:
-            explanation_parts.append(f"This whisky's {complementary_flavor} character would complement your collection.")
+        template_ids.append(5)
+    elif dominant_bottle_flavors:
+        template_ids.append(6)
     
     # Price explanation
-    price = bottle.get('msrp', 0)
-    avg_price = preferences.get('average_bottle_price', 0)
+    price = bottle.msrp or 0
+    avg_price = preferences.average_bottle_price
     if avg_price > 0:
         if price <= avg_price * 0.8:
-            explanation_parts.append(f"At ${price:.2f}, this is a good value compared to your collection average.")
+            template_ids.append(7)
         elif price <= avg_price * 1.2:
-            explanation_parts.append(f"This is priced similarly to most bottles in your collection.")
+            template_ids.append(8)
         else:
-            explanation_parts.append(f"This premium offering is slightly above your usual price range but worth considering.")
+            template_ids.append(9)
     else:
-        explanation_parts.append(f"At ${price:.2f}, this is a bottle worth considering for your collection.")
+        template_ids.append(10)
+    
+    fair_price = bottle.fair_price
+    if price and fair_price and price <= fair_price * DEAL_RATIO:
+        template_ids.append(11)
     
     # Rating/score explanation
-    score = bottle.get('total_score', 0)
+    score = bottle.total_score or 0
     if score > 90:
-        explanation_parts.append("This highly-rated whisky is widely regarded as exceptional.")
+        template_ids.append(12)
     elif score > 85:
-        explanation_parts.append("This well-rated whisky offers excellent quality.")
+        template_ids.append(13)
     elif score > 80:
-        explanation_parts.append("This solid whisky has positive ratings overall.")
+        template_ids.append(14)
     
-    # Combine all explanations
-    explanation = " ".join(explanation_parts)
+    return template_ids or [_DEFAULT_EXPLANATION]
+
+def render_explanation(template_ids: List[int], bottle: Bottle, preferences: UserPreferences,
+                       user_data: Dict[str, Any]) -> str:
+    """
+    Renders explanation sentences for a bottle from their template ids.
     
-    if not explanation:
-        explanation = "This bottle would make a nice addition to your whisky collection."
+    Args:
+        template_ids: Ids from explanation_template_ids
+        bottle: The recommended bottle
+        preferences: Analyzed user preferences
+        user_data: Original user data from BAXUS API
+        
+    Returns:
+        String containing the explanation
+    """
+    arguments = {'region': bottle.region, 'spirit_type': bottle.spirit_type,
+                 'price': bottle.msrp or 0, 'fair_price': bottle.fair_price}
+    if 1 in template_ids:
+        arguments['similar_bottle'] = _similar_region_bottle(bottle.region, user_data)
+    if 5 in template_ids or 6 in template_ids:
+        dominant_bottle_flavors, flavor_matches = _flavor_matches(bottle, preferences)
+        arguments['flavors'] = ", ".join(flavor_matches)
+        arguments['flavor'] = dominant_bottle_flavors[0][0] if dominant_bottle_flavors else None
+    return " ".join(EXPLANATION_TEMPLATES[i].format(**arguments) for i in template_ids)
+
+def _similar_region_bottle(region: str, user_data: Dict[str, Any]) -> Optional[str]:
+    """Name of the first bottle in the user's bar from the same region, if any"""
+    for user_bottle in user_data.get('bar', []):
+        product = user_bottle.get('product')
+        if product:
+            # Determine region of user's bottle based on spirit type
+            user_region = None
+            spirit = product.get('spirit')
+            if spirit:
+                if "Scotch" in str(spirit):
+                    user_region = "Scotland"
+                elif spirit == "Bourbon" or spirit == "Rye":
+                    user_region = "America"
+                elif spirit == "Japanese Whisky":
+                    user_region = "Japan"
+                elif spirit == "Irish Whiskey":
+                    user_region = "Ireland"
+                elif spirit == "Canadian Whisky":
+                    user_region = "Canada"
+                
+                if user_region == region:
+                    return product.get('name')
+    return None
+
+def _flavor_matches(bottle: Bottle, preferences: UserPreferences) -> Tuple[List[Tuple[str, float]], List[str]]:
+    """(bottle's two dominant flavors, those also among the user's two dominant flavors)"""
+    dominant_bottle_flavors = sorted(bottle.flavor_items(), key=lambda x: x[1], reverse=True)[:2]
+    dominant_user_flavors = sorted(preferences.flavor_items(), key=lambda x: x[1], reverse=True)[:2]
     
-    return explanation
+    flavor_matches = [flavor for flavor, _ in dominant_bottle_flavors 
+                     if flavor in dict(dominant_user_flavors)]
+    return dominant_bottle_flavors, flavor_matches
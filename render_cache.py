@@ -0,0 +1,118 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Hashable, Optional, Tuple
+from jinja2 import nodes
+from jinja2.ext import Extension
+from metrics import counter
+
+RENDER_CACHE = counter('bob_render_cache_lookups_total', 'Rendered page cache lookups by result',
+                       ('variant', 'result'))
+
+@dataclass(frozen=True)
+class CachedPage:
+    """A rendered response body together with its validators"""
+    body: str
+    mimetype: str
+    etag: str
+    last_modified: float
+
+class RenderCache:
+    """
+    Bounded LRU cache of rendered pages keyed on everything the page depends on.
+    
+    For the recommendations page that is (username, bar content hash, catalog
+    version): if none of them changed, the page can't have changed, so the
+    cached body is served and its ETag stays valid for conditional GETs.
+    """
+    
+    def __init__(self, max_entries: int = 2048):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[Tuple[Hashable, str], CachedPage]' = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def etag_for(key: Hashable, variant: str) -> str:
+        """Stable validator derived from the cache key and the response variant"""
+        return hashlib.sha1(repr((key, variant)).encode()).hexdigest()[:20]
+    
+    def peek(self, key: Hashable, variant: str) -> Optional[CachedPage]:
+        """Return a cached page without rendering on a miss"""
+        with self._lock:
+            page = self._entries.get((key, variant))
+            if page is not None:
+                self._entries.move_to_end((key, variant))
+            return page
+    
+    def get_or_render(self, key: Hashable, variant: str, mimetype: str,
+                      render: Callable[[], str]) -> CachedPage:
+        """
+        Return the cached page for a key, rendering and storing it on a miss.
+        
+        Args:
+            key: Everything the page content depends on
+            variant: Response representation, e.g. 'html' or 'json'
+            mimetype: Content type of the rendered body
+            render: Produces the response body on a miss
+            
+        Returns:
+            The cached page
+        """
+        page = self.peek(key, variant)
+        if page is not None:
+            RENDER_CACHE.inc(variant=variant, result='hit')
+            return page
+        RENDER_CACHE.inc(variant=variant, result='miss')
+        
+        page = CachedPage(body=render(), mimetype=mimetype,
+                          etag=self.etag_for(key, variant), last_modified=time.time())
+        with self._lock:
+            self._entries[(key, variant)] = page
+            self._entries.move_to_end((key, variant))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return page
+    
+    def discard(self, key: Hashable, variant: str) -> None:
+        """Drop one cached page, e.g. one rendered from degraded results"""
+        with self._lock:
+            self._entries.pop((key, variant), None)
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+class FragmentCacheExtension(Extension):
+    """
+    Jinja ``{% cache %}`` tag: renders a template fragment once per key.
+
+        {% cache 'page_head', asset_version %} ... {% endcache %}
+
+    The key is the tag's arguments, so a fragment that depends on anything
+    (the username, the asset build) must list it. Fragments are kept in a
+    RenderCache on the environment (``environment.fragment_cache``), counted
+    under the 'fragment' variant; setting ``environment.fragment_cache_enabled``
+    to False renders every fragment each time.
+    """
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=RenderCache(max_entries=4096),
+                           fragment_cache_enabled=True)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render_fragment', [nodes.List(args)]),
+                               [], [], body).set_lineno(lineno)
+
+    def _render_fragment(self, key, caller):
+        if not self.environment.fragment_cache_enabled:
+            return caller()
+        return self.environment.fragment_cache.get_or_render(tuple(key), 'fragment', 'text/html', caller).body
@@ -0,0 +1,207 @@
+import os
+import time
+import logging
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Callable, Hashable, Tuple
+from baxus_api import get_user_bar_data, bar_content_hash
+from bottle_dataset import get_catalog_version
+from models import Bottle, UserPreferences
+from recommendation_engine import (analyze_preferences, generate_recommendations,
+                                   generate_popular_recommendations, owned_bottle_ids,
+                                   rank_recommendations)
+from popularity_index import popular_rows
+from metrics import counter
+from resilience import DeadlineExceeded, has_budget, record_degraded
+from snapshot_store import snapshot_recommendations
+from structured_logging import log_enabled
+
+logger = logging.getLogger(__name__)
+
+# Personalized ranking is skipped for the popularity fallback with less time than this left
+RANKING_MIN_BUDGET = float(os.environ.get('BOB_RANKING_MIN_BUDGET', 0.25))
+
+USER_CACHE = counter('bob_user_cache_lookups_total', 'Per-user pipeline result cache lookups by stage',
+                     ('stage', 'result'))
+
+class UserResultCache:
+    """
+    Bounded LRU cache of pipeline stage results shared across requests.
+    
+    Entries are keyed on the pipeline's cache key (username, bar content hash,
+    catalog version), so a changed bar or catalog never serves a stale result.
+    Warmup jobs fill it ahead of traffic.
+    """
+    
+    def __init__(self, max_entries: int = 6000):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[Hashable, Any]' = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """Return (found, value) for a key"""
+        with self._lock:
+            if key not in self._entries:
+                return False, None
+            self._entries.move_to_end(key)
+            return True, self._entries[key]
+    
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+
+# Preferences and recommendations per (username, bar content, catalog version)
+user_cache = UserResultCache(max_entries=int(os.environ.get('BOB_USER_CACHE_MAX_ENTRIES', 6000)))
+
+class RecommendationContext:
+    """
+    Request-scoped view of the recommendation pipeline for a single user.
+
+    Each derived artifact (bar data, preferences, recommendations) is computed
+    at most once, and only when something actually reads it. A chat POST that
+    only needs the preference summary therefore never pays for the kNN search.
+
+    Personalized recommendations come from a fresh entry in the precomputed
+    snapshot (snapshot_store.py) when there is one and are ranked live
+    otherwise. When the request deadline is too close for a personalized
+    ranking, the popularity ranking for the user's preferences is used
+    instead; such degraded results are kept for this request only.
+    """
+
+    def __init__(self, username: Optional[str], num_recommendations: int = 5):
+        self.username = username
+        self.num_recommendations = num_recommendations
+        # Milliseconds spent in each stage that actually ran
+        self.timings: Dict[str, float] = {}
+        self._values: Dict[str, Any] = {}
+
+    def _stage(self, name: str, compute: Callable[[], Any], shared: bool = False) -> Any:
+        """
+        Compute a named stage once and remember both its value and its cost.
+        
+        Shared stages depend only on the cache key and the number of
+        recommendations, so their results are also looked up in and stored
+        into the cross-request user cache.
+        """
+        if name not in self._values:
+            start = time.perf_counter()
+            if shared:
+                key = (self.cache_key, name, self.num_recommendations)
+                found, value = user_cache.get(key)
+                USER_CACHE.inc(stage=name, result='hit' if found else 'miss')
+                if not found:
+                    value = compute()
+                    user_cache.put(key, value)
+                self._values[name] = value
+            else:
+                self._values[name] = compute()
+            self.timings[name] = (time.perf_counter() - start) * 1000
+        return self._values[name]
+
+    def _degrade(self, name: str, fallback: Callable[[], Any]) -> Any:
+        """Compute a stand-in for a stage that ran out of time, without sharing it"""
+        record_degraded('recommendations', 'deadline')
+        start = time.perf_counter()
+        self._values[name] = fallback()
+        self.timings[name] = (time.perf_counter() - start) * 1000
+        return self._values[name]
+
+    @staticmethod
+    def _within_budget(compute: Callable[[], Any]) -> Callable[[], Any]:
+        """Wrap a ranking stage so it doesn't start without RANKING_MIN_BUDGET left"""
+        def run():
+            if not has_budget(RANKING_MIN_BUDGET):
+                raise DeadlineExceeded("too little time left to rank")
+            return compute()
+        return run
+
+    @property
+    def user_data(self) -> Optional[Dict[str, Any]]:
+        """The user's bar data from the BAXUS API, or None without a username"""
+        if not self.username:
+            return None
+        return self._stage('user_data', lambda: get_user_bar_data(self.username))
+
+    @property
+    def has_collection(self) -> bool:
+        """Whether the user has a non-empty bar to analyze"""
+        user_data = self.user_data
+        return bool(user_data and 'bar' in user_data and user_data['bar'])
+
+    @property
+    def cache_key(self) -> Tuple[Optional[str], str, str]:
+        """Everything the user's recommendations depend on: user, bar content and catalog"""
+        if 'cache_key' not in self._values:
+            self._values['cache_key'] = (self.username, bar_content_hash(self.user_data),
+                                         get_catalog_version())
+        return self._values['cache_key']
+
+    @property
+    def preferences(self) -> Optional[UserPreferences]:
+        """Analyzed preferences, or None if the user has no collection"""
+        if not self.has_collection:
+            return None
+        return self._stage('preferences', lambda: analyze_preferences(self.user_data), shared=True)
+
+    @property
+    def recommendations(self) -> List[Bottle]:
+        """Personalized recommendations, or an empty list if the user has no collection"""
+        preferences = self.preferences
+        if preferences is None:
+            return []
+        rank = self._within_budget(lambda: generate_recommendations(
+            preferences, self.user_data, self.num_recommendations))
+        try:
+            return self._stage('recommendations', lambda: snapshot_recommendations(
+                self.username, preferences, self.user_data, self.num_recommendations) or rank(), shared=True)
+        except DeadlineExceeded:
+            return self._degrade('recommendations', lambda: generate_popular_recommendations(
+                preferences, self.user_data, self.num_recommendations))
+
+    @property
+    def popular_recommendations(self) -> List[Bottle]:
+        """Popularity-ranked recommendations for users without a usable collection"""
+        return self._stage('popular_recommendations', lambda: generate_popular_recommendations(
+            self.preferences, self.user_data, self.num_recommendations), shared=True)
+
+    def ranked_rows(self, limit: int) -> np.ndarray:
+        """Catalog row positions of the user's top recommendations, without materializing them"""
+        def rank():
+            preferences = self.preferences
+            if preferences is None:
+                return np.asarray(popular_rows(None, None, limit), dtype=np.int32)
+            return rank_recommendations(preferences, self.user_data, limit)
+        try:
+            return self._stage(f'ranked_rows_{limit}', self._within_budget(rank), shared=True)
+        except DeadlineExceeded:
+            return self._degrade(f'ranked_rows_{limit}', lambda: np.asarray(popular_rows(
+                self.preferences, owned_bottle_ids(self.user_data), limit), dtype=np.int32))
+
+    def computed(self, name: str) -> bool:
+        """Whether a stage has already been computed for this request"""
+        return name in self._values
+
+    def log_timings(self, route: str) -> None:
+        """Log the per-stage timings for the stages that ran in this request"""
+        if not self.timings:
+            return
+        if not log_enabled(logger, logging.INFO):
+            return
+        stages = ", ".join(f"{name}={ms:.1f}ms" for name, ms in self.timings.items())
+        skipped = [name for name in ('user_data', 'preferences', 'recommendations')
+                   if name not in self.timings]
+        logger.info("%s pipeline for %s: %s%s", route, self.username, stages,
+                    f" (skipped: {', '.join(skipped)})" if skipped else "",
+                    extra={'fields': {'route': route, 'username': self.username,
+                                      'stages_ms': {name: round(ms, 2) for name, ms in self.timings.items()}}})
@@ -0,0 +1,158 @@
+"""
+Request deadlines, degraded fallbacks and circuit breakers for upstreams.
+
+Every web request gets a deadline (BOB_REQUEST_DEADLINE seconds) bound to its
+context. Stages that wait on something ask how much time is left and cap
+their own timeouts with it: the BAXUS fetch, the OpenAI call and a ranking
+job in the process pool. A stage that runs out of time, or whose upstream is
+failing, falls back to a degraded answer instead of failing the request:
+
+    BAXUS bar        the last cached bar, even past its TTL
+    recommendations  popularity-ranked bottles for the user's preferences
+    chat             the cached or rule-based answer
+
+Degraded stages are recorded per request so the response can say so
+(X-Bob-Degraded) and isn't cached as if it were complete.
+
+Each upstream has a CircuitBreaker. After BOB_BREAKER_FAILURES consecutive
+failures it opens and callers skip the upstream for BOB_BREAKER_RESET
+seconds; then a single trial call decides whether it closes again. While it
+is open, requests go straight to the fallback instead of waiting out a
+timeout on a dead dependency.
+
+Outside a request (warmup, CLI jobs) there is no deadline, and stages wait
+for their own timeouts only.
+"""
+import os
+import time
+import logging
+import threading
+import contextvars
+from typing import List, Optional, Set, Tuple
+from metrics import counter
+
+logger = logging.getLogger(__name__)
+
+REQUEST_DEADLINE = float(os.environ.get('BOB_REQUEST_DEADLINE', 10.0))
+BREAKER_FAILURES = int(os.environ.get('BOB_BREAKER_FAILURES', 5))
+BREAKER_RESET = float(os.environ.get('BOB_BREAKER_RESET', 30.0))
+
+DEGRADED_RESPONSES = counter('bob_degraded_total', 'Stages answered with a degraded fallback by stage and reason',
+                             ('stage', 'reason'))
+BREAKER_EVENTS = counter('bob_circuit_breaker_events_total', 'Circuit breaker state changes and rejected calls',
+                         ('upstream', 'event'))
+
+class DeadlineExceeded(Exception):
+    """The request ran out of time before a stage could finish"""
+
+# (absolute time.monotonic() deadline, degraded stages) of the current request
+_request: contextvars.ContextVar[Optional[Tuple[float, Set[str]]]] = contextvars.ContextVar(
+    'request_deadline', default=None)
+
+def start_deadline(seconds: float = REQUEST_DEADLINE) -> contextvars.Token:
+    """Bind a deadline `seconds` from now to the current context; returns a token for reset_deadline"""
+    return _request.set((time.monotonic() + seconds, set()))
+
+def reset_deadline(token: contextvars.Token) -> None:
+    _request.reset(token)
+
+def remaining() -> Optional[float]:
+    """Seconds left until the current deadline, or None without one"""
+    state = _request.get()
+    return None if state is None else state[0] - time.monotonic()
+
+def stage_timeout(limit: float) -> float:
+    """
+    Timeout for a stage: its own limit, capped by the time left in the request.
+
+    Raises:
+        DeadlineExceeded: The deadline has already passed
+    """
+    left = remaining()
+    if left is None:
+        return limit
+    if left <= 0:
+        raise DeadlineExceeded("request deadline passed")
+    return min(limit, left)
+
+def has_budget(seconds: float) -> bool:
+    """Whether at least `seconds` are left (always true without a deadline)"""
+    left = remaining()
+    return left is None or left >= seconds
+
+def record_degraded(stage: str, reason: str) -> None:
+    """Note that a stage of the current request fell back to a degraded answer"""
+    DEGRADED_RESPONSES.inc(stage=stage, reason=reason)
+    logger.warning("Degraded %s (%s)", stage, reason, extra={'fields': {'stage': stage, 'reason': reason}})
+    state = _request.get()
+    if state is not None:
+        state[1].add(stage)
+
+def degraded_stages() -> List[str]:
+    """Stages of the current request that were degraded, sorted"""
+    state = _request.get()
+    return sorted(state[1]) if state is not None else []
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker for one upstream.
+
+    closed     calls go through; `failure_threshold` failures in a row open it
+    open       calls are rejected until `reset_timeout` seconds have passed
+    half_open  one trial call goes through; success closes, failure reopens
+    """
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURES,
+                 reset_timeout: float = BREAKER_RESET):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a call may go to the upstream now; rejected calls should use their fallback"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._transition('half_open')
+            if self.state == 'half_open' and not self._trial_running:
+                self._trial_running = True
+                return True
+        BREAKER_EVENTS.inc(upstream=self.name, event='rejected')
+        return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self._trial_running = False
+            if self.state != 'closed':
+                self._transition('closed')
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self._transition('open')
+
+    def _transition(self, state: str) -> None:
+        self.state = state
+        BREAKER_EVENTS.inc(upstream=self.name, event=state)
+        log = logger.warning if state == 'open' else logger.info
+        log(f"Circuit breaker for {self.name} is now {state}")
+
+    def reset(self) -> None:
+        """Close the breaker and forget failures (tests and benchmarks)"""
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._trial_running = False
+
+baxus_breaker = CircuitBreaker('baxus')
+openai_breaker = CircuitBreaker('openai')
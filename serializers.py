@@ -0,0 +1,63 @@
+import math
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, List, Sequence
+
+def json_safe(value: Any) -> Any:
+    """
+    Converts pipeline output into plain JSON-serializable Python values.
+    
+    Numpy scalars become Python numbers and NaN/inf become None, since the
+    catalog has missing prices and proofs that json.dumps would emit as NaN.
+    
+    Args:
+        value: A dict, list, record with to_dict(), scalar or numpy value
+        
+    Returns:
+        The same structure with only JSON-compatible values
+    """
+    if hasattr(value, 'to_dict'):
+        # Pipeline records (Bottle, UserPreferences)
+        value = value.to_dict()
+    if isinstance(value, dict):
+        return {str(key): json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_safe(item) for item in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+def serialize_columns(df: pd.DataFrame, rows: np.ndarray,
+                      fields: Sequence[str]) -> Dict[str, List[Any]]:
+    """
+    Extracts selected catalog rows as JSON-ready column lists.
+    
+    Each column is pulled as a typed numpy array and converted with a single
+    tolist() call, which is much cheaper than building a dict per row through
+    DataFrame.iloc[...].to_dict().
+    
+    Args:
+        df: The catalog
+        rows: Row positions to extract, in output order
+        fields: Catalog columns to include
+        
+    Returns:
+        Dictionary mapping each field to its list of values
+    """
+    columns = {}
+    for field in fields:
+        values = df[field].to_numpy()[rows]
+        column = values.tolist()
+        if values.dtype.kind in 'fO':
+            # NaN is not valid JSON; missing values become null
+            for i in np.flatnonzero(pd.isna(values)):
+                column[i] = None
+        columns[field] = column
+    return columns
+
+def records_from_columns(columns: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    """Turns column lists into a list of per-row objects"""
+    fields = list(columns)
+    return [dict(zip(fields, values)) for values in zip(*columns.values())]
@@ -0,0 +1,296 @@
+"""
+Precomputed bottle-to-bottle similarity graph for "more like this".
+
+The graph stores the top-K nearest catalog neighbors of every bottle in CSR
+form (int32 neighbor rows, float16 similarities), so a lookup is two array
+slices. It is built offline and rebuilt incrementally when the catalog changes:
+
+    python similarity_graph.py --k 10
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+from typing import List, Any, Optional, Tuple
+from sklearn.metrics.pairwise import euclidean_distances
+from sklearn.neighbors import NearestNeighbors
+from bottle_dataset import get_bottle_dataset, get_catalog_version, register_catalog_artifact, get_catalog_artifact
+from features import encode_bottle_features, min_max_scale
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_K = 10
+GRAPH_PATH = os.environ.get('BOB_SIMILARITY_GRAPH_PATH', 'data/similarity_graph.npz')
+
+# Rebuild from scratch instead of patching when more than this share of rows changed
+INCREMENTAL_MAX_CHANGED = 0.2
+
+# Rows per kneighbors() batch, bounding the distance matrix held in memory
+QUERY_BATCH = 4096
+
+class SimilarityGraph:
+    """
+    Top-K neighbor lists for every catalog row.
+
+    Attributes:
+        k: Neighbors per row
+        ids: Bottle id of each row
+        indptr: CSR row pointers, int32 of length n_rows + 1
+        indices: Neighbor row positions, int32
+        scores: Similarity 1 / (1 + distance), float16
+        row_hashes: Hash of each row's scaled features, used to detect changes
+        feature_columns: Feature space the graph was built in
+        feature_min, feature_spread: Scaling parameters of that feature space
+        catalog_version: Version of the catalog the graph was built from
+    """
+
+    def __init__(self, k: int, ids: np.ndarray, indptr: np.ndarray, indices: np.ndarray,
+                 scores: np.ndarray, row_hashes: np.ndarray, feature_columns: List[str],
+                 feature_min: np.ndarray, feature_spread: np.ndarray, catalog_version: str = ''):
+        self.k = k
+        self.ids = ids
+        self.indptr = indptr
+        self.indices = indices
+        self.scores = scores
+        self.row_hashes = row_hashes
+        self.feature_columns = list(feature_columns)
+        self.feature_min = feature_min
+        self.feature_spread = feature_spread
+        self.catalog_version = catalog_version
+        self._row_of_id = {bottle_id: row for row, bottle_id in enumerate(ids.tolist())}
+
+    def row_of(self, bottle_id: Any) -> Optional[int]:
+        """Row position of a bottle id, or None if it isn't in the graph"""
+        return self._row_of_id.get(bottle_id)
+
+    def neighbors(self, row: int, k: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Neighbor rows and similarity scores of a row, most similar first"""
+        start, end = self.indptr[row], self.indptr[row + 1]
+        if k is not None:
+            end = min(end, start + k)
+        return self.indices[start:end], self.scores[start:end]
+
+    def neighbor_ids(self, row: int) -> np.ndarray:
+        return self.ids[self.indices[self.indptr[row]:self.indptr[row + 1]]]
+
+    def save(self, path: str) -> None:
+        """Write the graph atomically, so readers never see a partial file"""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.tmp-{os.getpid()}.npz"
+        np.savez(tmp_path, k=self.k, ids=self.ids, indptr=self.indptr, indices=self.indices,
+                 scores=self.scores, row_hashes=self.row_hashes,
+                 feature_columns=np.array(self.feature_columns),
+                 feature_min=self.feature_min, feature_spread=self.feature_spread,
+                 catalog_version=self.catalog_version)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'SimilarityGraph':
+        with np.load(path, allow_pickle=False) as data:
+            return cls(int(data['k']), data['ids'], data['indptr'], data['indices'], data['scores'],
+                       data['row_hashes'], data['feature_columns'].tolist(),
+                       data['feature_min'], data['feature_spread'], str(data['catalog_version']))
+
+def _row_hashes(ids: np.ndarray, X: np.ndarray) -> np.ndarray:
+    """64-bit hash of each row's id and float32 features (wrapping uint64 arithmetic)"""
+    bits = np.ascontiguousarray(X, dtype=np.float32).view(np.uint32).astype(np.uint64)
+    with np.errstate(over='ignore'):
+        multipliers = np.uint64(0x9E3779B97F4A7C15) ** np.arange(1, bits.shape[1] + 1, dtype=np.uint64)
+        hashes = (bits * multipliers).sum(axis=1, dtype=np.uint64)
+        hashes ^= pd.util.hash_array(ids)
+    return hashes
+
+def _query(index: NearestNeighbors, X: np.ndarray, rows: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k neighbors (excluding the row itself) of the given rows, in batches"""
+    n_neighbors = min(k + 1, len(X))
+    all_rows = np.empty((len(rows), k), dtype=np.int32)
+    all_dist = np.full((len(rows), k), np.inf, dtype=np.float32)
+    for start in range(0, len(rows), QUERY_BATCH):
+        batch = rows[start:start + QUERY_BATCH]
+        distances, neighbors = index.kneighbors(X[batch], n_neighbors=n_neighbors)
+        for i, row in enumerate(batch):
+            keep = neighbors[i] != row
+            found = neighbors[i][keep][:k]
+            all_rows[start + i, :len(found)] = found
+            all_dist[start + i, :len(found)] = distances[i][keep][:k]
+            all_rows[start + i, len(found):] = -1
+    return all_rows, all_dist
+
+def _merge_unchanged(previous: SimilarityGraph, X: np.ndarray, old_rows: np.ndarray,
+                     changed_rows: np.ndarray, neighbor_rows: np.ndarray,
+                     distances: np.ndarray) -> np.ndarray:
+    """
+    Patches the neighbor lists of unchanged rows from the previous graph.
+
+    An unchanged row's new top-k can only be its old top-k or one of the
+    changed rows, so only those candidates are measured. Rows that lost one
+    of their old neighbors (changed or removed) can't be patched this way.
+
+    Returns:
+        Rows that need a full query: changed rows plus unpatchable rows
+    """
+    k = neighbor_rows.shape[1]
+    kept = np.flatnonzero(old_rows >= 0)
+    new_row_of_old = np.full(len(previous.ids), -1, dtype=np.int64)
+    new_row_of_old[old_rows[kept]] = kept
+
+    # Only rows that had a complete list are patchable
+    expected = min(k, len(previous.ids) - 1)
+    old_starts = previous.indptr[old_rows[kept]]
+    complete = (previous.indptr[old_rows[kept] + 1] - old_starts) == expected
+    old_neighbors = new_row_of_old[previous.indices[old_starts[complete, None] + np.arange(expected)]]
+    intact = (old_neighbors >= 0).all(axis=1)
+    patchable = kept[complete][intact]
+    old_neighbors = old_neighbors[intact]
+
+    # Bound the (batch x changed rows) distance matrix
+    batch_size = max(1, min(QUERY_BATCH, (1 << 22) // max(len(changed_rows), 1)))
+    for start in range(0, len(patchable), batch_size):
+        rows = patchable[start:start + batch_size]
+        candidates = old_neighbors[start:start + batch_size]
+        candidate_dist = np.sqrt(((X[candidates] - X[rows, None, :]) ** 2).sum(axis=2))
+        if len(changed_rows):
+            candidates = np.hstack([candidates, np.broadcast_to(changed_rows, (len(rows), len(changed_rows)))])
+            candidate_dist = np.hstack([candidate_dist, euclidean_distances(X[rows], X[changed_rows])])
+        candidate_dist = candidate_dist.astype(np.float32)
+        order = np.argsort(candidate_dist, axis=1, kind='stable')[:, :k]
+        neighbor_rows[rows, :order.shape[1]] = np.take_along_axis(candidates, order, axis=1)
+        distances[rows, :order.shape[1]] = np.take_along_axis(candidate_dist, order, axis=1)
+
+    unpatchable = np.setdiff1d(kept, patchable, assume_unique=True)
+    return np.union1d(changed_rows, unpatchable)
+
+def _to_csr(neighbor_rows: np.ndarray, distances: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    valid = neighbor_rows >= 0
+    indptr = np.zeros(len(neighbor_rows) + 1, dtype=np.int32)
+    np.cumsum(valid.sum(axis=1), out=indptr[1:])
+    indices = neighbor_rows[valid].astype(np.int32)
+    scores = (1.0 / (1.0 + distances[valid])).astype(np.float16)
+    return indptr, indices, scores
+
+def build_similarity_graph(df: pd.DataFrame, k: int = DEFAULT_K,
+                           previous: Optional[SimilarityGraph] = None,
+                           catalog_version: str = '') -> SimilarityGraph:
+    """
+    Builds the top-K similarity graph for a catalog.
+
+    With a previous graph built in the same feature space, only rows that are
+    new or changed are queried against the whole catalog; unchanged rows
+    merge their old neighbors with the changed rows, unless one of their
+    neighbors changed or disappeared, in which case they are requeried too.
+
+    Args:
+        df: The catalog
+        k: Neighbors per bottle
+        previous: Graph built from an earlier version of the catalog
+        catalog_version: Version recorded in the graph
+
+    Returns:
+        The similarity graph
+    """
+    started = time.perf_counter()
+    X_raw, feature_columns = encode_bottle_features(df)
+    ids = df['id'].to_numpy()
+    n_rows = len(df)
+
+    reusable = (previous is not None and previous.k == k
+                and previous.feature_columns == feature_columns)
+    if reusable:
+        # Keep the old scaling so unchanged rows keep identical coordinates
+        feature_min, feature_spread = previous.feature_min, previous.feature_spread
+        X = (X_raw - feature_min) / feature_spread
+        reusable = bool(((X >= 0) & (X <= 1)).all())
+    if not reusable:
+        X, feature_min, feature_spread = min_max_scale(X_raw)
+    X = X.astype(np.float32)
+    hashes = _row_hashes(ids, X)
+
+    index = NearestNeighbors(metric='euclidean').fit(X)
+    neighbor_rows = np.full((n_rows, k), -1, dtype=np.int32)
+    distances = np.full((n_rows, k), np.inf, dtype=np.float32)
+
+    if reusable:
+        old_row_by_hash = {h: row for row, h in enumerate(previous.row_hashes.tolist())}
+        old_rows = np.array([old_row_by_hash.get(h, -1) for h in hashes.tolist()], dtype=np.int64)
+        unchanged = old_rows >= 0
+        changed_rows = np.flatnonzero(~unchanged)
+        if len(changed_rows) > INCREMENTAL_MAX_CHANGED * n_rows:
+            reusable = False
+
+    if not reusable:
+        all_rows = np.arange(n_rows)
+        neighbor_rows[:], distances[:] = _query(index, X, all_rows, k)
+        mode = 'full'
+    else:
+        requery = _merge_unchanged(previous, X, old_rows, changed_rows, neighbor_rows, distances)
+        if len(requery):
+            neighbor_rows[requery], distances[requery] = _query(index, X, requery, k)
+        mode = f'incremental ({len(changed_rows)} changed, {len(requery)} requeried)'
+
+    indptr, indices, scores = _to_csr(neighbor_rows, distances)
+    logger.info(f"Built {mode} similarity graph for {n_rows} bottles (k={k}) "
+                f"in {time.perf_counter() - started:.2f}s")
+    return SimilarityGraph(k, ids, indptr, indices, scores, hashes, feature_columns,
+                           feature_min, feature_spread, catalog_version)
+
+def _load_or_build(df: pd.DataFrame) -> SimilarityGraph:
+    """Use the offline graph if it matches the catalog, else patch it in process"""
+    version = get_catalog_version()
+    previous = None
+    if os.path.exists(GRAPH_PATH):
+        try:
+            previous = SimilarityGraph.load(GRAPH_PATH)
+            if previous.catalog_version == version and len(previous.ids) == len(df):
+                return previous
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable similarity graph at {GRAPH_PATH}: {str(e)}")
+    return build_similarity_graph(df, previous.k if previous else DEFAULT_K, previous, version)
+
+# Not eager: the graph is only needed once someone asks for similar bottles
+register_catalog_artifact('similarity_graph', _load_or_build, eager=False)
+
+def get_similarity_graph() -> SimilarityGraph:
+    """The similarity graph for the currently loaded catalog"""
+    return get_catalog_artifact('similarity_graph')
+
+def similar_rows(bottle_id: Any, k: int = 5) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Looks up the most similar bottles to a bottle in O(1).
+
+    Args:
+        bottle_id: Id of the bottle
+        k: Maximum number of neighbors
+
+    Returns:
+        Tuple of (catalog row positions, float16 similarity scores); empty if
+        the bottle isn't in the catalog
+    """
+    graph = get_similarity_graph()
+    row = graph.row_of(bottle_id)
+    if row is None:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float16)
+    return graph.neighbors(row, k)
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Build the bottle similarity graph")
+    parser.add_argument('--k', type=int, default=DEFAULT_K, help="Neighbors per bottle")
+    parser.add_argument('--output', default=GRAPH_PATH)
+    parser.add_argument('--full', action='store_true', help="Ignore any existing graph")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    df = get_bottle_dataset()
+    previous = None
+    if not args.full and os.path.exists(args.output):
+        previous = SimilarityGraph.load(args.output)
+    graph = build_similarity_graph(df, args.k, previous, get_catalog_version())
+    graph.save(args.output)
+    print(f"Wrote similarity graph for {len(graph.ids)} bottles "
+          f"({graph.indices.nbytes + graph.scores.nbytes + graph.indptr.nbytes} bytes) to {args.output}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
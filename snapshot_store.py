@@ -0,0 +1,393 @@
+"""
+Precomputed recommendation snapshots, served from storage instead of ranked per request.
+
+For the largest customers, a batch scorer ranks every listed user ahead of
+time and writes one compact binary file per catalog version. A request maps
+the file, binary-searches the user's hash and renders the stored bottles;
+only users missing from the snapshot, or whose entry is no longer fresh, are
+ranked live.
+
+File layout (little endian):
+
+    header   magic b'BOBSNAP2', k, entry count, created_at, catalog version
+    keys     uint64[count], ascending hashes of the usernames
+    entries  count fixed-size records, in key order:
+                 bar_hash    uint64      hash of the bar content the entry was ranked for
+                 count       uint16      bottles stored (k, or fewer candidates)
+                 templates   uint16[k]   EXPLANATION_TEMPLATES ids per bottle, as a bitmask
+                 rows        int32[k]    catalog rows, best recommendation first
+                 scores      float32[k]  the scores they were ranked by
+
+Recommendations are stored as row positions in the catalog the snapshot was
+built for, not as bottle ids. Entries are only served for that catalog
+version, so the rows stay valid, whatever type the release ids have, and a
+bottle listed more than once keeps the listing it was ranked as.
+
+An entry is fresh when the snapshot was built for the loaded catalog, its bar
+hash matches the user's current bar and the snapshot is younger than
+BOB_SNAPSHOT_MAX_AGE seconds. Explanations are stored as template ids and
+rendered at serve time, so they read exactly like live ones.
+
+Each snapshot is written under a temporary name and renamed into place, then
+the CURRENT file naming the live snapshot is replaced the same way, so a
+reader sees the old version or the new one, never a partial file. Readers
+check CURRENT every BOB_SNAPSHOT_CHECK_INTERVAL seconds and remap when it has
+changed; a mapping still in use stays valid after its file is replaced.
+Every tenant deployment points BOB_SNAPSHOT_DIR at its own directory.
+
+Usage:
+    # Rank the users listed one per line (or a bar spool file) into a new snapshot
+    python snapshot_store.py build users.txt --concurrency 8 --rate 5
+    # Describe the live snapshot
+    python snapshot_store.py info
+"""
+import os
+import sys
+import mmap
+import time
+import struct
+import hashlib
+import logging
+import argparse
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Iterable, NamedTuple, Optional, Tuple
+from baxus_api import BAR_CACHE_TTL, bar_content_hash, cached_bar_age, get_user_bar_data
+from bottle_dataset import get_bottle_dataset, get_catalog_version
+from metrics import counter, timer
+from models import Bottle, UserPreferences
+from recommendation_engine import (EXPLANATION_TEMPLATES, analyze_preferences, explanation_template_ids,
+                                   is_sparse_profile, owned_bottle_ids, render_explanation,
+                                   score_collection)
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = os.environ.get('BOB_SNAPSHOT_DIR', 'data/snapshots')
+# Entries older than this are ranked live again
+SNAPSHOT_MAX_AGE = float(os.environ.get('BOB_SNAPSHOT_MAX_AGE', 86400))
+# Seconds between checks of CURRENT for a newer snapshot
+SNAPSHOT_CHECK_INTERVAL = float(os.environ.get('BOB_SNAPSHOT_CHECK_INTERVAL', 5))
+# Recommendations ranked per user; must match what the pages request, since
+# the kNN shortlist depends on it and other counts are ranked live
+SNAPSHOT_K = int(os.environ.get('BOB_SNAPSHOT_K', 5))
+
+SNAPSHOT_LOOKUPS = counter('bob_snapshot_lookups_total', 'Recommendation snapshot lookups by result',
+                           ('result',))
+
+MAGIC = b'BOBSNAP2'
+CURRENT_FILE = 'CURRENT'
+# magic, k, padding, entry count, created_at, catalog version
+HEADER = struct.Struct('<8sI4xQd32s')
+
+# Template ids are stored as a uint16 bitmask
+assert len(EXPLANATION_TEMPLATES) <= 16
+
+class SnapshotEntry(NamedTuple):
+    """One user's precomputed recommendations"""
+    # Catalog rows, in the catalog version the snapshot was built for
+    rows: np.ndarray
+    scores: np.ndarray
+    # Ascending EXPLANATION_TEMPLATES ids per bottle
+    template_ids: List[List[int]]
+
+def hash64(text: str) -> int:
+    """64-bit hash used for usernames and bar content hashes"""
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+
+def _entry_dtype(k: int) -> np.dtype:
+    return np.dtype([('bar_hash', '<u8'), ('count', '<u2'), ('templates', '<u2', (k,)),
+                     ('rows', '<i4', (k,)), ('scores', '<f4', (k,))])
+
+def _template_mask(template_ids: Iterable[int]) -> int:
+    return sum(1 << i for i in set(template_ids))
+
+def _template_ids(mask: int) -> List[int]:
+    return [i for i in range(len(EXPLANATION_TEMPLATES)) if mask >> i & 1]
+
+class Snapshot:
+    """A snapshot file mapped read-only; keys and entries are views into the mapping"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.k, count, self.created_at, version = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a recommendation snapshot")
+        self.catalog_version = version.rstrip(b'\0').decode()
+        self.keys = np.frombuffer(self._map, dtype='<u8', count=count, offset=HEADER.size)
+        self.entries = np.frombuffer(self._map, dtype=_entry_dtype(self.k), count=count,
+                                     offset=HEADER.size + self.keys.nbytes)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def find(self, user_hash: int) -> Optional[np.void]:
+        """The record for a username hash, or None"""
+        i = int(np.searchsorted(self.keys, np.uint64(user_hash)))
+        if i < len(self.keys) and int(self.keys[i]) == user_hash:
+            return self.entries[i]
+        return None
+
+class SnapshotStore:
+    """Reader of the live snapshot in a directory, following CURRENT as it is swapped"""
+
+    def __init__(self, directory: str = SNAPSHOT_DIR, max_age: float = SNAPSHOT_MAX_AGE,
+                 check_interval: float = SNAPSHOT_CHECK_INTERVAL):
+        self.directory = directory
+        self.max_age = max_age
+        self.check_interval = check_interval
+        self._snapshot: Optional[Snapshot] = None
+        self._pointer: Optional[Tuple[int, int, int]] = None
+        self._checked = float('-inf')
+        self._lock = threading.Lock()
+
+    def current(self) -> Optional[Snapshot]:
+        """The live snapshot, or None if there is none"""
+        now = time.monotonic()
+        if now - self._checked >= self.check_interval:
+            with self._lock:
+                if now - self._checked >= self.check_interval:
+                    self._checked = now
+                    self._reload()
+        return self._snapshot
+
+    def _reload(self) -> None:
+        """Map the snapshot named by CURRENT if CURRENT has been replaced"""
+        pointer = os.path.join(self.directory, CURRENT_FILE)
+        try:
+            stat = os.stat(pointer)
+        except FileNotFoundError:
+            self._snapshot, self._pointer = None, None
+            return
+        except OSError as e:
+            logger.warning(f"Could not check {pointer}: {str(e)}")
+            return
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if key == self._pointer:
+            return
+        try:
+            with open(pointer, encoding='utf-8') as f:
+                snapshot = Snapshot(os.path.join(self.directory, f.read().strip()))
+        except (OSError, ValueError, struct.error) as e:
+            # Keep serving the previous snapshot; CURRENT is checked again next interval
+            logger.warning(f"Could not open the snapshot named in {pointer}: {str(e)}")
+            return
+        self._snapshot, self._pointer = snapshot, key
+        logger.info(f"Serving snapshot {snapshot.path}: {len(snapshot)} users, "
+                    f"catalog {snapshot.catalog_version}")
+
+    def lookup(self, username: str, bar_hash: str, count: int) -> Optional[SnapshotEntry]:
+        """
+        A user's stored recommendations, if the live snapshot has a fresh entry
+        ranked for `count` bottles.
+
+        Args:
+            username: BAXUS username
+            bar_hash: Content hash of the user's current bar (bar_content_hash)
+            count: Number of recommendations wanted
+
+        Returns:
+            The entry, or None on a miss
+        """
+        snapshot = self.current()
+        if snapshot is None:
+            return None
+        if snapshot.k != count:
+            SNAPSHOT_LOOKUPS.inc(result='k_mismatch')
+            return None
+        record = snapshot.find(hash64(username))
+        if record is None:
+            SNAPSHOT_LOOKUPS.inc(result='miss')
+            return None
+        if (snapshot.catalog_version != get_catalog_version() or int(record['bar_hash']) != hash64(bar_hash)
+                or time.time() - snapshot.created_at > self.max_age):
+            SNAPSHOT_LOOKUPS.inc(result='stale')
+            return None
+        SNAPSHOT_LOOKUPS.inc(result='hit')
+        stored = int(record['count'])
+        return SnapshotEntry(record['rows'][:stored].copy(), record['scores'][:stored].copy(),
+                             [_template_ids(mask) for mask in record['templates'][:stored].tolist()])
+
+snapshot_store = SnapshotStore()
+
+@timer('snapshot_lookup')
+def snapshot_recommendations(username: Optional[str], preferences: Optional[UserPreferences],
+                             user_data: Optional[Dict[str, Any]],
+                             num_recommendations: int = 5) -> Optional[List[Bottle]]:
+    """
+    A user's recommendations from the live snapshot, rendered like live ones.
+
+    Args:
+        username: BAXUS username
+        preferences: Analyzed user preferences
+        user_data: Original user data from BAXUS API
+        num_recommendations: Number of recommendations wanted
+
+    Returns:
+        List of recommended bottles with explanations, or None on a miss
+    """
+    # Sparse profiles are never stored; the popularity index serves them cheaply anyway
+    if not username or is_sparse_profile(preferences):
+        return None
+    entry = snapshot_store.lookup(username, bar_content_hash(user_data), num_recommendations)
+    if entry is None:
+        return None
+    df = get_bottle_dataset()
+    if (entry.rows >= len(df)).any():
+        return None
+    recommendations = Bottle.from_catalog(df, entry.rows)
+    for bottle, template_ids in zip(recommendations, entry.template_ids):
+        bottle.explanation = render_explanation(template_ids, bottle, preferences, user_data)
+    return recommendations
+
+def _write_atomic(path: str, chunks: Iterable[bytes]) -> None:
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def write_snapshot(entries: Iterable[Tuple[str, str, SnapshotEntry]], catalog_version: str,
+                   k: int = SNAPSHOT_K, directory: str = SNAPSHOT_DIR) -> str:
+    """
+    Writes a snapshot for a catalog version and makes it the live one.
+
+    Args:
+        entries: (username, bar content hash, entry) per user; later entries
+            for the same user replace earlier ones
+        catalog_version: Catalog the entries were ranked against
+        k: Recommendations each entry was ranked for
+        directory: Snapshot directory
+
+    Returns:
+        Path of the written snapshot
+    """
+    version = catalog_version.encode('utf-8')
+    if len(version) > 32:
+        raise ValueError(f"Catalog version {catalog_version!r} is too long for a snapshot header")
+    by_user = {hash64(username): (hash64(bar_hash), entry) for username, bar_hash, entry in entries}
+    keys = np.array(sorted(by_user), dtype='<u8')
+    records = np.zeros(len(keys), dtype=_entry_dtype(k))
+    for i, key in enumerate(keys.tolist()):
+        bar_hash, entry = by_user[key]
+        count = min(k, len(entry.rows))
+        records['bar_hash'][i] = bar_hash
+        records['count'][i] = count
+        records['templates'][i, :count] = [_template_mask(ids) for ids in entry.template_ids[:count]]
+        records['rows'][i, :count] = entry.rows[:count]
+        records['scores'][i, :count] = entry.scores[:count]
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{catalog_version}.snap")
+    _write_atomic(path, (HEADER.pack(MAGIC, k, len(keys), time.time(), version),
+                         keys.tobytes(), records.tobytes()))
+    _write_atomic(os.path.join(directory, CURRENT_FILE), (os.path.basename(path).encode() + b'\n',))
+    return path
+
+def score_user(username: str, k: int = SNAPSHOT_K) -> Optional[Tuple[str, SnapshotEntry]]:
+    """
+    Ranks one user for a snapshot, exactly as a live in-process request would.
+
+    Returns:
+        (bar content hash, entry), or None for users without a bar or with a
+        sparse profile
+    """
+    user_data = get_user_bar_data(username)
+    if not user_data or not user_data.get('bar'):
+        return None
+    preferences = analyze_preferences(user_data)
+    if is_sparse_profile(preferences):
+        return None
+    rows, scores = score_collection(preferences, owned_bottle_ids(user_data), k)
+    df = get_bottle_dataset()
+    template_ids = [explanation_template_ids(bottle, preferences, user_data)
+                    for bottle in Bottle.from_catalog(df, rows)]
+    return bar_content_hash(user_data), SnapshotEntry(np.asarray(rows, dtype=np.int32), scores, template_ids)
+
+def build_snapshot(usernames: Iterable[str], k: int = SNAPSHOT_K, concurrency: int = 4,
+                   rate: float = 5.0, directory: str = SNAPSHOT_DIR) -> Tuple[str, Dict[str, int]]:
+    """
+    The batch scorer: ranks users with a bounded pool of worker threads and
+    writes the results as the live snapshot.
+
+    Args:
+        usernames: Users to rank (duplicates are skipped)
+        k: Recommendations ranked per user
+        concurrency: Maximum number of users processed at once
+        rate: Maximum BAXUS fetches per second (0 disables the limit)
+        directory: Snapshot directory
+
+    Returns:
+        Tuple of (snapshot path, counts of stored, skipped and failed users)
+    """
+    from warmup import RateLimiter
+    usernames = list(dict.fromkeys(u.strip() for u in usernames if u and u.strip()))
+    limiter = RateLimiter(rate)
+    catalog_version = get_catalog_version()
+    counts = {'stored': 0, 'skipped': 0, 'failed': 0}
+    entries: List[Tuple[str, str, SnapshotEntry]] = []
+    lock = threading.Lock()
+
+    def work(username: str) -> None:
+        age = cached_bar_age(username)
+        if age is None or age > BAR_CACHE_TTL:
+            limiter.acquire()
+        try:
+            scored = score_user(username, k)
+        except Exception:
+            logger.exception(f"Scoring failed for {username}")
+            scored, outcome = None, 'failed'
+        else:
+            outcome = 'stored' if scored is not None else 'skipped'
+        with lock:
+            counts[outcome] += 1
+            if scored is not None:
+                entries.append((username, *scored))
+
+    logger.info(f"Scoring {len(usernames)} users for catalog {catalog_version} with {concurrency} workers")
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='snapshot') as pool:
+        list(pool.map(work, usernames))
+    if get_catalog_version() != catalog_version:
+        raise RuntimeError("The catalog changed while scoring; run the build again")
+    return write_snapshot(entries, catalog_version, k, directory), counts
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Build and inspect recommendation snapshots")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help="Rank users into a new live snapshot")
+    build_parser.add_argument('users', help="File of usernames, one per line, or a bar spool file")
+    build_parser.add_argument('--k', type=int, default=SNAPSHOT_K)
+    build_parser.add_argument('--concurrency', type=int, default=4)
+    build_parser.add_argument('--rate', type=float, default=5.0, help="BAXUS fetches per second (0 for no limit)")
+    build_parser.add_argument('--directory', default=SNAPSHOT_DIR)
+
+    info_parser = subparsers.add_parser('info', help="Describe the live snapshot")
+    info_parser.add_argument('--directory', default=SNAPSHOT_DIR)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == 'build':
+        from warmup import load_usernames
+        started = time.perf_counter()
+        path, counts = build_snapshot(load_usernames(args.users), args.k, args.concurrency,
+                                      args.rate, args.directory)
+        print(f"Wrote {counts['stored']} users to {path} in {time.perf_counter() - started:.1f}s "
+              f"({counts['skipped']} without a bar or with a sparse profile, {counts['failed']} failed)")
+        return 1 if counts['failed'] else 0
+
+    snapshot = SnapshotStore(args.directory).current()
+    if snapshot is None:
+        print(f"No snapshot in {args.directory}")
+        return 1
+    print(f"{snapshot.path}: {len(snapshot)} users, k={snapshot.k}, catalog {snapshot.catalog_version}, "
+          f"{os.path.getsize(snapshot.path):,} bytes, {time.time() - snapshot.created_at:.0f}s old")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,215 @@
+"""
+Fingerprinted, precompressed static assets.
+
+Flask serves static/ uncompressed and asks browsers to revalidate every file
+on every page view. The build step copies each CSS, JS and image file to
+BOB_ASSET_DIR under a name carrying a hash of its contents
+(css/main.css -> css/main.3f2a1b9c0d.css), next to gzip and, with the brotli
+package installed, brotli versions. The manifest maps each source path to its
+fingerprinted name.
+
+Pages link assets through asset_url(), which points at the fingerprinted
+file. A changed file gets a new URL, so the response can be cached by
+browsers and CDNs for a year without revalidation. Before the first build,
+or for files outside the manifest, asset_url() falls back to the plain
+static URL.
+
+Usage:
+    # Build (or rebuild) the assets; the app also does this at start-up when
+    # the manifest is missing or older than the sources
+    python static_assets.py build
+"""
+import os
+import sys
+import json
+import gzip
+import time
+import hashlib
+import logging
+import argparse
+import mimetypes
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+try:
+    import brotli
+except ImportError:  # Optional: without it only gzip versions are built
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+ASSET_SOURCE_DIR = 'static'
+ASSET_DIR = os.environ.get('BOB_ASSET_DIR', 'data/assets')
+# Subdirectories of static/ holding page assets (static/data holds the catalog)
+ASSET_SUBDIRS = ('css', 'js', 'images', 'assets')
+# Only text formats compress; images other than SVG are already compressed
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.txt')
+# Precompressed files smaller than this share of the original are kept
+MIN_COMPRESSION_GAIN = 0.9
+MANIFEST_NAME = 'manifest.json'
+
+@dataclass(frozen=True)
+class Asset:
+    """A built asset"""
+    # Fingerprinted path relative to ASSET_DIR, e.g. 'css/main.3f2a1b9c0d.css'
+    path: str
+    content_hash: str
+    mimetype: str
+    # Byte sizes of each stored encoding ('identity', 'gzip', 'br')
+    sizes: Dict[str, int]
+
+    def encoded_path(self, encoding: str) -> str:
+        """Relative path of the file holding an encoding of this asset"""
+        return self.path + {'identity': '', 'gzip': '.gz', 'br': '.br'}[encoding]
+
+def _write_atomic(path: str, content: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+def _source_files(source_dir: str) -> List[str]:
+    """Asset paths relative to source_dir, sorted"""
+    files = []
+    for subdir in ASSET_SUBDIRS:
+        for root, _, names in os.walk(os.path.join(source_dir, subdir)):
+            for name in names:
+                files.append(os.path.relpath(os.path.join(root, name), source_dir).replace(os.sep, '/'))
+    return sorted(files)
+
+def build_assets(source_dir: str = ASSET_SOURCE_DIR, output_dir: str = ASSET_DIR) -> Dict[str, Asset]:
+    """
+    Fingerprints and precompresses every asset and writes the manifest.
+
+    Args:
+        source_dir: Directory holding the asset subdirectories
+        output_dir: Where the built files and manifest go
+
+    Returns:
+        Mapping of source path (e.g. 'css/main.css') to the built asset
+    """
+    started = time.perf_counter()
+    manifest: Dict[str, Asset] = {}
+    for name in _source_files(source_dir):
+        with open(os.path.join(source_dir, name), 'rb') as f:
+            content = f.read()
+        content_hash = hashlib.sha1(content).hexdigest()[:10]
+        stem, ext = os.path.splitext(name)
+        path = f"{stem}.{content_hash}{ext}"
+        mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        encodings = {'identity': content}
+        if ext.lower() in COMPRESSIBLE_EXTENSIONS:
+            # mtime=0 keeps the gzip output identical across builds
+            encodings['gzip'] = gzip.compress(content, compresslevel=9, mtime=0)
+            if brotli is not None:
+                encodings['br'] = brotli.compress(content, quality=11)
+        sizes = {}
+        asset = Asset(path, content_hash, mimetype, sizes)
+        for encoding, data in encodings.items():
+            if encoding != 'identity' and len(data) > len(content) * MIN_COMPRESSION_GAIN:
+                continue
+            target = os.path.join(output_dir, asset.encoded_path(encoding))
+            if not os.path.exists(target):
+                _write_atomic(target, data)
+            sizes[encoding] = len(data)
+        manifest[name] = asset
+
+    _write_atomic(os.path.join(output_dir, MANIFEST_NAME), json.dumps(
+        {name: {'path': a.path, 'hash': a.content_hash, 'mimetype': a.mimetype, 'sizes': a.sizes}
+         for name, a in manifest.items()}, indent=1, sort_keys=True).encode())
+    logger.info(f"Built {len(manifest)} static assets in {time.perf_counter() - started:.2f}s")
+    return manifest
+
+def load_manifest(output_dir: str = ASSET_DIR) -> Optional[Dict[str, Asset]]:
+    """The manifest of a previous build, or None if there is none"""
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME), encoding='utf-8') as f:
+            entries = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return {name: Asset(entry['path'], entry['hash'], entry['mimetype'], entry['sizes'])
+            for name, entry in entries.items()}
+
+def _manifest_is_stale(manifest: Dict[str, Asset], source_dir: str, output_dir: str) -> bool:
+    """Whether sources were added, removed or changed since the manifest was built"""
+    if set(manifest) != set(_source_files(source_dir)):
+        return True
+    built = os.path.getmtime(os.path.join(output_dir, MANIFEST_NAME))
+    return any(os.path.getmtime(os.path.join(source_dir, name)) > built for name in manifest)
+
+class AssetRegistry:
+    """The asset manifest used to build and serve asset URLs"""
+
+    def __init__(self, source_dir: str = ASSET_SOURCE_DIR, output_dir: str = ASSET_DIR):
+        self.source_dir = source_dir
+        self.output_dir = output_dir
+        self.assets: Dict[str, Asset] = {}
+        # Fingerprinted path -> asset, for serving
+        self.by_path: Dict[str, Asset] = {}
+        # Changes whenever any asset does; part of cached fragment keys
+        self.version = ''
+
+    def load(self, build: bool = True) -> None:
+        """
+        Loads the manifest, building the assets first if it is missing or stale.
+        A failed build leaves the plain static URLs in use.
+        """
+        manifest = load_manifest(self.output_dir)
+        try:
+            if build and (manifest is None or _manifest_is_stale(manifest, self.source_dir, self.output_dir)):
+                manifest = build_assets(self.source_dir, self.output_dir)
+        except OSError as e:
+            logger.warning(f"Could not build static assets in {self.output_dir}: {str(e)}")
+        self.assets = manifest or {}
+        self.by_path = {asset.path: asset for asset in self.assets.values()}
+        self.version = hashlib.sha1(''.join(sorted(a.path for a in self.assets.values())).encode()).hexdigest()[:10]
+
+    def lookup(self, filename: str) -> Optional[Asset]:
+        """The built asset of a source path such as 'css/main.css'"""
+        return self.assets.get(filename)
+
+    def resolve(self, path: str, accept_encodings) -> Optional[tuple]:
+        """
+        The file to send for a fingerprinted path, in the best encoding the client accepts.
+
+        Args:
+            path: Fingerprinted path relative to the asset directory
+            accept_encodings: The request's Accept-Encoding (werkzeug MIMEAccept-like,
+                where accept_encodings['gzip'] is the quality)
+
+        Returns:
+            Tuple of (asset, encoding, absolute file path), or None for unknown paths
+        """
+        asset = self.by_path.get(path)
+        if asset is None:
+            return None
+        encoding = 'identity'
+        for candidate in ('br', 'gzip'):
+            if candidate in asset.sizes and accept_encodings[candidate] > 0:
+                encoding = candidate
+                break
+        return asset, encoding, os.path.abspath(os.path.join(self.output_dir, asset.encoded_path(encoding)))
+
+asset_registry = AssetRegistry()
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Fingerprint and precompress static assets")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help="Build every asset and the manifest")
+    build_parser.add_argument('--source', default=ASSET_SOURCE_DIR)
+    build_parser.add_argument('--output', default=ASSET_DIR)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if brotli is None:
+        logger.warning("brotli is not installed; only gzip versions will be built")
+    manifest = build_assets(args.source, args.output)
+    for name, asset in manifest.items():
+        sizes = ', '.join(f"{encoding} {size}" for encoding, size in asset.sizes.items())
+        print(f"{name:<28} -> {asset.path:<36} {sizes}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,193 @@
+"""
+Logging setup: levels, JSON lines, per-logger sampling and request IDs.
+
+Configured from the environment by configure_logging():
+
+    BOB_LOG_LEVEL    Root level (default DEBUG with FLASK_DEBUG, INFO otherwise)
+    BOB_LOG_FORMAT   'text' (default) or 'json' for one JSON object per line
+    BOB_LOG_SAMPLE   Per-logger sampling of records below WARNING, e.g.
+                     'recommendation_engine=0.01,baxus_api=0.1'. Warnings and
+                     errors are always kept.
+
+Sampling is decided once per request and logger, so a sampled request keeps
+all of its records for that logger and can be followed from the BAXUS fetch
+through ranking to the OpenAI call by its request ID. Hot paths check
+log_enabled() before building anything to log, which also honors sampling,
+so an unsampled request pays for neither the message nor the record.
+
+Structured fields are passed with extra={'fields': {...}}: JSON lines carry
+them as top-level keys, text lines append them as key=value pairs.
+"""
+import os
+import json
+import uuid
+import zlib
+import random
+import logging
+import contextvars
+from typing import Dict, Any, List, Optional
+
+# ID of the request (or job) being served by the current thread
+_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar('request_id', default=None)
+
+# Logger name prefix -> share of sub-WARNING records kept
+_sample_rates: Dict[str, float] = {}
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+def set_request_id(request_id: Optional[str]) -> contextvars.Token:
+    """Bind a request ID to the current context; returns a token for reset_request_id"""
+    return _request_id.set(request_id)
+
+def reset_request_id(token: contextvars.Token) -> None:
+    _request_id.reset(token)
+
+def get_request_id() -> Optional[str]:
+    return _request_id.get()
+
+def _sample_rate(name: str) -> float:
+    """Sampling rate of the most specific configured prefix of a logger name"""
+    while True:
+        rate = _sample_rates.get(name)
+        if rate is not None:
+            return rate
+        if '.' not in name:
+            return 1.0
+        name = name.rsplit('.', 1)[0]
+
+def sampled(name: str) -> bool:
+    """Whether sub-WARNING records of a logger are kept for the current request"""
+    if not _sample_rates:
+        return True
+    rate = _sample_rate(name)
+    if rate >= 1:
+        return True
+    if rate <= 0:
+        return False
+    request_id = _request_id.get()
+    if request_id is None:
+        return random.random() < rate
+    # Same decision for every record of this request and logger
+    return zlib.crc32(f"{request_id}:{name}".encode()) < rate * 0xFFFFFFFF
+
+def log_enabled(logger: logging.Logger, level: int = logging.DEBUG) -> bool:
+    """
+    Hot-path guard: whether a record at this level would be emitted, counting
+    sampling. Check it before computing values that only feed a log call.
+    """
+    if not logger.isEnabledFor(level):
+        return False
+    return level >= logging.WARNING or sampled(logger.name)
+
+class RequestContextFilter(logging.Filter):
+    """Attaches the request ID to records and drops sub-WARNING records not sampled"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_id.get()
+        if record.levelno >= logging.WARNING:
+            return True
+        return sampled(record.name)
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            entry['request_id'] = request_id
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, separators=(',', ':'))
+
+class TextFormatter(logging.Formatter):
+    """The usual text layout, with the request ID and structured fields appended"""
+
+    def __init__(self):
+        super().__init__('%(levelname)s:%(name)s:%(message)s')
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        extras = []
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            extras.append(f"request_id={request_id}")
+        fields = getattr(record, 'fields', None)
+        if fields:
+            extras.extend(f"{key}={value}" for key, value in fields.items())
+        if not extras:
+            return line
+        # Keep tracebacks last
+        head, sep, tail = line.partition('\n')
+        return f"{head} [{' '.join(extras)}]{sep}{tail}"
+
+def parse_sample_rates(spec: str, malformed: Optional[List[str]] = None) -> Dict[str, float]:
+    """Parses 'logger=rate,...' into a dict, skipping malformed entries (appended to malformed if given)"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, value = item.partition('=')
+        try:
+            rates[name.strip()] = min(max(float(value), 0.0), 1.0)
+        except ValueError:
+            if malformed is not None:
+                malformed.append(item)
+    return rates
+
+def configure_logging(level: Optional[str] = None, log_format: Optional[str] = None,
+                      sample: Optional[str] = None, force: bool = False) -> None:
+    """
+    Sets up the root logger from the arguments or the BOB_LOG_* environment.
+
+    Like logging.basicConfig, an already configured root logger (a benchmark
+    or an embedding server) keeps its handlers and level unless force is set;
+    it only gains request IDs and sampling.
+
+    Args:
+        level: Level name; defaults to BOB_LOG_LEVEL, else DEBUG when
+            FLASK_DEBUG is on and INFO otherwise
+        log_format: 'text' or 'json'; defaults to BOB_LOG_FORMAT
+        sample: Sampling spec; defaults to BOB_LOG_SAMPLE
+        force: Replace existing root handlers
+    """
+    debug = os.environ.get('FLASK_DEBUG', 'True').lower() in ('true', '1', 't')
+    level = (level or os.environ.get('BOB_LOG_LEVEL') or ('DEBUG' if debug else 'INFO')).upper()
+    log_format = (log_format or os.environ.get('BOB_LOG_FORMAT', 'text')).lower()
+    malformed: List[str] = []
+    _sample_rates.clear()
+    _sample_rates.update(parse_sample_rates(sample if sample is not None
+                                            else os.environ.get('BOB_LOG_SAMPLE', ''), malformed))
+
+    root = logging.getLogger()
+    if root.handlers and not force:
+        for existing in root.handlers:
+            if not any(isinstance(f, RequestContextFilter) for f in existing.filters):
+                existing.addFilter(RequestContextFilter())
+        _warn_malformed(malformed)
+        return
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(JSONFormatter() if log_format == 'json' else TextFormatter())
+    handler.addFilter(RequestContextFilter())
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(getattr(logging, level, logging.INFO))
+    # Third-party request logging is noise at DEBUG
+    for name in ('urllib3', 'openai', 'httpx', 'httpcore'):
+        logging.getLogger(name).setLevel(max(root.level, logging.INFO))
+    _warn_malformed(malformed)
+
+def _warn_malformed(entries: List[str]) -> None:
+    """Report ignored BOB_LOG_SAMPLE entries through the configured handlers"""
+    if entries:
+        logging.getLogger(__name__).warning(
+            "Ignoring malformed BOB_LOG_SAMPLE entries: %s", ', '.join(f"'{item}'" for item in entries))
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from ann_index import IVFIndex
+from benchmarks.synthetic import generate_catalog
+from bottle_dataset import _load_bottle_dataset
+
+K = 10
+
+@pytest.fixture(scope='module')
+def index(tmp_path_factory):
+    path = tmp_path_factory.mktemp('catalog') / 'catalog.csv'
+    generate_catalog(5000, seed=3).to_csv(path, index=False)
+    return IVFIndex(_load_bottle_dataset(str(path)))
+
+@pytest.fixture(scope='module')
+def queries(index):
+    # Perturbed catalog vectors stand in for user preference vectors
+    rng = np.random.default_rng(0)
+    picked = index.vectors[rng.choice(len(index.vectors), 50, replace=False)]
+    return (picked + rng.normal(0, 0.05, picked.shape)).astype(np.float32)
+
+def exact_search(index, query, k, exclude_rows=None, price_range=None):
+    rows = np.arange(len(index.rows))
+    if exclude_rows is not None:
+        rows = rows[~np.isin(rows, exclude_rows)]
+    if price_range is not None:
+        msrp = index.msrp[np.argsort(index.rows)][rows]
+        rows = rows[(msrp >= price_range[0]) & (msrp <= price_range[1])]
+    distances = index.distances(query, rows)
+    return rows[np.argsort(distances, kind='stable')[:k]]
+
+def recall(index, queries, nprobe, **filters):
+    found = 0
+    for query in queries:
+        approximate, _ = index.search(query, K, nprobe=nprobe, **filters)
+        found += len(set(approximate.tolist()) & set(exact_search(index, query, K, **filters).tolist()))
+    return found / (K * len(queries))
+
+def test_default_probe_recalls_most_exact_neighbors(index, queries):
+    assert recall(index, queries, nprobe=16) >= 0.9
+
+def test_recall_grows_with_nprobe(index, queries):
+    recalls = [recall(index, queries, nprobe) for nprobe in (1, 4, 16)]
+    assert recalls == sorted(recalls)
+
+def test_probing_every_cell_is_exact(index, queries):
+    assert recall(index, queries, nprobe=index.num_cells) == 1.0
+
+def test_recall_holds_with_filters(index, queries):
+    excluded = np.arange(0, len(index.rows), 7)
+    assert recall(index, queries, nprobe=16, exclude_rows=excluded, price_range=(20.0, 150.0)) >= 0.85
+
+def test_results_respect_filters_and_order(index, queries):
+    excluded = np.arange(0, len(index.rows), 3)
+    rows, distances = index.search(queries[0], K, exclude_rows=excluded, price_range=(20.0, 150.0))
+    assert len(rows) == K
+    assert not np.isin(rows, excluded).any()
+    msrp = index.msrp[np.argsort(index.rows)][rows]
+    assert ((msrp >= 20.0) & (msrp <= 150.0)).all()
+    assert (np.diff(distances) >= 0).all()
+    np.testing.assert_allclose(distances, index.distances(queries[0], rows), rtol=1e-5)
+
+def test_narrow_filter_widens_the_probe(index, queries):
+    # Too few rows survive in the first cell alone
+    rows, _ = index.search(queries[0], K, nprobe=1, price_range=(20.0, 25.0))
+    assert len(rows) == K
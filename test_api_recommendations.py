@@ -0,0 +1,71 @@
+import pytest
+
+import app as web
+
+@pytest.fixture
+def client(seed_bar):
+    seed_bar('api-user')
+    return web.app.test_client()
+
+def get_json(client, query: str = '', username: str = 'api-user'):
+    response = client.get(f'/api/recommendations/{username}{query}')
+    assert response.status_code == 200, response.data
+    return response.get_json()
+
+def test_default_fields(client):
+    payload = get_json(client)
+    assert payload['fields'] == list(web.API_DEFAULT_FIELDS)
+    assert payload['personalized'] is True
+    assert len(payload['recommendations']) == 10
+    assert all(list(row) == list(web.API_DEFAULT_FIELDS) for row in payload['recommendations'])
+
+def test_fields_are_projected_in_the_order_asked(client):
+    payload = get_json(client, '?fields=name,id,value_score')
+    assert all(list(row) == ['name', 'id', 'value_score'] for row in payload['recommendations'])
+
+def test_pages_are_slices_of_one_ranking(client):
+    full = get_json(client, '?fields=id&limit=30')
+    pages = [get_json(client, f'?fields=id&limit=10&offset={offset}') for offset in (0, 10, 20)]
+    assert [row['id'] for page in pages for row in page['recommendations']] == \
+        [row['id'] for row in full['recommendations']]
+    assert {page['total'] for page in pages} == {web.API_MAX_RECOMMENDATIONS}
+
+def test_last_page_is_short(client):
+    payload = get_json(client, f'?fields=id&limit=10&offset={web.API_MAX_RECOMMENDATIONS - 4}')
+    assert len(payload['recommendations']) == 4
+
+def test_columns_layout_matches_rows(client):
+    rows = get_json(client, '?fields=id,name&limit=5')['recommendations']
+    columns = get_json(client, '?fields=id,name&limit=5&layout=columns')['columns']
+    assert columns == {'id': [row['id'] for row in rows], 'name': [row['name'] for row in rows]}
+
+@pytest.mark.parametrize('query', [
+    '?fields=id,password',
+    '?fields=',
+    '?limit=0',
+    f'?limit={web.API_MAX_PAGE_SIZE + 1}',
+    f'?offset={web.API_MAX_RECOMMENDATIONS}',
+    '?offset=-1',
+    '?limit=ten',
+    '?layout=table',
+])
+def test_invalid_parameters_are_rejected(client, query):
+    response = client.get(f'/api/recommendations/api-user{query}')
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'invalid_parameters'
+
+def test_unknown_field_is_named(client):
+    response = client.get('/api/recommendations/api-user?fields=id,password')
+    assert response.get_json()['unknown_fields'] == ['password']
+
+def test_user_without_a_bar_gets_popular_bottles(client):
+    payload = get_json(client, '?fields=id', username='no-bar-user')
+    assert payload['personalized'] is False
+    assert len(payload['recommendations']) == 10
+
+def test_page_answers_if_none_match_with_304(client):
+    etag = client.get('/api/recommendations/api-user?limit=5').headers['ETag']
+    response = client.get('/api/recommendations/api-user?limit=5', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    other_page = client.get('/api/recommendations/api-user?limit=5&offset=5', headers={'If-None-Match': etag})
+    assert other_page.status_code == 200
@@ -0,0 +1,72 @@
+import hashlib
+
+import pytest
+
+from bob_chat import ConversationCache, conversation_key, get_rule_based_response
+
+OPENING = "What's a good smoky Scotch?"
+REPLY = "Try Laphroaig 10."
+FOLLOW_UP = "What about under $40?"
+
+def turn(role: str, content: str):
+    return {"role": role, "content": content}
+
+def test_single_question_hashes_to_its_md5():
+    key, depth = conversation_key([turn("user", OPENING)])
+    assert key == hashlib.md5(OPENING.lower().encode()).hexdigest()
+    assert depth == 1
+
+def test_key_ignores_case_whitespace_and_system_turns():
+    key, _ = conversation_key([turn("user", OPENING)])
+    assert conversation_key([turn("system", "You are Bob."),
+                             turn("user", "  what's a GOOD   smoky scotch? ")]) == (key, 1)
+
+def test_follow_up_key_depends_on_the_whole_prefix():
+    first = [turn("user", OPENING), turn("assistant", REPLY), turn("user", FOLLOW_UP)]
+    other = [turn("user", "Recommend a bourbon"), turn("assistant", REPLY), turn("user", FOLLOW_UP)]
+    key, depth = conversation_key(first)
+    assert depth == 2
+    assert key != conversation_key([turn("user", FOLLOW_UP)])[0]
+    assert key != conversation_key(other)[0]
+
+def test_assistant_reply_is_part_of_the_prefix():
+    first = [turn("user", OPENING), turn("assistant", REPLY), turn("user", FOLLOW_UP)]
+    other = [turn("user", OPENING), turn("assistant", "Try Ardbeg."), turn("user", FOLLOW_UP)]
+    assert conversation_key(first)[0] != conversation_key(other)[0]
+
+def test_key_stops_at_the_last_user_message():
+    messages = [turn("user", OPENING), turn("assistant", REPLY)]
+    assert conversation_key(messages) == conversation_key(messages[:1])
+
+def test_conversation_without_a_user_message_has_no_key():
+    assert conversation_key([turn("system", "You are Bob."), turn("assistant", REPLY)]) == (None, 0)
+
+def test_pinned_conversation_is_served_turn_by_turn():
+    first, depth = conversation_key([turn("user", OPENING)])
+    follow_up, _ = conversation_key([turn("user", OPENING), turn("assistant", REPLY), turn("user", FOLLOW_UP)])
+    cache = ConversationCache()
+    cache.put(first, REPLY, pinned=True)
+    cache.put(follow_up, "Ardbeg Wee Beastie.", pinned=True)
+    assert cache.lookup(first, depth) == REPLY
+    assert cache.lookup(follow_up, 2) == "Ardbeg Wee Beastie."
+    assert cache.lookup(conversation_key([turn("user", FOLLOW_UP)])[0], 1) is None
+
+@pytest.mark.parametrize('message', [
+    "Is Laphroaig peated?",
+    "What are the whisky regions?",
+    "Where should I start?",
+    "What food pairs with Lagavulin?",
+    "What's on the nose of Talisker?",
+    "Best whisky under $50",
+])
+def test_topic_keywords_match_whole_words(message):
+    assert get_rule_based_response(message, catalog=False) is not None
+
+@pytest.mark.parametrize('message', [
+    "How do I repair a cork?",
+    "Tell me about the regional style of Speyside",
+    "I'm a nosey collector",
+    "Does Redbreast restart after a long finish?",
+])
+def test_topic_keywords_do_not_match_inside_words(message):
+    assert get_rule_based_response(message, catalog=False) is None
@@ -0,0 +1,83 @@
+import pytest
+
+import app as web
+from render_cache import RenderCache
+from resilience import start_deadline
+
+@pytest.fixture
+def client():
+    return web.app.test_client()
+
+def login(client, username: str) -> None:
+    with client.session_transaction() as session:
+        session['username'] = username
+
+def test_render_cache_renders_once_per_key_and_variant():
+    cache = RenderCache()
+    renders = []
+    def render():
+        renders.append(1)
+        return 'body'
+
+    first = cache.get_or_render(('alice', 'bar1', 'v1'), 'html', 'text/html', render)
+    again = cache.get_or_render(('alice', 'bar1', 'v1'), 'html', 'text/html', render)
+    cache.get_or_render(('alice', 'bar1', 'v1'), 'json', 'application/json', render)
+    assert again is first
+    assert len(renders) == 2
+    assert first.etag == RenderCache.etag_for(('alice', 'bar1', 'v1'), 'html')
+
+def test_etag_changes_with_the_key():
+    assert RenderCache.etag_for(('alice', 'bar1', 'v1'), 'html') != RenderCache.etag_for(('alice', 'bar2', 'v1'), 'html')
+    assert RenderCache.etag_for(('alice', 'bar1', 'v1'), 'html') != RenderCache.etag_for(('alice', 'bar1', 'v2'), 'html')
+
+def test_render_cache_evicts_least_recently_used():
+    cache = RenderCache(max_entries=2)
+    for key in ('a', 'b'):
+        cache.get_or_render(key, 'html', 'text/html', lambda: key)
+    cache.peek('a', 'html')
+    cache.get_or_render('c', 'html', 'text/html', lambda: 'c')
+    assert cache.peek('b', 'html') is None
+    assert cache.peek('a', 'html') is not None
+
+def test_recommendations_page_answers_if_none_match_with_304(client, seed_bar):
+    seed_bar('etag-user')
+    login(client, 'etag-user')
+    response = client.get('/recommendations')
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+
+    response = client.get('/recommendations', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+def test_new_bar_content_invalidates_the_etag(client, seed_bar):
+    seed_bar('changing-user', seed=1)
+    login(client, 'changing-user')
+    etag = client.get('/recommendations').headers['ETag']
+
+    seed_bar('changing-user', seed=2)
+    response = client.get('/recommendations', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+def test_json_and_html_have_different_etags(client, seed_bar):
+    seed_bar('variant-user')
+    login(client, 'variant-user')
+    html = client.get('/recommendations')
+    data = client.get('/recommendations?format=json')
+    assert data.mimetype == 'application/json'
+    assert html.headers['ETag'] != data.headers['ETag']
+
+def test_degraded_page_is_not_cached(client, seed_bar, monkeypatch):
+    seed_bar('degraded-page-user')
+    login(client, 'degraded-page-user')
+    # Requests start with no time left, so ranking falls back to popularity
+    monkeypatch.setattr(web, 'start_deadline', lambda: start_deadline(0.0))
+    degraded = client.get('/recommendations?format=json')
+    assert degraded.headers['X-Bob-Degraded'] == 'recommendations'
+
+    monkeypatch.setattr(web, 'start_deadline', start_deadline)
+    complete = client.get('/recommendations?format=json', headers={'If-None-Match': degraded.headers['ETag']})
+    assert complete.status_code == 200
+    assert 'X-Bob-Degraded' not in complete.headers
+    assert complete.headers['ETag'] != degraded.headers['ETag']
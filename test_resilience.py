@@ -0,0 +1,105 @@
+import time
+
+import pytest
+
+import baxus_api
+from recommendation_engine import generate_popular_recommendations
+from request_context import RecommendationContext, user_cache
+from resilience import (CircuitBreaker, DeadlineExceeded, baxus_breaker, degraded_stages,
+                        reset_deadline, stage_timeout, start_deadline)
+
+@pytest.fixture
+def deadline():
+    """Binds a request deadline `seconds` from now for the rest of the test"""
+    tokens = []
+    def start(seconds: float):
+        tokens.append(start_deadline(seconds))
+    yield start
+    for token in reversed(tokens):
+        reset_deadline(token)
+
+def test_stage_timeout_without_deadline_is_the_stage_limit():
+    assert stage_timeout(3.0) == 3.0
+
+def test_stage_timeout_is_capped_by_the_deadline(deadline):
+    deadline(1.0)
+    assert 0 < stage_timeout(3.0) <= 1.0
+    assert stage_timeout(0.5) == 0.5
+
+def test_stage_timeout_raises_once_the_deadline_passed(deadline):
+    deadline(-1.0)
+    with pytest.raises(DeadlineExceeded):
+        stage_timeout(3.0)
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+    breaker.record_success()
+    for _ in range(3):
+        breaker.record_failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+
+def test_breaker_lets_one_trial_through_after_the_reset_timeout():
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == 'half_open'
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    assert breaker.allow()
+
+def test_expired_bar_is_served_while_the_breaker_is_open(seed_bar, deadline):
+    user_data = seed_bar('breaker-user')
+    baxus_api.store_user_bar_data('breaker-user', user_data, fetched_at=time.time() - baxus_api.BAR_CACHE_TTL - 1)
+    for _ in range(baxus_breaker.failure_threshold):
+        baxus_breaker.record_failure()
+    deadline(10.0)
+
+    assert baxus_api.get_user_bar_data('breaker-user') is user_data
+    assert degraded_stages() == ['bar']
+
+def test_expired_bar_is_served_when_baxus_fails(seed_bar, deadline):
+    user_data = seed_bar('failing-baxus-user')
+    baxus_api.store_user_bar_data('failing-baxus-user', user_data,
+                                  fetched_at=time.time() - baxus_api.BAR_CACHE_TTL - 1)
+    deadline(10.0)
+
+    assert baxus_api.get_user_bar_data('failing-baxus-user') is user_data
+    assert baxus_breaker.failures == 1
+    assert degraded_stages() == ['bar']
+
+def test_recommendations_fall_back_to_popularity_near_the_deadline(seed_bar, deadline):
+    user_data = seed_bar('deadline-user')
+    pipeline = RecommendationContext('deadline-user')
+    preferences = pipeline.preferences
+    deadline(0.0)
+
+    recommendations = pipeline.recommendations
+    expected = generate_popular_recommendations(preferences, user_data, pipeline.num_recommendations)
+    assert [b.id for b in recommendations] == [b.id for b in expected]
+    assert degraded_stages() == ['recommendations']
+
+def test_degraded_recommendations_are_not_shared(seed_bar, deadline):
+    seed_bar('unshared-user')
+    deadline(0.0)
+    pipeline = RecommendationContext('unshared-user')
+    pipeline.recommendations
+    key = (pipeline.cache_key, 'recommendations', pipeline.num_recommendations)
+    assert user_cache.get(key) == (False, None)
+
+    deadline(10.0)
+    pipeline = RecommendationContext('unshared-user')
+    pipeline.recommendations
+    assert degraded_stages() == []
+    assert user_cache.get(key)[0]
@@ -0,0 +1,99 @@
+import time
+
+import numpy as np
+import pytest
+
+import snapshot_store
+from baxus_api import bar_content_hash
+from bottle_dataset import get_catalog_version
+from recommendation_engine import analyze_preferences, generate_recommendations
+from snapshot_store import (SNAPSHOT_LOOKUPS, Snapshot, SnapshotEntry, SnapshotStore, score_user,
+                            write_snapshot)
+
+K = 5
+
+def entry(first_row: int, count: int = K) -> SnapshotEntry:
+    rows = np.arange(first_row, first_row + count, dtype=np.int32)
+    scores = np.linspace(1.0, 0.5, count).astype(np.float32)
+    return SnapshotEntry(rows, scores, [[0, 2]] + [[1]] * (count - 1))
+
+@pytest.fixture
+def store(tmp_path):
+    return SnapshotStore(str(tmp_path), max_age=3600, check_interval=0)
+
+def lookups(result: str) -> float:
+    return SNAPSHOT_LOOKUPS.value(result=result)
+
+def test_round_trip(store):
+    write_snapshot([('alice', 'bar-a', entry(10)), ('bob', 'bar-b', entry(20, count=3))],
+                   get_catalog_version(), K, store.directory)
+
+    alice = store.lookup('alice', 'bar-a', K)
+    np.testing.assert_array_equal(alice.rows, entry(10).rows)
+    np.testing.assert_allclose(alice.scores, entry(10).scores)
+    assert alice.template_ids == entry(10).template_ids
+    # Users ranked fewer than k bottles keep only what they had
+    assert store.lookup('bob', 'bar-b', K).rows.tolist() == [20, 21, 22]
+
+def test_header_and_sorted_keys(tmp_path):
+    path = write_snapshot([(name, 'bar', entry(i)) for i, name in enumerate('fedcba')],
+                          'v-test', K, str(tmp_path))
+    snapshot = Snapshot(path)
+    assert (len(snapshot), snapshot.k, snapshot.catalog_version) == (6, K, 'v-test')
+    assert (np.diff(snapshot.keys.astype(np.float64)) > 0).all()
+
+def test_later_entry_for_a_user_replaces_the_earlier(store):
+    write_snapshot([('alice', 'old-bar', entry(10)), ('alice', 'new-bar', entry(30))],
+                   get_catalog_version(), K, store.directory)
+    assert store.lookup('alice', 'old-bar', K) is None
+    assert store.lookup('alice', 'new-bar', K).rows[0] == 30
+
+def test_miss_for_unknown_user(store):
+    write_snapshot([('alice', 'bar-a', entry(10))], get_catalog_version(), K, store.directory)
+    before = lookups('miss')
+    assert store.lookup('carol', 'bar-c', K) is None
+    assert lookups('miss') == before + 1
+
+def test_changed_bar_is_stale(store):
+    write_snapshot([('alice', 'bar-a', entry(10))], get_catalog_version(), K, store.directory)
+    before = lookups('stale')
+    assert store.lookup('alice', 'bar-a-with-a-new-bottle', K) is None
+    assert lookups('stale') == before + 1
+
+def test_other_catalog_version_is_stale(store):
+    write_snapshot([('alice', 'bar-a', entry(10))], 'an-older-catalog', K, store.directory)
+    assert store.lookup('alice', 'bar-a', K) is None
+
+def test_old_snapshot_is_stale(tmp_path):
+    write_snapshot([('alice', 'bar-a', entry(10))], get_catalog_version(), K, str(tmp_path))
+    time.sleep(0.02)
+    assert SnapshotStore(str(tmp_path), max_age=0.01, check_interval=0).lookup('alice', 'bar-a', K) is None
+
+def test_other_count_is_a_k_mismatch(store):
+    write_snapshot([('alice', 'bar-a', entry(10))], get_catalog_version(), K, store.directory)
+    before = lookups('k_mismatch')
+    assert store.lookup('alice', 'bar-a', K + 1) is None
+    assert lookups('k_mismatch') == before + 1
+
+def test_no_snapshot(store):
+    assert store.current() is None
+    assert store.lookup('alice', 'bar-a', K) is None
+
+def test_swapped_snapshot_is_picked_up(store):
+    write_snapshot([('alice', 'bar-a', entry(10))], get_catalog_version(), K, store.directory)
+    assert store.lookup('alice', 'bar-a', K).rows[0] == 10
+    write_snapshot([('alice', 'bar-a', entry(40))], get_catalog_version(), K, store.directory)
+    assert store.lookup('alice', 'bar-a', K).rows[0] == 40
+
+def test_stored_recommendations_match_live_ones(seed_bar, store, monkeypatch):
+    user_data = seed_bar('snapshot-user')
+    bar_hash, stored = score_user('snapshot-user', K)
+    assert bar_hash == bar_content_hash(user_data)
+    write_snapshot([('snapshot-user', bar_hash, stored)], get_catalog_version(), K, store.directory)
+    monkeypatch.setattr(snapshot_store, 'snapshot_store', store)
+
+    preferences = analyze_preferences(user_data)
+    live = generate_recommendations(preferences, user_data, K)
+    from_snapshot = snapshot_store.snapshot_recommendations('snapshot-user', preferences, user_data, K)
+    assert [b.id for b in from_snapshot] == [b.id for b in live]
+    assert [b.explanation for b in from_snapshot] == [b.explanation for b in live]
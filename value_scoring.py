@@ -0,0 +1,116 @@
+import logging
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Any, Optional
+from bottle_dataset import get_bottle_dataset, register_catalog_artifact, get_catalog_artifact
+from candidate_index import get_candidate_index
+
+logger = logging.getLogger(__name__)
+
+# Weight of each signal in the combined value score
+VALUE_WEIGHTS = {
+    'fair_value': 0.5,        # MSRP well below the fair market price
+    'score_per_dollar': 0.35, # Rating points per dollar of MSRP
+    'attainability': 0.15,    # Shelf price close to MSRP, so the deal is actually available
+}
+
+# A bottle counts as a deal when its MSRP is at most this fraction of its fair price
+DEAL_RATIO = 0.8
+
+class ValueScores:
+    """
+    Price/value signals for every catalog row, computed once per catalog version.
+
+    All signals are float32 column arrays aligned with the catalog rows, so
+    using them at request time is an index lookup rather than a recomputation.
+
+    Attributes:
+        price_to_fair: MSRP divided by fair price (below 1 means below fair value)
+        score_per_dollar: total_score divided by MSRP
+        shelf_markup: Shelf price over MSRP, minus one (0.5 means shelves charge 50% more)
+        value_score: Combined 0-1 score, higher is a better deal
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        msrp = _column(df, 'msrp')
+        fair_price = _column(df, 'fair_price')
+        shelf_price = _column(df, 'shelf_price')
+        total_score = _column(df, 'total_score')
+        valid_msrp = np.where(msrp > 0, msrp, np.nan)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.price_to_fair = (valid_msrp / np.where(fair_price > 0, fair_price, np.nan)).astype(np.float32)
+            self.score_per_dollar = (total_score / valid_msrp).astype(np.float32)
+            self.shelf_markup = (shelf_price / valid_msrp - 1).astype(np.float32)
+
+        signals = {
+            'fair_value': _percentile(-self.price_to_fair),
+            'score_per_dollar': _percentile(self.score_per_dollar),
+            'attainability': _percentile(-self.shelf_markup),
+        }
+        self.value_score = sum(VALUE_WEIGHTS[name] * values
+                               for name, values in signals.items()).astype(np.float32)
+        logger.debug("Scored value for %d bottles", len(df))
+
+    def columns(self, rows: np.ndarray) -> Dict[str, np.ndarray]:
+        """Value signals for the given catalog row positions"""
+        return {
+            'price_to_fair': self.price_to_fair[rows],
+            'score_per_dollar': self.score_per_dollar[rows],
+            'shelf_markup': self.shelf_markup[rows],
+            'value_score': self.value_score[rows],
+        }
+
+def _column(df: pd.DataFrame, name: str) -> np.ndarray:
+    if name not in df.columns:
+        return np.full(len(df), np.nan)
+    return pd.to_numeric(df[name], errors='coerce').to_numpy(dtype=float)
+
+def _percentile(values: np.ndarray) -> np.ndarray:
+    """Percentile rank in [0, 1]; missing values rank lowest"""
+    return pd.Series(values).rank(pct=True).fillna(0).to_numpy()
+
+register_catalog_artifact('value_scores', ValueScores)
+
+def get_value_scores() -> ValueScores:
+    """Value signals for the currently loaded catalog"""
+    return get_catalog_artifact('value_scores')
+
+def get_best_deals(limit: int = 10, min_price: Optional[float] = None,
+                   max_price: Optional[float] = None, spirit_type: Optional[str] = None,
+                   region: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Retrieves the best-value bottles, optionally within a price range or style.
+
+    Args:
+        limit: Maximum number of bottles to return
+        min_price: Optional minimum MSRP
+        max_price: Optional maximum MSRP
+        spirit_type: Optional spirit type to filter by
+        region: Optional region to filter by
+
+    Returns:
+        List of bottle dictionaries, best deal first, including the value signals
+    """
+    if limit <= 0:
+        return []
+    df = get_bottle_dataset()
+    scores = get_value_scores()
+
+    # Price window and style come from the MSRP-sorted partitions, not a full-catalog mask
+    rows = get_candidate_index().price_window(min_price, max_price, spirit_type, region)
+    rows = rows[~np.isnan(scores.price_to_fair[rows])]
+    if len(rows) > limit:
+        # Partial selection keeps this linear in the number of matching bottles
+        top = np.argpartition(-scores.value_score[rows], limit - 1)[:limit]
+        rows = rows[top]
+    rows = rows[np.argsort(-scores.value_score[rows], kind='stable')][:limit]
+
+    bottles = df.iloc[rows].astype(object)
+    bottles = bottles.where(bottles.notna(), None).to_dict('records')
+    signals = scores.columns(rows)
+    for i, bottle in enumerate(bottles):
+        for name, values in signals.items():
+            value = float(values[i])
+            bottle[name] = None if np.isnan(value) else round(value, 4)
+    return bottles
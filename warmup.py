@@ -0,0 +1,350 @@
+"""
+Background warmup of bars, preferences and recommendations for active users.
+
+The first page view of a user otherwise pays for the BAXUS fetch, the
+preference analysis and the kNN ranking. A warmup run takes a list of
+recently active usernames and, with a bounded pool of worker threads,
+fetches each bar through baxus_api and computes the user's preferences and
+recommendations into the shared user cache, so the first request only renders.
+
+Fetches from BAXUS are paced by a rate limit shared by all workers; users
+whose bar is still fresh in the bar cache are not fetched again.
+
+A warmed bar lives only as long as the bar cache keeps it fresh
+(BAXUS_BAR_CACHE_TTL, 300 s by default). A user who first visits later pays
+the BAXUS fetch again; their preferences and recommendations are keyed on
+bar content, so those still hit if the bar hasn't changed. Start a run no
+more than one TTL before the traffic it is meant for, and to hold a peak
+warm, repeat it every TTL (only expired bars are refetched) or raise
+BAXUS_BAR_CACHE_TTL for the window. A run of N users at R fetches/s takes
+about N/R seconds, so the first users' bars expire before it ends once N/R
+exceeds the TTL.
+
+The caches live in the app process, so the warmup has to run there: at
+start-up from BOB_WARMUP_USERS_FILE, or on demand through the app's
+POST /admin/warmup (enabled by setting BOB_WARMUP_TOKEN), which the command
+line below calls.
+
+Usage:
+    # Ask the running app to warm the users listed one per line (or a bar
+    # spool file) and report when it is done
+    python warmup.py users.txt --server http://localhost:5000 --concurrency 8 --rate 5
+
+    # Dry run in this process: measures warmup throughput against BAXUS but
+    # warms no server
+    python warmup.py users.txt --dry-run
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Any, Callable, Iterable, Optional
+from baxus_api import BAR_CACHE_TTL, cached_bar_age
+from request_context import RecommendationContext
+from metrics import counter
+from structured_logging import new_request_id, reset_request_id, set_request_id
+
+logger = logging.getLogger(__name__)
+
+WARMUP_CONCURRENCY = int(os.environ.get('BOB_WARMUP_CONCURRENCY', 4))
+# BAXUS bar requests per second across all workers
+WARMUP_RATE = float(os.environ.get('BOB_WARMUP_RATE', 5))
+WARMUP_USERS_FILE = os.environ.get('BOB_WARMUP_USERS_FILE')
+# Bearer token for /admin/warmup; the route is disabled while unset
+WARMUP_TOKEN = os.environ.get('BOB_WARMUP_TOKEN', '')
+WARMUP_SERVER = os.environ.get('BOB_WARMUP_SERVER', 'http://localhost:5000')
+
+WARMUP_USERS = counter('bob_warmup_users_total', 'Users processed by warmup runs by outcome', ('outcome',))
+
+class RateLimiter:
+    """
+    Token bucket shared by threads: at most `rate` acquisitions per second,
+    with bursts of up to `burst`. A rate of 0 or less disables the limit.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Block until a token is available; returns the seconds spent waiting"""
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+@dataclass
+class WarmupReport:
+    """Outcome of a warmup run"""
+    total: int = 0
+    # Users whose preferences and recommendations are now cached
+    warmed: int = 0
+    # Users without a bar (unknown user, empty bar or failed fetch)
+    no_bar: int = 0
+    failed: int = 0
+    # Bars fetched from BAXUS rather than served from the bar cache
+    fetched: int = 0
+    rate_limited_s: float = 0.0
+    elapsed_s: float = 0.0
+    errors: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def done(self) -> int:
+        return self.warmed + self.no_bar + self.failed
+
+    @property
+    def users_per_second(self) -> float:
+        return self.done / self.elapsed_s if self.elapsed_s else 0.0
+
+    def summary(self) -> str:
+        return (f"{self.done}/{self.total} users in {self.elapsed_s:.1f}s "
+                f"({self.users_per_second:.1f} users/s): {self.warmed} warmed, {self.no_bar} without bar, "
+                f"{self.failed} failed, {self.fetched} fetched from BAXUS, "
+                f"{self.rate_limited_s:.1f}s waiting on the rate limit")
+
+def warm_user(username: str, limiter: RateLimiter, num_recommendations: int = 5) -> Dict[str, Any]:
+    """
+    Fetches one user's bar and computes their preferences and recommendations
+    into the user cache.
+
+    Args:
+        username: BAXUS username
+        limiter: Rate limit for BAXUS fetches
+        num_recommendations: Must match what the pages request to be reused
+
+    Returns:
+        Dictionary with the outcome ('warmed' or 'no_bar'), whether the bar was
+        fetched and the seconds waited on the rate limit
+    """
+    age = cached_bar_age(username)
+    fetched = age is None or age > BAR_CACHE_TTL
+    waited = limiter.acquire() if fetched else 0.0
+
+    pipeline = RecommendationContext(username, num_recommendations)
+    if not pipeline.has_collection:
+        # Cold-start visitors get the popularity page; warm that instead
+        pipeline.popular_recommendations
+        return {'outcome': 'no_bar', 'fetched': fetched, 'waited': waited}
+    pipeline.preferences
+    pipeline.recommendations
+    return {'outcome': 'warmed', 'fetched': fetched, 'waited': waited}
+
+def warm_users(usernames: Iterable[str], concurrency: int = WARMUP_CONCURRENCY,
+               rate: float = WARMUP_RATE, num_recommendations: int = 5,
+               progress_interval: float = 10.0,
+               on_progress: Optional[Callable[[WarmupReport], None]] = None) -> WarmupReport:
+    """
+    Warms a list of users with a bounded pool of worker threads.
+
+    Threads rather than processes: the work is mostly waiting on BAXUS, and
+    the results have to land in this process's caches to be of any use.
+
+    Args:
+        usernames: Users to warm, most important first (duplicates are skipped)
+        concurrency: Maximum number of users processed at once
+        rate: Maximum BAXUS fetches per second (0 disables the limit)
+        num_recommendations: Recommendations per user, as the pages request them
+        progress_interval: Seconds between progress log lines
+        on_progress: Optional callback receiving the report after each user
+
+    Returns:
+        The final report
+    """
+    usernames = list(dict.fromkeys(u.strip() for u in usernames if u and u.strip()))
+    report = WarmupReport(total=len(usernames))
+    limiter = RateLimiter(rate)
+    lock = threading.Lock()
+    started = time.perf_counter()
+    last_logged = [started]
+
+    def work(username: str) -> None:
+        # Each user gets its own request ID, like a page view would
+        token = set_request_id(new_request_id())
+        try:
+            result = warm_user(username, limiter, num_recommendations)
+        except Exception as e:
+            logger.exception(f"Warmup failed for {username}")
+            result = {'outcome': 'failed', 'fetched': False, 'waited': 0.0, 'error': str(e)}
+        finally:
+            reset_request_id(token)
+        WARMUP_USERS.inc(outcome=result['outcome'])
+        with lock:
+            setattr(report, result['outcome'], getattr(report, result['outcome']) + 1)
+            report.fetched += result['fetched']
+            report.rate_limited_s += result['waited']
+            if 'error' in result:
+                report.errors[username] = result['error']
+            now = time.perf_counter()
+            report.elapsed_s = now - started
+            if now - last_logged[0] >= progress_interval:
+                last_logged[0] = now
+                logger.info(f"Warmup progress: {report.summary()}")
+            if on_progress is not None:
+                on_progress(report)
+
+    logger.info(f"Warming {report.total} users with {concurrency} workers at {rate:g} fetches/s")
+    if rate > 0 and report.total / rate > BAR_CACHE_TTL:
+        logger.warning(f"Warmup of {report.total} users at {rate:g} fetches/s takes over "
+                       f"{report.total / rate:.0f}s; bars warmed first expire after {BAR_CACHE_TTL:g}s")
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='warmup') as pool:
+        # Consume the iterator so worker exceptions can't go unnoticed
+        list(pool.map(work, usernames))
+    report.elapsed_s = time.perf_counter() - started
+    logger.info(f"Warmup finished: {report.summary()}")
+    return report
+
+def load_usernames(path: str) -> List[str]:
+    """
+    Reads usernames from a file: one per line, or JSON lines with a 'username'
+    key (such as the bar spool written by cooccurrence.py). Later lines are
+    more recent, so the result lists the most recent users first.
+    """
+    usernames = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('{'):
+                try:
+                    line = json.loads(line).get('username') or ''
+                except ValueError:
+                    logger.warning(f"Skipping malformed line in {path}")
+                    continue
+            if line:
+                usernames.append(line)
+    return list(dict.fromkeys(reversed(usernames)))
+
+# The latest background run, reported by warmup_status
+_background: Dict[str, Any] = {'thread': None, 'report': None}
+_background_lock = threading.Lock()
+
+def start_warmup_thread(usernames: Iterable[str], **kwargs) -> Optional[threading.Thread]:
+    """
+    Runs warm_users in a daemon thread so start-up isn't held up.
+
+    Returns:
+        The thread, or None if a background warmup is still running
+    """
+    usernames = list(usernames)
+    with _background_lock:
+        if _background['thread'] is not None and _background['thread'].is_alive():
+            return None
+        _background['report'] = WarmupReport(total=len(usernames))
+
+        def run() -> None:
+            warm_users(usernames, on_progress=lambda report: _background.update(report=report), **kwargs)
+
+        thread = threading.Thread(target=run, name='warmup', daemon=True)
+        _background['thread'] = thread
+        thread.start()
+    return thread
+
+def warmup_status() -> Dict[str, Any]:
+    """Whether a background warmup is running, and the report of the latest one"""
+    thread, report = _background['thread'], _background['report']
+    return {
+        'running': thread is not None and thread.is_alive(),
+        'report': None if report is None else {**asdict(report), 'done': report.done,
+                                               'summary': report.summary()},
+    }
+
+def start_configured_warmup() -> Optional[threading.Thread]:
+    """Starts a background warmup of BOB_WARMUP_USERS_FILE if it is set"""
+    if not WARMUP_USERS_FILE:
+        return None
+    try:
+        usernames = load_usernames(WARMUP_USERS_FILE)
+    except OSError as e:
+        logger.warning(f"Could not read warmup users from {WARMUP_USERS_FILE}: {str(e)}")
+        return None
+    return start_warmup_thread(usernames)
+
+def request_server_warmup(server: str, usernames: List[str], concurrency: int, rate: float,
+                          token: str = WARMUP_TOKEN, poll_interval: float = 5.0) -> Dict[str, Any]:
+    """
+    Starts a warmup in a running app through POST /admin/warmup and waits for it.
+
+    Args:
+        server: Base URL of the app
+        usernames: Users to warm, most important first
+        concurrency: Worker threads in the app
+        rate: BAXUS fetches per second in the app (0 for no limit)
+        token: The app's BOB_WARMUP_TOKEN
+        poll_interval: Seconds between progress checks
+
+    Returns:
+        The app's report of the finished run (see WarmupReport)
+
+    Raises:
+        requests.HTTPError: The app refused the warmup (bad token, one already running)
+    """
+    url = f"{server.rstrip('/')}/admin/warmup"
+    headers = {'Authorization': f"Bearer {token}"}
+    response = requests.post(url, headers=headers, timeout=30,
+                             json={'usernames': usernames, 'concurrency': concurrency, 'rate': rate})
+    response.raise_for_status()
+    while True:
+        time.sleep(poll_interval)
+        response = requests.get(url, headers=headers, timeout=30)
+        response.raise_for_status()
+        status = response.json()
+        if status['report']:
+            logger.info(f"Warmup progress: {status['report']['summary']}")
+        if not status['running']:
+            return status['report']
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Prefetch bars and precompute recommendations in the app")
+    parser.add_argument('users', help="File of usernames, one per line, or a bar spool file")
+    parser.add_argument('--server', default=WARMUP_SERVER,
+                        help="App to warm; the token is read from BOB_WARMUP_TOKEN")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="Warm this process instead of the app, to measure throughput")
+    parser.add_argument('--concurrency', type=int, default=WARMUP_CONCURRENCY)
+    parser.add_argument('--rate', type=float, default=WARMUP_RATE,
+                        help="BAXUS fetches per second (0 for no limit)")
+    parser.add_argument('--limit', type=int, default=None, help="Warm only the N most recent users")
+    parser.add_argument('--progress-interval', type=float, default=5.0)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    usernames = load_usernames(args.users)[:args.limit]
+    if args.dry_run:
+        report = warm_users(usernames, args.concurrency, args.rate,
+                            progress_interval=args.progress_interval)
+        print(f"Dry run (no server warmed): {report.summary()}")
+        return 1 if report.failed else 0
+
+    if not WARMUP_TOKEN:
+        parser.error("set BOB_WARMUP_TOKEN to the app's token, or pass --dry-run")
+    try:
+        report = request_server_warmup(args.server, usernames, args.concurrency, args.rate,
+                                       poll_interval=args.progress_interval)
+    except requests.RequestException as e:
+        logger.error(f"Warmup request to {args.server} failed: {str(e)}")
+        return 1
+    print(report['summary'])
+    return 1 if report['failed'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())